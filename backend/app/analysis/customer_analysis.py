@@ -1,85 +1,276 @@
+import os
+import time
+import logfire
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.metrics import silhouette_score
+from dataclasses import dataclass
+from typing import Dict, List, Literal, Optional, Tuple, Union
+
+from app.core.analysis_config import AnalysisConfig
+from app.schemas.core.enums import CustomerSegmentEnum
+from app.utils.preprocessing import PreparedOrders
+
+# Columns of the prepared orders that the customer KPIs are built from
+CUSTOMER_COLUMNS = [
+    'customer_phone', 'customer_name', 'invoice_no', 'total',
+    'item_quantity', 'date', 'DateOnly'
+]
+
+# KMeans restarts per k candidate during cluster count selection, each one budget-checked step
+SILHOUETTE_KMEANS_INITS = 3
+
+# Per-customer sufficient statistics; every KPI of the master table derives from these
+ADDITIVE_STAT_COLUMNS = ['total_spend', 'priced_orders', 'orders', 'items']
+STAT_AGGREGATIONS = {
+    'total_spend': 'sum',          # sum of deduplicated invoice totals
+    'priced_orders': 'sum',        # invoices with a known total (mean denominator)
+    'orders': 'sum',               # distinct invoices
+    'items': 'sum',                # item quantity
+    'last_order_date': 'max',
+    'first_order_date': 'min'
+}
+
+# "refit": fit from scratch, "warm_start": refit seeded with the previous
+# centroids, "predict": assign customers to the previous clusters as-is
+RFMClusteringMode = Literal["refit", "warm_start", "predict"]
+
+
+RFM_COLUMNS = ['Recency', 'Frequency', 'Monetary']
+QUINTILES = np.linspace(0, 1, 6)
+
+
+@dataclass
+class RFMScoreBoundaries:
+    """
+    Quintile edges of Recency, Frequency and Monetary over the customer base.
+
+    Scoring uses pd.qcut's right-closed bins via searchsorted, so any number
+    of customers can be scored in O(log n) each without the full customer set.
+    Values outside the fitted range fall into the outer quintiles. Frequency is
+    binned by value (tied customers share a score) rather than by row rank.
+    """
+    recency: np.ndarray
+    frequency: np.ndarray
+    monetary: np.ndarray
+
+    @classmethod
+    def fit(cls, rfm: pd.DataFrame) -> "RFMScoreBoundaries":
+        recency, frequency, monetary = (np.quantile(rfm[col].to_numpy(dtype=float), QUINTILES) for col in RFM_COLUMNS)
+        return cls(recency=recency, frequency=frequency, monetary=monetary)
+
+    @staticmethod
+    def _quintile(edges: np.ndarray, values) -> np.ndarray:
+        """0-based quintile; bin i holds edges[i] < x <= edges[i + 1]."""
+        return np.searchsorted(edges[1:-1], np.asarray(values, dtype=float), side='left')
+
+    def score(self, recency, frequency, monetary) -> pd.DataFrame:
+        """1-5 scores per customer (recent, frequent, high-spend customers score 5)."""
+        scores = pd.DataFrame({
+            'Recency_Score': 5 - self._quintile(self.recency, recency),
+            'Frequency_Score': 1 + self._quintile(self.frequency, frequency),
+            'Monetary_Score': 1 + self._quintile(self.monetary, monetary)
+        })
+        scores['RFM_Total_Score'] = scores.sum(axis=1)
+        return scores
+
+    def to_dict(self) -> Dict[str, List[float]]:
+        return {
+            "recency_days": [round(float(edge), 2) for edge in self.recency],
+            "frequency_orders": [round(float(edge), 2) for edge in self.frequency],
+            "monetary_spend": [round(float(edge), 2) for edge in self.monetary]
+        }
+
+
+@dataclass
+class RFMModel:
+    """
+    Fitted RFM segmentation: score quintile boundaries, the scaler over
+    log1p(R, F, M) and the clusterer on its output.
+    """
+    scaler: StandardScaler
+    kmeans: Union[KMeans, MiniBatchKMeans]
+    score_boundaries: RFMScoreBoundaries
 
-from app.utils.preprocessing import preprocess_raw_data
 
 class CustomerAnalyzer:
     
     def prepare_customer_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """
         Filters known customers and builds key date fields.
+        Delivery(Parcel) orders were already dropped during preprocessing.
         """
-        df_known = df[df['customer_phone'].notnull()].copy()
-        df_known = df_known[df_known['order_type'] != "Delivery(Parcel)"].copy()
+        known = df['customer_phone'].notnull().to_numpy()
+        df_known = df.take(np.flatnonzero(known))
         df_known['customer_phone'] = df_known['customer_phone'].astype(str)
 
-        df_known['date_only'] = df_known['date'].dt.date
-        df_known['date_dt'] = pd.to_datetime(df_known['date_only'])
+        df_known['date_dt'] = df_known['DateOnly']
         return df_known
 
-    def build_customer_kpis(self, df: pd.DataFrame) -> pd.DataFrame:
+    def compute_customer_stats(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
         """
-        Constructs customer-level KPIs such as total spend, orders, recency, tenure.
+        Builds the per-customer sufficient statistics (indexed by customer_phone)
+        and the (customer_phone, customer_name) occurrence counts.
+
+        Customers are integer-encoded once and all statistics come out of a
+        single grouped aggregation over those codes; invoice totals are
+        deduplicated by flagging rows rather than by a separate groupby.
         """
-        latest_date = df['date'].max()
+        # Sorted codes keep the statistics ordered by customer_phone
+        customer_codes, customer_phones = pd.factorize(df['customer_phone'], sort=True)
+
+        # Deduplicate invoice totals: each invoice counts once per customer,
+        # with its first non-null total
+        invoice_keys = pd.DataFrame({'customer': customer_codes, 'invoice_no': df['invoice_no'].to_numpy()})
+        is_new_invoice = ~invoice_keys.duplicated().to_numpy()
+        has_total = df['total'].notna().to_numpy()
+        first_total_row = np.zeros(len(df), dtype=bool)
+        first_total_row[has_total] = ~invoice_keys[has_total].duplicated().to_numpy()
+
+        keyed = pd.DataFrame({
+            'customer': customer_codes,
+            'invoice_total': df['total'].where(first_total_row).to_numpy(),
+            'new_invoice': is_new_invoice.astype(np.int64),
+            'item_quantity': df['item_quantity'].to_numpy(),
+            'date': df['date'].to_numpy(),
+            'date_dt': df['date_dt'].to_numpy()
+        })
+        stats = keyed.groupby('customer', sort=True).agg(
+            total_spend=('invoice_total', 'sum'),
+            priced_orders=('invoice_total', 'count'),
+            orders=('new_invoice', 'sum'),
+            items=('item_quantity', 'sum'),
+            last_order_date=('date', 'max'),
+            first_order_date=('date_dt', 'min')
+        )
+        stats.index = pd.Index(customer_phones, name='customer_phone')
 
-        # Deduplicate invoice totals
-        invoice_totals = df.groupby(['customer_phone', 'invoice_no'])['total'].first().reset_index()
+        return stats, self._count_customer_names(customer_codes, customer_phones, df['customer_name'])
 
-        # Total Spend
-        total_spend = invoice_totals.groupby('customer_phone')['total'].sum().reset_index(name='Total_Spend_By_Customer')
+    def _count_customer_names(self, customer_codes: np.ndarray, customer_phones: pd.Index, names: pd.Series) -> pd.Series:
+        """Occurrences of each (customer_phone, customer_name) pair; unnamed rows are skipped."""
+        if isinstance(names.dtype, pd.CategoricalDtype):
+            name_codes, name_values = names.cat.codes.to_numpy(), names.cat.categories
+        else:
+            name_codes, name_values = pd.factorize(names)
 
-        # Average Spend Per Order
-        avg_spend_order = invoice_totals.groupby('customer_phone')['total'].mean().reset_index(name='Average_Spend_Per_Order')
+        named = name_codes >= 0
+        pair_keys = customer_codes[named].astype(np.int64) * len(name_values) + name_codes[named]
+        pair_keys, pair_counts = np.unique(pair_keys, return_counts=True)
+        pair_customers, pair_names = np.divmod(pair_keys, max(len(name_values), 1))
 
-        # Total Orders Placed
-        order_count = invoice_totals.groupby('customer_phone')['invoice_no'].nunique().reset_index(name='Total_Orders_Placed')
+        index = pd.MultiIndex.from_arrays(
+            [
+                np.asarray(customer_phones, dtype=object)[pair_customers],
+                np.asarray(name_values, dtype=object)[pair_names]
+            ],
+            names=['customer_phone', 'customer_name']
+        )
+        return pd.Series(pair_counts.astype(np.int64), index=index, name='name_count')
 
-        # Total Items Ordered
-        item_count = df.groupby('customer_phone')['item_quantity'].sum().reset_index(name='Total_Items_Ordered')
+    def merge_customer_stats(self, *parts: pd.DataFrame) -> pd.DataFrame:
+        """Combines statistics of disjoint row sets (negated parts subtract)."""
+        return pd.concat(parts).groupby(level=0, sort=True).agg(STAT_AGGREGATIONS)
 
-        # Average Spend Per Item
-        avg_spend_item = total_spend.merge(item_count, on='customer_phone')
-        avg_spend_item['Average_Spend_Per_Item'] = avg_spend_item['Total_Spend_By_Customer'] / avg_spend_item['Total_Items_Ordered']
-        avg_spend_item = avg_spend_item[['customer_phone', 'Average_Spend_Per_Item']]
+    def fold_new_orders(
+        self,
+        history_df: pd.DataFrame,
+        new_df: pd.DataFrame,
+        customer_stats: pd.DataFrame,
+        name_counts: pd.Series
+    ) -> Tuple[pd.DataFrame, pd.Series]:
+        """
+        Merges newly ingested item rows into the persisted customer statistics.
 
-        # Recency
-        recency = df.groupby('customer_phone')['date'].max().reset_index()
-        recency['Days_Since_Last_Order'] = (latest_date - recency['date']).dt.days
+        Rows are only ever appended, so dates and name counts merge directly.
+        Invoice-level figures are exact too: invoices that already had rows in
+        `history_df` are recomputed from their old and new rows, and their old
+        contribution is subtracted.
+        """
+        new_known = self.prepare_customer_data(new_df)
+        if new_known.empty:
+            return customer_stats, name_counts
 
-        # Tenure
-        first_order = df.groupby('customer_phone')['date_dt'].min().reset_index(name='First_Order_Date')
-        first_order['Days_Since_First_Order'] = (latest_date - first_order['First_Order_Date']).dt.days
+        touched = history_df['invoice_no'].isin(new_known['invoice_no'].unique()).to_numpy()
+        previous = self.prepare_customer_data(history_df.take(np.flatnonzero(touched)))
 
-        # Frequent customer name for personalization
-        name_map = (
-            df.groupby('customer_phone')['customer_name']
-            .agg(lambda x: x.mode().iloc[0] if not x.mode().empty else 'Valued Customer')
-            .reset_index()
-        )
+        new_stats, new_name_counts = self.compute_customer_stats(new_known)
+        name_counts = name_counts.add(new_name_counts, fill_value=0).astype(np.int64)
+
+        if not len(previous):
+            return self.merge_customer_stats(customer_stats, new_stats), name_counts
+
+        touched_stats, _ = self.compute_customer_stats(pd.concat([previous, new_known], ignore_index=True))
+        previous_stats, _ = self.compute_customer_stats(previous)
+        previous_stats[ADDITIVE_STAT_COLUMNS] = -previous_stats[ADDITIVE_STAT_COLUMNS]
+
+        return self.merge_customer_stats(customer_stats, touched_stats, previous_stats), name_counts
+
+    def build_customer_kpis(
+        self,
+        df: Optional[pd.DataFrame] = None,
+        customer_stats: Optional[pd.DataFrame] = None,
+        name_counts: Optional[pd.Series] = None
+    ) -> pd.DataFrame:
+        """
+        Constructs customer-level KPIs such as total spend, orders, recency, tenure.
+        Either from known-customer rows `df`, or from persisted statistics, in
+        which case only recency and tenure depend on the new latest date.
+        """
+        if customer_stats is None:
+            customer_stats, name_counts = self.compute_customer_stats(df)
+
+        latest_date = customer_stats['last_order_date'].max()
 
         # Merge all into final KPI master
-        kpi_master = (
-            total_spend
-            .merge(avg_spend_order, on='customer_phone')
-            .merge(order_count, on='customer_phone')
-            .merge(avg_spend_item, on='customer_phone')
-            .merge(item_count, on='customer_phone')
-            .merge(recency[['customer_phone', 'Days_Since_Last_Order']], on='customer_phone')
-            .merge(first_order[['customer_phone', 'Days_Since_First_Order']], on='customer_phone')
-            .merge(name_map, on='customer_phone')
-        )
+        kpi_master = pd.DataFrame({
+            'customer_phone': customer_stats.index.to_numpy(),
+            'Total_Spend_By_Customer': customer_stats['total_spend'].to_numpy(),
+            'Average_Spend_Per_Order': (customer_stats['total_spend'] / customer_stats['priced_orders']).to_numpy(),
+            'Total_Orders_Placed': customer_stats['orders'].to_numpy(),
+            'Average_Spend_Per_Item': (customer_stats['total_spend'] / customer_stats['items']).to_numpy(),
+            'Total_Items_Ordered': customer_stats['items'].to_numpy(),
+            'Days_Since_Last_Order': (latest_date - customer_stats['last_order_date']).dt.days.to_numpy(),
+            'Days_Since_First_Order': (latest_date - customer_stats['first_order_date']).dt.days.to_numpy(),
+            # Frequent customer name for personalization
+            'customer_name': self._modal_customer_names(name_counts, customer_stats.index)
+        })
 
         return kpi_master
 
-    def perform_rfm_clustering(self, kpi_df: pd.DataFrame) -> pd.DataFrame:
+    def _modal_customer_names(self, name_counts: pd.Series, customer_phones: pd.Index) -> np.ndarray:
+        """
+        Most frequent name per customer, ties going to the alphabetically first
+        name (as Series.mode would), 'Valued Customer' when none is known.
+        """
+        counts = name_counts.reset_index()
+        top = (
+            counts.sort_values(['customer_phone', 'name_count', 'customer_name'], ascending=[True, False, True])
+            .drop_duplicates('customer_phone')
+            .set_index('customer_phone')['customer_name']
+        )
+        return top.reindex(customer_phones).fillna('Valued Customer').to_numpy(dtype=object)
+
+    def perform_rfm_clustering(
+        self,
+        kpi_df: pd.DataFrame,
+        previous_model: Optional[RFMModel] = None,
+        mode: RFMClusteringMode = "warm_start",
+        minibatch_min_customers: Optional[int] = None,
+        auto_k: bool = False,
+        config: Optional[AnalysisConfig] = None
+    ) -> Tuple[pd.DataFrame, RFMModel]:
         """
         Runs RFM scoring and K-Means clustering.
+        Returns the KPI master with a Cluster column and the model to persist
+        for the next run. Without a previous model every mode fits from scratch;
+        with `auto_k` such fits choose their cluster count by sampled silhouette.
         """
+        config = config or AnalysisConfig()
         rfm = kpi_df[[
             'customer_phone', 'Days_Since_Last_Order',
             'Total_Orders_Placed', 'Total_Spend_By_Customer'
@@ -89,38 +280,154 @@ class CustomerAnalyzer:
             'Total_Spend_By_Customer': 'Monetary'
         })
 
-        # RFM Scores
-        rfm['Recency_Score'] = pd.qcut(rfm['Recency'], 5, labels=[5,4,3,2,1], duplicates='drop')
-        rfm['Frequency_Score'] = pd.qcut(rfm['Frequency'].rank(method='first'), 5, labels=[1,2,3,4,5], duplicates='drop')
-        rfm['Monetary_Score'] = pd.qcut(rfm['Monetary'], 5, labels=[1,2,3,4,5], duplicates='drop')
-        rfm['RFM_Total_Score'] = rfm[['Recency_Score', 'Frequency_Score', 'Monetary_Score']].astype(int).sum(axis=1)
+        # RFM Scores, from boundaries kept with the model so customers can be re-scored later
+        if previous_model is not None and mode == "predict":
+            score_boundaries = previous_model.score_boundaries
+        else:
+            score_boundaries = RFMScoreBoundaries.fit(rfm)
+        scores = score_boundaries.score(rfm['Recency'], rfm['Frequency'], rfm['Monetary'])
+        rfm[list(scores.columns)] = scores.to_numpy()
+
+        # Log transform (plain array: the persisted scaler is applied to centroids too)
+        rfm_log = np.log1p(rfm[RFM_COLUMNS]).to_numpy()
 
-        # Log transform
-        rfm_log = np.log1p(rfm[['Recency', 'Frequency', 'Monetary']])
+        if previous_model is not None and mode == "predict":
+            model = previous_model
+            rfm['Cluster'] = model.kmeans.predict(model.scaler.transform(rfm_log))
+        else:
+            # Scale
+            scaler = StandardScaler()
+            rfm_scaled = scaler.fit_transform(rfm_log)
 
-        # Scale
-        scaler = StandardScaler()
-        rfm_scaled = scaler.fit_transform(rfm_log)
+            use_minibatch = minibatch_min_customers is not None and len(rfm) >= minibatch_min_customers
+            if previous_model is not None and mode == "warm_start":
+                # Carry the old centroids into the new scaling; one init is enough and keeps labels stable
+                init = scaler.transform(previous_model.scaler.inverse_transform(previous_model.kmeans.cluster_centers_))
+                kmeans = self._make_kmeans(len(init), init=init, n_init=1, minibatch=use_minibatch)
+            else:
+                optimal_k = self.select_cluster_count(rfm_scaled, config) if auto_k else config.rfm_default_k
+                kmeans = self._make_kmeans(optimal_k, init="k-means++", n_init=10, minibatch=use_minibatch)
 
-        # Optimal K using silhouette could be added here — we fix to 3 for stability
-        optimal_k = 3
-        kmeans = KMeans(n_clusters=optimal_k, random_state=42, n_init=10)
-        rfm['Cluster'] = kmeans.fit_predict(rfm_scaled)
+            rfm['Cluster'] = kmeans.fit_predict(rfm_scaled)
+            model = RFMModel(scaler=scaler, kmeans=kmeans, score_boundaries=score_boundaries)
 
         # Merge cluster back to master
         kpi_df = kpi_df.merge(rfm[['customer_phone', 'Cluster']], on='customer_phone')
+        return kpi_df, model
+
+    def select_cluster_count(self, rfm_scaled: np.ndarray, config: AnalysisConfig) -> int:
+        """
+        Picks k by silhouette score on a fixed-size random subsample, fitting
+        the candidate k values in parallel threads. Each candidate runs as
+        short steps (single-init KMeans fits, then one silhouette) that check
+        the time budget before starting, so work left over past the budget is
+        at most one step per thread. The best candidate finished within the
+        budget wins; a candidate that raises is logged and skipped, and the
+        default k is returned only if none finished with a score.
+        """
+        rng = np.random.default_rng(42)
+        if len(rfm_scaled) > config.rfm_silhouette_sample_size:
+            sample = rfm_scaled[rng.choice(len(rfm_scaled), config.rfm_silhouette_sample_size, replace=False)]
+        else:
+            sample = rfm_scaled
+
+        # Silhouette needs 2 <= k <= n_samples - 1
+        candidates = [k for k in config.rfm_k_candidates if 2 <= k < len(sample)]
+        if not candidates:
+            return config.rfm_default_k
+
+        deadline = time.monotonic() + config.rfm_k_selection_budget_seconds
+
+        def sampled_silhouette(k: int) -> Optional[float]:
+            best = None
+            for seed in range(SILHOUETTE_KMEANS_INITS):
+                if time.monotonic() >= deadline:
+                    return None
+                kmeans = KMeans(n_clusters=k, random_state=42 + seed, n_init=1).fit(sample)
+                if best is None or kmeans.inertia_ < best.inertia_:
+                    best = kmeans
+            if time.monotonic() >= deadline:
+                return None
+            return silhouette_score(sample, best.labels_)
+
+        executor = ThreadPoolExecutor(max_workers=min(len(candidates), os.cpu_count() or 1))
+        try:
+            futures = {executor.submit(sampled_silhouette, k): k for k in candidates}
+            done, _ = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+        finally:
+            # Never block past the budget; queued candidates are dropped and running ones stop after their current step
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        scores = {}
+        for future in done:
+            k = futures[future]
+            try:
+                score = future.result()
+            except Exception as e:
+                # e.g. silhouette rejects a fit whose labels collapsed into one cluster
+                logfire.warn("Skipping cluster count candidate", k=k, exc_info=e)
+                continue
+            if score is not None:
+                scores[k] = score
+        if not scores:
+            return config.rfm_default_k
+        return max(scores, key=lambda k: (scores[k], -k))
+
+    def assign_segments(self, kpi_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds a Segment column (CustomerSegmentEnum values): new customers first
+        ordered within 30 days, dormant ones have not ordered for over 60 days,
+        everyone else is active.
+        """
+        kpi_df['Segment'] = label_segments(kpi_df['Days_Since_First_Order'], kpi_df['Days_Since_Last_Order'])
         return kpi_df
 
+    def _make_kmeans(self, n_clusters: int, init, n_init: int, minibatch: bool) -> Union[KMeans, MiniBatchKMeans]:
+        """KMeans, or MiniBatchKMeans for very large customer bases."""
+        if minibatch:
+            return MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=n_init, random_state=42, batch_size=4096)
+        return KMeans(n_clusters=n_clusters, init=init, n_init=n_init, random_state=42)
+
+
+def label_segments(days_since_first_order: pd.Series, days_since_last_order: pd.Series) -> np.ndarray:
+    """CustomerSegmentEnum value per customer, as int8 (see CustomerAnalyzer.assign_segments)"""
+    is_new = days_since_first_order.to_numpy() <= 30
+    is_dormant = (days_since_last_order.to_numpy() > 60) & ~is_new
+    return np.select(
+        [is_new, is_dormant],
+        [CustomerSegmentEnum.NEW.value, CustomerSegmentEnum.DORMANT.value],
+        default=CustomerSegmentEnum.ACTIVE.value
+    ).astype(np.int8)
 
-def run_customer_analysis(df: pd.DataFrame):
 
-    df = preprocess_raw_data(df)
+def run_customer_analysis(
+    orders: PreparedOrders,
+    customer_stats: Optional[pd.DataFrame] = None,
+    name_counts: Optional[pd.Series] = None,
+    rfm_model: Optional[RFMModel] = None,
+    rfm_mode: RFMClusteringMode = "warm_start",
+    rfm_minibatch_min_customers: Optional[int] = None,
+    rfm_auto_k: bool = False,
+    config: Optional[AnalysisConfig] = None
+):
 
     analyzer = CustomerAnalyzer()
 
-    df_known = analyzer.prepare_customer_data(df)
-    customer_kpis = analyzer.build_customer_kpis(df_known)
-    customer_kpis = analyzer.perform_rfm_clustering(customer_kpis)
+    # Incremental runs pass in the persisted statistics instead of rescanning the rows
+    if customer_stats is None:
+        df_known = analyzer.prepare_customer_data(orders.select(CUSTOMER_COLUMNS))
+        customer_kpis = analyzer.build_customer_kpis(df_known)
+    else:
+        customer_kpis = analyzer.build_customer_kpis(customer_stats=customer_stats, name_counts=name_counts)
+    customer_kpis, rfm_model = analyzer.perform_rfm_clustering(
+        customer_kpis,
+        previous_model=rfm_model,
+        mode=rfm_mode,
+        minibatch_min_customers=rfm_minibatch_min_customers,
+        auto_k=rfm_auto_k,
+        config=config
+    )
+    customer_kpis = analyzer.assign_segments(customer_kpis)
 
-    return customer_kpis
+    return customer_kpis, rfm_model
 
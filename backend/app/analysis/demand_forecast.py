@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+from app.core.analysis_config import AnalysisConfig
+
+DAYS_PER_WEEK = 7
+
+# Baseline methods, in order of preference when their holdout errors tie
+FORECAST_METHODS = ('seasonal_naive', 'exponential_smoothing', 'weekly_seasonal')
+
+# Name of the program-wide series, appended after the items
+PROGRAM_TOTAL = '__program_total__'
+
+
+@dataclass(frozen=True)
+class DemandForecast:
+    """
+    Daily demand baselines (units) for every item plus the program total,
+    which is the last series. For each series the method with the lowest
+    mean absolute error on the holdout window is kept.
+    """
+    series: np.ndarray        # item names, then PROGRAM_TOTAL
+    start_date: pd.Timestamp  # first forecast day
+    daily: np.ndarray         # (series, horizon days)
+    method: np.ndarray        # index into FORECAST_METHODS, per series
+    holdout_mae: np.ndarray   # (series, method)
+
+    def weekly(self) -> np.ndarray:
+        """Forecast summed into consecutive weeks from start_date, shape (series, weeks)"""
+        n_series, n_days = self.daily.shape
+        return self.daily.reshape(n_series, n_days // DAYS_PER_WEEK, DAYS_PER_WEEK).sum(axis=2)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            'series': self.series.astype(str),
+            'start_date': np.array(self.start_date.to_datetime64()),
+            'daily': self.daily,
+            'method': self.method,
+            'holdout_mae': self.holdout_mae
+        }
+
+
+def daily_demand_matrix(daily_df: pd.DataFrame) -> Tuple[pd.Index, pd.DatetimeIndex, np.ndarray]:
+    """
+    Dense (item, day) matrix of units sold from the item x day performance,
+    with zeros on days an item did not sell.
+    """
+    item_codes, items = pd.factorize(daily_df['item_name'], sort=True)
+    days = pd.DatetimeIndex(daily_df['DateOnly'])
+    first_day = days.min()
+    day_codes = ((days - first_day) // pd.Timedelta(days=1)).to_numpy()
+
+    demand = np.zeros((len(items), day_codes.max() + 1), dtype=np.float64)
+    demand[item_codes, day_codes] = daily_df['quantity'].to_numpy(np.float64)
+    return pd.Index(items), pd.date_range(first_day, periods=demand.shape[1], freq='D'), demand
+
+
+def seasonal_naive(demand: np.ndarray, horizon: int) -> np.ndarray:
+    """Repeats each series' last observed week"""
+    demand = _pad_to_week(demand)
+    last_week = demand.shape[1] - DAYS_PER_WEEK
+    return demand[:, last_week + np.arange(horizon) % DAYS_PER_WEEK]
+
+
+def exponential_smoothing(demand: np.ndarray, horizon: int, alpha: float) -> np.ndarray:
+    """
+    Simple exponential smoothing with a flat forecast. The final level is a
+    fixed weighting of the history, so all series are smoothed with one
+    matrix-vector product instead of a loop over days.
+    """
+    n_days = demand.shape[1]
+    weights = alpha * (1 - alpha) ** np.arange(n_days - 1, -1, -1, dtype=np.float64)
+    weights[0] = (1 - alpha) ** (n_days - 1)
+    level = demand @ weights
+    return np.repeat(level[:, None], horizon, axis=1)
+
+
+def weekly_seasonal(demand: np.ndarray, horizon: int, alpha: float, season_weeks: int) -> np.ndarray:
+    """
+    Exponential smoothing of the series with additive weekday effects removed,
+    the effects being estimated over the last `season_weeks` weeks. Weekday
+    positions are relative to the last day, which is position 6.
+    """
+    demand = _pad_to_week(demand)
+    n_days = demand.shape[1]
+    window = min(n_days // DAYS_PER_WEEK, season_weeks) * DAYS_PER_WEEK
+
+    recent = demand[:, n_days - window:].reshape(len(demand), -1, DAYS_PER_WEEK)
+    effects = recent.mean(axis=1) - recent.mean(axis=(1, 2))[:, None]
+
+    positions = (np.arange(n_days) - n_days) % DAYS_PER_WEEK
+    level = exponential_smoothing(demand - effects[:, positions], 1, alpha)
+    forecast = level + effects[:, np.arange(horizon) % DAYS_PER_WEEK]
+    return np.clip(forecast, 0, None)
+
+
+def _pad_to_week(demand: np.ndarray) -> np.ndarray:
+    """Left-pads series shorter than a week with zeros"""
+    missing = DAYS_PER_WEEK - demand.shape[1]
+    return np.pad(demand, ((0, 0), (missing, 0))) if missing > 0 else demand
+
+
+def _forecast_all(demand: np.ndarray, horizon: int, config: AnalysisConfig) -> np.ndarray:
+    """Forecasts of every method, shape (method, series, horizon)"""
+    return np.stack([
+        seasonal_naive(demand, horizon),
+        exponential_smoothing(demand, horizon, config.forecast_smoothing_alpha),
+        weekly_seasonal(demand, horizon, config.forecast_smoothing_alpha, config.forecast_season_weeks)
+    ])
+
+
+def forecast_demand(daily_df: pd.DataFrame, config: AnalysisConfig) -> DemandForecast:
+    """
+    Baseline forecasts for the next `forecast_horizon_weeks` weeks of every
+    item and of the program as a whole, from the item x day performance.
+
+    Each method is backtested on the last `forecast_holdout_days` days and
+    the best one per series is refitted on the full history. Everything is
+    computed on the (series, day) matrix at once, so the cost grows with
+    items x days and not with a per-item loop.
+    """
+    items, dates, demand = daily_demand_matrix(daily_df)
+    demand = np.vstack([demand, demand.sum(axis=0)])
+    horizon = config.forecast_horizon_weeks * DAYS_PER_WEEK
+    holdout = config.forecast_holdout_days
+
+    if demand.shape[1] > holdout + DAYS_PER_WEEK:
+        backtest = _forecast_all(demand[:, :-holdout], holdout, config)
+        holdout_mae = np.abs(backtest - demand[:, -holdout:]).mean(axis=2).T
+        # argmin keeps the first (simplest) method on ties
+        method = holdout_mae.argmin(axis=1)
+    else:
+        # Too little history to backtest
+        holdout_mae = np.full((len(demand), len(FORECAST_METHODS)), np.nan)
+        method = np.full(len(demand), FORECAST_METHODS.index('exponential_smoothing'))
+
+    forecasts = _forecast_all(demand, horizon, config)
+    return DemandForecast(
+        series=np.append(np.asarray(items, dtype=object), PROGRAM_TOTAL),
+        start_date=dates[-1] + pd.Timedelta(days=1),
+        daily=forecasts[method, np.arange(len(demand))],
+        method=method,
+        holdout_mae=holdout_mae
+    )
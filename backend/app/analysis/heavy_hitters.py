@@ -0,0 +1,69 @@
+import numpy as np
+from typing import Dict, Hashable, Iterable, Iterator, Mapping, Tuple
+
+
+class PairHeavyHitters:
+    """
+    Fixed-memory heavy-hitters summary of item pair counts (Misra-Gries, in
+    the mergeable form of Agarwal et al.).
+
+    At most `capacity` pairs are tracked. Whenever a merged batch pushes the
+    summary past that, the (capacity + 1)-th largest count is subtracted from
+    every pair and non-positive ones are dropped. Estimates therefore never
+    overcount: for every pair, estimate <= true count <= estimate + error_bound,
+    and error_bound <= total / (capacity + 1). Any pair occurring in more than
+    error_bound invoices is guaranteed to be tracked.
+
+    Exposes the read side of a Counter (items, get, []), so it can stand in
+    for exact pair counts when building the co-occurrence matrix.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[Hashable, int] = {}
+        self.total = 0          # sum of all pair occurrences merged so far
+        self.error_bound = 0    # maximum undercount of any single pair
+
+    def update(self, batch_counts: Mapping[Hashable, int]) -> None:
+        """
+        Merges exact counts of one batch of invoices. Negative counts retract
+        earlier occurrences (e.g. an invoice re-sent with different items);
+        they only reduce pairs still being tracked.
+        """
+        for pair, count in batch_counts.items():
+            if count > 0:
+                self.counts[pair] = self.counts.get(pair, 0) + count
+                self.total += count
+            elif count < 0:
+                self.total += count
+                if pair in self.counts:
+                    remaining = self.counts[pair] + count
+                    if remaining > 0:
+                        self.counts[pair] = remaining
+                    else:
+                        del self.counts[pair]
+
+        if len(self.counts) > self.capacity:
+            self._compact()
+
+    def _compact(self) -> None:
+        values = np.fromiter(self.counts.values(), dtype=np.int64, count=len(self.counts))
+        # (capacity + 1)-th largest count
+        threshold = int(np.partition(values, len(values) - self.capacity - 1)[len(values) - self.capacity - 1])
+        self.counts = {pair: count - threshold for pair, count in self.counts.items() if count > threshold}
+        self.error_bound += threshold
+
+    def items(self) -> Iterator[Tuple[Hashable, int]]:
+        return iter(self.counts.items())
+
+    def get(self, pair: Hashable, default: int = 0) -> int:
+        return self.counts.get(pair, default)
+
+    def __getitem__(self, pair: Hashable) -> int:
+        return self.counts.get(pair, 0)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def most_common(self, n: int) -> Iterable[Tuple[Hashable, int]]:
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
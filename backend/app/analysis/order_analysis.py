@@ -1,9 +1,25 @@
+import numpy as np
 import pandas as pd
-from itertools import combinations
 from collections import Counter
+from scipy import sparse
 from pathlib import Path
+from typing import List, Optional, Tuple, Union
 
-from app.utils.preprocessing import preprocess_raw_data
+from app.analysis.heavy_hitters import PairHeavyHitters
+from app.core.analysis_config import AnalysisConfig
+from app.utils.preprocessing import PreparedOrders, concat_preprocessed
+
+# Columns of the prepared orders that the order KPIs are built from
+ORDER_COLUMNS = [
+    'invoice_no', 'item_name', 'date', 'item_quantity',
+    'discount', 'waived_off', 'net_sales'
+]
+
+
+RULE_COLUMNS = ['antecedent', 'consequent', 'count', 'support', 'confidence', 'lift']
+
+# Exact pair counts, or a bounded sketch of them on very large menus
+PairCounts = Union[Counter, PairHeavyHitters]
 
 
 class OrderAnalyzer:
@@ -42,45 +58,328 @@ class OrderAnalyzer:
         """
         Builds item co-occurrence matrix, filtered to top N most frequent items.
         Returns the symmetric matrix dataframe.
+
+        Only the top N item columns of the invoice x item indicator matrix are
+        built, and the pair counts come out of one sparse product XᵀX.
         """
-        # Group items by invoice
-        invoice_items = df.groupby('invoice_no')['item_name'].apply(list).reset_index()
-       
-        # Build pair counts
-        pair_counter = Counter()
-        for items in invoice_items['item_name']:
-            unique_items = list(set(items))
-            if len(unique_items) > 1:
-                pairs = combinations(sorted(unique_items), 2)
-                pair_counter.update(pairs)
-       
-        co_occurrence_df = pd.DataFrame(pair_counter.items(), columns=['item_pair', 'count'])
-        co_occurrence_df[['item_1', 'item_2']] = pd.DataFrame(co_occurrence_df['item_pair'].tolist(), index=co_occurrence_df.index)
-        co_occurrence_df.drop(columns='item_pair', inplace=True)
-       
-        # Build symmetric matrix
-        matrix_df = pd.pivot_table(
-            co_occurrence_df,
-            values='count',
-            index='item_1',
-            columns='item_2',
-            fill_value=0
+        top_items = self._top_items(df['item_name'].value_counts(), top_n)
+        indicator = self._invoice_item_indicator(df, top_items)
+        counts = (indicator.T @ indicator).toarray()
+        np.fill_diagonal(counts, 0)
+        return pd.DataFrame(counts, index=top_items, columns=top_items)
+
+    def count_item_pairs(self, df: pd.DataFrame) -> Counter:
+        """
+        Counts, for every unordered item pair, the number of invoices containing both.
+        Counts are additive over disjoint sets of invoices.
+        """
+        # Items sorted by name, so (item_1, item_2) pairs come out alphabetically ordered
+        items = pd.Index(np.sort(np.asarray(df['item_name'].dropna().unique(), dtype=object)))
+        indicator = self._invoice_item_indicator(df, items)
+        pair_counts = sparse.triu(indicator.T @ indicator, k=1).tocoo()
+
+        item_names = np.asarray(items, dtype=object)
+        return Counter(dict(zip(
+            zip(item_names[pair_counts.row], item_names[pair_counts.col]),
+            pair_counts.data.tolist()
+        )))
+
+    def count_item_pairs_bounded(self, df: pd.DataFrame, capacity: int, batch_invoices: int) -> PairHeavyHitters:
+        """
+        Approximate pair counts in fixed memory: invoices are streamed in
+        batches of `batch_invoices`, each batch is counted exactly and merged
+        into a heavy-hitters sketch that keeps at most `capacity` pairs.
+        """
+        sketch = PairHeavyHitters(capacity)
+        invoice_codes = pd.factorize(df['invoice_no'])[0]
+        batch_ids = invoice_codes // batch_invoices
+        order = np.argsort(batch_ids, kind='stable')
+        bounds = np.searchsorted(batch_ids[order], np.arange(batch_ids.max(initial=-1) + 2))
+
+        invoice_nos = df['invoice_no'].to_numpy()
+        item_names = df['item_name'].to_numpy()
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            rows = order[start:end]
+            batch = pd.DataFrame({'invoice_no': invoice_nos[rows], 'item_name': item_names[rows]})
+            sketch.update(self.count_item_pairs(batch))
+        return sketch
+
+    def build_pair_counts(self, df: pd.DataFrame, config: AnalysisConfig) -> PairCounts:
+        """Exact pair counts, or a bounded sketch once the menu exceeds `pair_sketch_min_distinct_items`."""
+        if self._use_pair_sketch(df['item_name'].nunique(), config):
+            return self.count_item_pairs_bounded(df, config.pair_sketch_capacity, config.pair_sketch_batch_invoices)
+        return self.count_item_pairs(df)
+
+    def _use_pair_sketch(self, distinct_items: int, config: AnalysisConfig) -> bool:
+        return distinct_items > config.pair_sketch_min_distinct_items
+
+    def count_items(self, df: pd.DataFrame) -> Counter:
+        """Counts item rows per item. Counts are additive over disjoint sets of rows."""
+        item_counts = df['item_name'].value_counts()
+        item_counts = item_counts[item_counts > 0]
+        return Counter(dict(zip(item_counts.index.tolist(), item_counts.tolist())))
+
+    def count_item_invoices(self, df: pd.DataFrame) -> Counter:
+        """Counts the invoices containing each item. Counts are additive over disjoint sets of invoices."""
+        keys = pd.DataFrame({'invoice_no': df['invoice_no'].to_numpy(), 'item_name': df['item_name'].to_numpy()})
+        item_counts = keys.drop_duplicates()['item_name'].value_counts()
+        return Counter(dict(zip(item_counts.index.tolist(), item_counts.tolist())))
+
+    def rank_items(self, item_counter: Counter) -> pd.Series:
+        """Persisted item counts as a Series, most frequent first (ties by name)."""
+        item_counts = pd.Series(item_counter, dtype=np.int64, name='count')
+        order = np.lexsort((item_counts.index.to_numpy(dtype=object).astype(str), -item_counts.to_numpy()))
+        return item_counts.iloc[order]
+
+    def build_cooccurrence_matrix(self, pair_counter: PairCounts, item_counts: pd.Series, top_n: int = 30) -> pd.DataFrame:
+        """
+        Builds the symmetric co-occurrence matrix from pair counts, restricted
+        to the top N items of `item_counts` (item -> number of item rows).
+        """
+        top_items = self._top_items(item_counts, top_n)
+        position = {item: i for i, item in enumerate(top_items)}
+
+        counts = np.zeros((len(top_items), len(top_items)), dtype=np.int64)
+        for (item_1, item_2), count in pair_counter.items():
+            i, j = position.get(item_1), position.get(item_2)
+            if i is not None and j is not None:
+                counts[i, j] = counts[j, i] = count
+        return pd.DataFrame(counts, index=top_items, columns=top_items)
+
+    def mine_association_rules(self, df: pd.DataFrame, config: AnalysisConfig, max_itemset_size: int = 2) -> pd.DataFrame:
+        """
+        Apriori-style association rules over invoices, with support, confidence
+        and lift.
+
+        Items in fewer than `min_item_support` invoices are pruned before any
+        pair is counted, and itemsets below `min_pair_support` invoices are
+        dropped. With `max_itemset_size=3`, 3-item sets are only built from
+        frequent pairs among the `top_n_items` best supported items, so the
+        cost stays bounded on large menus.
+
+        Returns one row per rule (antecedent -> consequent), strongest lift first.
+        """
+        items = pd.Index(np.sort(np.asarray(df['item_name'].dropna().unique(), dtype=object)))
+        indicator = self._invoice_item_indicator(df, items)
+        n_invoices = indicator.shape[0]
+        if n_invoices == 0:
+            return pd.DataFrame(columns=RULE_COLUMNS)
+
+        # Prune infrequent items before counting any pair
+        item_support = np.asarray(indicator.sum(axis=0)).ravel()
+        frequent = np.flatnonzero(item_support >= config.min_item_support)
+        indicator = indicator[:, frequent].tocsc()
+        item_names = np.asarray(items, dtype=object)[frequent]
+        item_support = item_support[frequent]
+
+        pair_counts = sparse.triu(indicator.T @ indicator, k=1).tocoo()
+        kept = pair_counts.data >= config.min_pair_support
+        pairs = dict(sorted(
+            zip(zip(pair_counts.row[kept].tolist(), pair_counts.col[kept].tolist()), pair_counts.data[kept].tolist())
+        ))
+
+        triples = self._count_item_triples(indicator, item_support, pairs, config) if max_itemset_size >= 3 else {}
+        return self._build_rules(pairs, triples, item_names, item_support, n_invoices)
+
+    def association_rules_from_counts(
+        self,
+        pair_counter: PairCounts,
+        item_invoice_counter: Counter,
+        n_invoices: int,
+        config: AnalysisConfig
+    ) -> pd.DataFrame:
+        """
+        Pair rules (one item -> one item) from persisted counts, with the same
+        pruning and measures as mine_association_rules at max_itemset_size=2
+        but without touching any item rows. With a pair sketch the counts,
+        and so support and confidence, are lower bounds.
+        """
+        item_support = pd.Series(item_invoice_counter, dtype=np.int64)
+        item_support = item_support[item_support >= config.min_item_support].sort_index()
+        if n_invoices == 0 or item_support.empty:
+            return pd.DataFrame(columns=RULE_COLUMNS)
+
+        item_names = item_support.index.to_numpy(dtype=object)
+        position = {item: i for i, item in enumerate(item_names)}
+        pairs = {}
+        for (item_1, item_2), count in pair_counter.items():
+            i, j = position.get(item_1), position.get(item_2)
+            if count >= config.min_pair_support and i is not None and j is not None:
+                pairs[(min(i, j), max(i, j))] = count
+
+        return self._build_rules(dict(sorted(pairs.items())), {}, item_names, item_support.to_numpy(), n_invoices)
+
+    def _build_rules(
+        self,
+        pairs: dict,
+        triples: dict,
+        item_names: np.ndarray,
+        item_support: np.ndarray,
+        n_invoices: int
+    ) -> pd.DataFrame:
+        """Rules with support, confidence and lift from frequent pair and triple counts (keyed by item indices)."""
+        # (antecedent item indices, consequent item index, itemset invoice count)
+        candidates: List[Tuple[Tuple[int, ...], int, int]] = []
+        for (i, j), count in pairs.items():
+            candidates += [((i,), j, count), ((j,), i, count)]
+
+        for itemset, count in triples.items():
+            for consequent in itemset:
+                antecedent = tuple(k for k in itemset if k != consequent)
+                candidates.append((antecedent, consequent, count))
+
+        if not candidates:
+            return pd.DataFrame(columns=RULE_COLUMNS)
+
+        antecedent_support = np.array([
+            item_support[a[0]] if len(a) == 1 else pairs[a] for a, _, _ in candidates
+        ], dtype=np.float64)
+        consequent_support = item_support[[c for _, c, _ in candidates]].astype(np.float64)
+        counts = np.array([count for _, _, count in candidates], dtype=np.float64)
+
+        confidence = counts / antecedent_support
+        rules = pd.DataFrame({
+            'antecedent': [tuple(item_names[list(a)]) for a, _, _ in candidates],
+            'consequent': item_names[[c for _, c, _ in candidates]],
+            'count': counts.astype(np.int64),
+            'support': counts / n_invoices,
+            'confidence': confidence,
+            'lift': confidence / (consequent_support / n_invoices)
+        })
+        return rules.sort_values(['lift', 'count'], ascending=False, ignore_index=True)
+
+    def _count_item_triples(self, indicator: sparse.csc_matrix, item_support: np.ndarray, pairs: dict, config: AnalysisConfig) -> dict:
+        """Counts 3-item sets whose three sub-pairs are all frequent, among the best supported items."""
+        top = set(np.argsort(-item_support, kind='stable')[:config.top_n_items].tolist())
+        neighbours = {}
+        for i, j in pairs:
+            if i in top and j in top:
+                neighbours.setdefault(i, set()).add(j)
+
+        triples = {}
+        for i, followers in neighbours.items():
+            for j in followers:
+                for k in followers & neighbours.get(j, set()):
+                    # Invoices containing all three items
+                    invoices = np.intersect1d(
+                        np.intersect1d(self._column_rows(indicator, i), self._column_rows(indicator, j), assume_unique=True),
+                        self._column_rows(indicator, k),
+                        assume_unique=True
+                    )
+                    if len(invoices) >= config.min_pair_support:
+                        triples[(i, j, k)] = len(invoices)
+        return triples
+
+    def _column_rows(self, indicator: sparse.csc_matrix, column: int) -> np.ndarray:
+        return indicator.indices[indicator.indptr[column]:indicator.indptr[column + 1]]
+
+    def _top_items(self, item_counts: pd.Series, top_n: int) -> pd.Index:
+        # Categorical value_counts also lists unused categories; those never qualify
+        return item_counts[item_counts > 0].head(top_n).index
+
+    def _invoice_item_indicator(self, df: pd.DataFrame, items: pd.Index) -> sparse.csr_matrix:
+        """
+        Sparse 0/1 matrix with one row per invoice and one column per entry of
+        `items`; rows of other items are left out.
+        """
+        item_codes = items.get_indexer(df['item_name'])
+        kept = item_codes >= 0
+        invoice_codes, invoices = pd.factorize(df['invoice_no'].to_numpy()[kept])
+
+        indicator = sparse.csr_matrix(
+            (np.ones(len(invoice_codes), dtype=np.int64), (invoice_codes, item_codes[kept])),
+            shape=(len(invoices), len(items))
         )
-        full_matrix = matrix_df + matrix_df.T.fillna(0)
-       
-        # Limit to top-N items
-        top_items = df['item_name'].value_counts().head(top_n).index
-        filtered_matrix = full_matrix.loc[top_items, top_items]
-       
-        return filtered_matrix
+        # Repeated items within an invoice were summed; an invoice counts once
+        indicator.data[:] = 1
+        return indicator
+
+    def fold_new_orders(
+        self,
+        history_df: pd.DataFrame,
+        new_df: pd.DataFrame,
+        invoice_df: pd.DataFrame,
+        pair_counter: PairCounts,
+        item_counter: Counter,
+        item_invoice_counter: Counter,
+        config: Optional[AnalysisConfig] = None
+    ) -> Tuple[pd.DataFrame, PairCounts, Counter, Counter]:
+        """
+        Updates persisted invoice aggregates, pair counts, item row counts and
+        item invoice counts with newly ingested rows.
+
+        Only invoices touched by `new_df` are recomputed. An invoice number that
+        already exists in `history_df` (e.g. an order re-sent by the POS) has its
+        old contribution replaced, so the result matches a full recomputation
+        (within the sketch's error bound when pair counts are approximate).
+        Exact counts are moved into a sketch once the menu outgrows
+        `pair_sketch_min_distinct_items`.
+        """
+        config = config or AnalysisConfig()
+        # Re-sent invoices keep their earlier rows in the history, so item rows only add up
+        item_counter = item_counter + self.count_items(new_df)
+        touched = new_df['invoice_no'].unique()
+        previous_rows = history_df[history_df['invoice_no'].isin(touched)]
+        touched_rows = concat_preprocessed([previous_rows, new_df]) if len(previous_rows) else new_df
 
+        invoice_df = pd.concat(
+            [invoice_df[~invoice_df['invoice_no'].isin(touched)], self.compute_invoice_aggregation(touched_rows)],
+            ignore_index=True
+        )
+
+        item_invoice_counter = item_invoice_counter + self.count_item_invoices(touched_rows)
+        if len(previous_rows):
+            item_invoice_counter = item_invoice_counter - self.count_item_invoices(previous_rows)
+
+        if isinstance(pair_counter, PairHeavyHitters):
+            # subtract() keeps negative deltas, which the sketch applies as retractions
+            delta = self.count_item_pairs(touched_rows)
+            if len(previous_rows):
+                delta.subtract(self.count_item_pairs(previous_rows))
+            pair_counter.update(delta)
+            return invoice_df, pair_counter, item_counter, item_invoice_counter
+
+        pair_counter = pair_counter + self.count_item_pairs(touched_rows)
+        if len(previous_rows):
+            # Counter subtraction also drops pairs whose count reaches zero
+            pair_counter = pair_counter - self.count_item_pairs(previous_rows)
 
-def run_order_analysis(df: pd.DataFrame):
+        if self._use_pair_sketch(len(item_counter), config):
+            sketch = PairHeavyHitters(config.pair_sketch_capacity)
+            sketch.update(pair_counter)
+            pair_counter = sketch
+
+        return invoice_df, pair_counter, item_counter, item_invoice_counter
+
+
+def run_order_analysis(
+    orders: PreparedOrders,
+    invoice_df: Optional[pd.DataFrame] = None,
+    pair_counter: Optional[PairCounts] = None,
+    item_counter: Optional[Counter] = None,
+    item_invoice_counter: Optional[Counter] = None,
+    config: Optional[AnalysisConfig] = None,
+    max_itemset_size: int = 2,
+    full_rule_mining: bool = True
+):
     
-    df = preprocess_raw_data(df)
+    config = config or AnalysisConfig()
+    df = orders.select(ORDER_COLUMNS)
     analyzer = OrderAnalyzer()
 
-    invoice_df = analyzer.compute_invoice_aggregation(df)
-    cooc_matrix_df = analyzer.compute_cooccurrence_matrix(df)
+    # Incremental runs pass in the persisted aggregates instead of rescanning the rows
+    if invoice_df is None:
+        invoice_df = analyzer.compute_invoice_aggregation(df)
+    if pair_counter is None:
+        cooc_matrix_df = analyzer.compute_cooccurrence_matrix(df, top_n=config.top_n_items)
+    else:
+        item_counts = analyzer.rank_items(item_counter) if item_counter is not None else df['item_name'].value_counts()
+        cooc_matrix_df = analyzer.build_cooccurrence_matrix(pair_counter, item_counts, top_n=config.top_n_items)
+
+    # Incremental runs read pair rules off the persisted counts; full mining rescans every basket
+    if full_rule_mining or pair_counter is None or item_invoice_counter is None:
+        rules_df = analyzer.mine_association_rules(df, config, max_itemset_size=max_itemset_size)
+    else:
+        rules_df = analyzer.association_rules_from_counts(pair_counter, item_invoice_counter, len(invoice_df), config)
    
-    return invoice_df, cooc_matrix_df
+    return invoice_df, cooc_matrix_df, rules_df
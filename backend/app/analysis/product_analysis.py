@@ -1,37 +1,201 @@
+import numpy as np
 import pandas as pd
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from app.analysis.demand_forecast import forecast_demand
 from app.core.analysis_config import AnalysisConfig
+from app.utils.preprocessing import PreparedOrders, concat_preprocessed
+
+# Columns of the prepared orders that the product KPIs are built from
+PRODUCT_COLUMNS = [
+    'item_name', 'invoice_no', 'DateOnly', 'Hour',
+    'item_quantity', 'item_total', 'discount', 'waived_off'
+]
+
+# Additive metrics of the item x day x hour grain; every roll-up is a plain sum
+PRODUCT_METRICS = ['quantity', 'gross_sales', 'discounts', 'revenue', 'orders']
+SLOT_KEYS = ['item_name', 'DateOnly', 'Hour']
+
 
 class ProductAnalyzer:
     """Analyzes product-level KPIs and patterns"""
-    
+
     def __init__(self, config: AnalysisConfig):
         self.config = config
-    
-    def analyze_product_performance(self, df: pd.DataFrame) -> Dict[str, Any]:
-        """Analyze product performance metrics"""
-        # TODO: Implement product analysis
+
+    def compute_item_slots(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Aggregates item rows at the finest grain, one row per item, day and
+        hour. This is the only pass over the item rows; daily, hourly and
+        monthly performance are roll-ups of it.
+
+        'orders' counts invoices containing the item. An invoice falls in a
+        single day and hour, so these counts stay additive in every roll-up.
+        """
+        is_new_invoice = ~pd.DataFrame({
+            'item_name': df['item_name'].to_numpy(),
+            'invoice_no': df['invoice_no'].to_numpy()
+        }).duplicated().to_numpy()
+
+        # The discount is order-level and repeated on every item row; each item
+        # takes its share of item_total (an equal share if the invoice totals 0),
+        # so revenue is gross_sales - discounts on every slot
+        invoice_codes = pd.factorize(df['invoice_no'].to_numpy())[0]
+        item_totals = df['item_total'].to_numpy(np.float64)
+        invoice_totals = np.bincount(invoice_codes, weights=item_totals)[invoice_codes]
+        invoice_rows = np.bincount(invoice_codes)[invoice_codes]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            discount_share = np.where(invoice_totals != 0, item_totals / invoice_totals, 1.0 / invoice_rows)
+
+        discounts = df['discount'].to_numpy(np.float64) * discount_share + df['waived_off'].fillna(0).to_numpy(np.float64)
+
+        keyed = pd.DataFrame({
+            'item_name': df['item_name'],
+            'DateOnly': df['DateOnly'],
+            'Hour': df['Hour'],
+            'quantity': df['item_quantity'],
+            'gross_sales': df['item_total'],
+            'discounts': discounts,
+            'revenue': item_totals - discounts,
+            'orders': is_new_invoice.astype(np.int64)
+        }, copy=False)
+        return self._roll_up(keyed, SLOT_KEYS)
+
+    def fold_new_orders(self, history_df: pd.DataFrame, new_df: pd.DataFrame, item_slots: pd.DataFrame) -> pd.DataFrame:
+        """
+        Merges newly ingested item rows into the persisted item slots.
+
+        Invoices that already had rows in `history_df` are recomputed from
+        their old and new rows and their old contribution is subtracted, so
+        'orders' keeps counting each invoice once per item.
+        """
+        touched = history_df['invoice_no'].isin(new_df['invoice_no'].unique()).to_numpy()
+        previous_rows = history_df.take(np.flatnonzero(touched))
+        if not len(previous_rows):
+            return self.merge_item_slots([item_slots, self.compute_item_slots(new_df)])
+
+        previous_slots = self.compute_item_slots(previous_rows)
+        previous_slots[PRODUCT_METRICS] = -previous_slots[PRODUCT_METRICS]
+        touched_slots = self.compute_item_slots(concat_preprocessed([previous_rows, new_df]))
+        return self.merge_item_slots([item_slots, touched_slots, previous_slots])
+
+    def merge_item_slots(self, parts: List[pd.DataFrame]) -> pd.DataFrame:
+        """Combines item slots of disjoint invoice sets (negated parts subtract)."""
+        return self._roll_up(concat_preprocessed(parts), SLOT_KEYS)
+
+    def compute_daily_performance(self, item_slots: pd.DataFrame) -> pd.DataFrame:
+        """Compute daily product performance (item x day), rolled up from compute_item_slots"""
+        return self._roll_up(item_slots, ['item_name', 'DateOnly'])
+
+    def compute_hourly_performance(self, item_slots: pd.DataFrame) -> pd.DataFrame:
+        """Compute hourly product performance (item x hour of day), rolled up from compute_item_slots"""
+        return self._roll_up(item_slots, ['item_name', 'Hour'])
+
+    def compute_monthly_performance(self, daily_df: pd.DataFrame) -> pd.DataFrame:
+        """Compute monthly product performance (item x month), rolled up from the daily performance"""
+        keyed = daily_df.assign(YearMonth=daily_df['DateOnly'].values.astype('datetime64[M]').astype('datetime64[ns]'))
+        return self._roll_up(keyed, ['item_name', 'YearMonth'])
+
+    def _roll_up(self, df: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+        return df.groupby(keys, observed=True, sort=True)[PRODUCT_METRICS].sum().reset_index()
+
+    def analyze_product_performance(self, daily_df: pd.DataFrame, monthly_df: pd.DataFrame) -> Dict[str, Any]:
+        """Analyze product performance metrics from the daily and monthly roll-ups"""
+        if daily_df.empty:
+            return {
+                "top_selling_items": [],
+                "seasonal_trends": {},
+                "profit_margins": {},
+                "inventory_turnover": {}
+            }
+
+        items = self._roll_up(daily_df, ['item_name']).set_index('item_name')
+        items['active_days'] = daily_df.groupby('item_name', observed=True).size()
+        items['last_sold'] = daily_df.groupby('item_name', observed=True)['DateOnly'].max()
+        items = items.sort_values(['revenue', 'quantity'], ascending=False, kind='stable')
+        top_items = items.head(self.config.top_n_items)
+
+        total_revenue = items['revenue'].sum()
+        last_day = daily_df['DateOnly'].max()
+        period_days = (last_day - daily_df['DateOnly'].min()).days + 1
+
+        return {
+            "top_selling_items": [
+                {
+                    "item_name": item,
+                    "quantity_sold": int(row['quantity']),
+                    "revenue": round(float(row['revenue']), 2),
+                    "orders": int(row['orders']),
+                    "revenue_share": round(float(row['revenue'] / total_revenue * 100), 2) if total_revenue else 0,
+                    "average_selling_price": round(float(row['revenue'] / row['quantity']), 2) if row['quantity'] else 0
+                }
+                for item, row in top_items.iterrows()
+            ],
+            "seasonal_trends": self._seasonal_trends(monthly_df, top_items.index),
+            "profit_margins": {
+                # No cost prices in the POS data: report what discounts take off gross sales
+                "basis": "discounts_and_waivers_vs_gross_sales",
+                "overall_discount_rate": self._rate(items['discounts'].sum(), items['gross_sales'].sum()),
+                "discount_rate_by_item": {
+                    item: self._rate(row['discounts'], row['gross_sales']) for item, row in top_items.iterrows()
+                }
+            },
+            "inventory_turnover": {
+                # No stock levels either: sales velocity over the analysed period
+                "basis": "units_sold_per_day",
+                "period_days": period_days,
+                "fast_movers": self._velocity(top_items, period_days, last_day),
+                "slow_movers": self._velocity(
+                    items.sort_values('quantity', kind='stable').head(self.config.top_n_items // 3), period_days, last_day
+                )
+            }
+        }
+
+    def _seasonal_trends(self, monthly_df: pd.DataFrame, top_items: pd.Index) -> Dict[str, Any]:
+        monthly_revenue = monthly_df.groupby('YearMonth', sort=True)['revenue'].sum()
+        months = monthly_revenue.index.strftime('%Y-%m')
+
+        top_monthly = monthly_df[monthly_df['item_name'].isin(top_items)]
+        peak_rows = top_monthly.sort_values(['revenue', 'YearMonth'], ascending=[False, True], kind='stable').drop_duplicates('item_name')
         return {
-            "top_selling_items": [],
-            "seasonal_trends": {},
-            "profit_margins": {},
-            "inventory_turnover": {}
+            "monthly_revenue": {month: round(float(value), 2) for month, value in zip(months, monthly_revenue)},
+            "best_month": months[int(np.argmax(monthly_revenue.to_numpy()))],
+            "worst_month": months[int(np.argmin(monthly_revenue.to_numpy()))],
+            "peak_month_by_item": {
+                item: month.strftime('%Y-%m') for item, month in zip(peak_rows['item_name'], peak_rows['YearMonth'])
+            }
         }
-    
-    def compute_daily_performance(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Compute daily product performance"""
-        # TODO: Implement daily performance computation
-        return pd.DataFrame()
-    
-    def compute_hourly_performance(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Compute hourly product performance"""
-        # TODO: Implement hourly performance computation
-        return pd.DataFrame()
-    
-    def compute_monthly_performance(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Compute monthly product performance"""
-        # TODO: Implement monthly performance computation
-        return pd.DataFrame()
-    
-def run_analysis():
-    pass
\ No newline at end of file
+
+    def _velocity(self, items: pd.DataFrame, period_days: int, last_day: pd.Timestamp) -> List[Dict[str, Any]]:
+        return [
+            {
+                "item_name": item,
+                "units_per_day": round(float(row['quantity'] / period_days), 2),
+                "active_days": int(row['active_days']),
+                "days_since_last_sale": int((last_day - row['last_sold']).days)
+            }
+            for item, row in items.iterrows()
+        ]
+
+    def _rate(self, part: float, whole: float) -> float:
+        return round(float(part / whole * 100), 2) if whole else 0.0
+
+
+def run_product_analysis(
+    orders: PreparedOrders,
+    config: Optional[AnalysisConfig] = None,
+    item_slots: Optional[pd.DataFrame] = None
+):
+
+    config = config or AnalysisConfig()
+    analyzer = ProductAnalyzer(config)
+
+    # Incremental runs pass in the persisted item slots instead of rescanning the rows
+    if item_slots is None:
+        item_slots = analyzer.compute_item_slots(orders.select(PRODUCT_COLUMNS))
+    daily_df = analyzer.compute_daily_performance(item_slots)
+    hourly_df = analyzer.compute_hourly_performance(item_slots)
+    monthly_df = analyzer.compute_monthly_performance(daily_df)
+    performance = analyzer.analyze_product_performance(daily_df, monthly_df)
+    demand_forecast = forecast_demand(daily_df, config) if len(daily_df) else None
+
+    return performance, daily_df, hourly_df, monthly_df, demand_forecast
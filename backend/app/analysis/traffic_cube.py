@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from app.utils.preprocessing import WEEKDAY_NAMES
+
+HOURS = 24
+SLOTS = len(WEEKDAY_NAMES) * HOURS
+
+# Order of the metric axis
+CUBE_METRICS = ('invoices', 'revenue', 'quantity')
+
+
+@dataclass(frozen=True)
+class TrafficCube:
+    """
+    Invoices, revenue and quantity by (weekday, hour), overall and for the
+    top items, as dense arrays. Weekday 0 is Monday.
+
+    `totals` has shape (metric, weekday, hour) and is built from invoices,
+    each counted in the slot of its first item row. `by_item` has shape
+    (item, metric, weekday, hour) for the items in `items`; there,
+    'invoices' counts the invoices containing the item.
+    """
+    totals: np.ndarray
+    items: np.ndarray
+    by_item: np.ndarray
+
+    def metric(self, name: str, item: Optional[str] = None) -> np.ndarray:
+        """(weekday, hour) slice of one metric, overall or for one item."""
+        m = CUBE_METRICS.index(name)
+        if item is None:
+            return self.totals[m]
+        positions = np.flatnonzero(self.items == item)
+        if len(positions) == 0:
+            return np.zeros((len(WEEKDAY_NAMES), HOURS), dtype=self.by_item.dtype)
+        return self.by_item[positions[0], m]
+
+    def by_weekday(self, name: str = 'invoices') -> np.ndarray:
+        return self.metric(name).sum(axis=1)
+
+    def by_hour(self, name: str = 'invoices') -> np.ndarray:
+        return self.metric(name).sum(axis=0)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            'totals': self.totals,
+            'items': self.items.astype(str),
+            'by_item': self.by_item
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "TrafficCube":
+        return cls(totals=arrays['totals'], items=arrays['items'].astype(object), by_item=arrays['by_item'])
+
+
+def build_traffic_cube(invoice_df: pd.DataFrame, item_slots: pd.DataFrame, items: pd.Index) -> TrafficCube:
+    """
+    Builds the cube from invoice aggregates (OrderAnalyzer.compute_invoice_aggregation)
+    and the item x day x hour slots (ProductAnalyzer.compute_item_slots), with
+    a per-item breakdown for `items`. Every metric is one bincount over a
+    flat (weekday, hour) slot index; no item rows are read.
+    """
+    order_dates = invoice_df['order_date']
+    invoice_slots = order_dates.dt.dayofweek.to_numpy() * HOURS + order_dates.dt.hour.to_numpy()
+    totals = np.stack([
+        np.bincount(invoice_slots, minlength=SLOTS).astype(np.float64),
+        np.bincount(invoice_slots, weights=invoice_df['net_invoice_value'].to_numpy(np.float64), minlength=SLOTS),
+        np.bincount(invoice_slots, weights=invoice_df['total_quantity'].to_numpy(np.float64), minlength=SLOTS)
+    ])
+
+    item_codes = items.get_indexer(item_slots['item_name'])
+    rows = np.flatnonzero(item_codes >= 0)
+    weekdays = item_slots['DateOnly'].dt.dayofweek.to_numpy()[rows].astype(np.int64)
+    cells = item_codes[rows] * SLOTS + weekdays * HOURS + item_slots['Hour'].to_numpy()[rows]
+    size = len(items) * SLOTS
+
+    # Slot 'orders' already count each invoice once per item, in its own slot
+    by_item = np.stack([
+        np.bincount(cells, weights=item_slots['orders'].to_numpy(np.float64)[rows], minlength=size),
+        np.bincount(cells, weights=item_slots['revenue'].to_numpy(np.float64)[rows], minlength=size),
+        np.bincount(cells, weights=item_slots['quantity'].to_numpy(np.float64)[rows], minlength=size)
+    ])
+
+    return TrafficCube(
+        totals=totals.reshape(len(CUBE_METRICS), len(WEEKDAY_NAMES), HOURS),
+        items=np.asarray(items, dtype=object),
+        by_item=by_item.reshape(len(CUBE_METRICS), len(items), len(WEEKDAY_NAMES), HOURS).transpose(1, 0, 2, 3).copy()
+    )
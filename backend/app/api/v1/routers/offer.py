@@ -1,5 +1,5 @@
 import asyncpg
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
 from app.db.database import get_db_pool
 from app.api.deps import get_current_auth_data
 from app.services import offer_service, forecast_service
@@ -24,12 +24,14 @@ async def generate_one_template(background_tasks: BackgroundTasks,
 @router.post("/generate-all-templates")
 async def generate_all_templates(background_tasks: BackgroundTasks,
     pool: asyncpg.Pool = Depends(get_db_pool),
-    auth_data: AuthData = Depends(get_current_auth_data)
+    auth_data: AuthData = Depends(get_current_auth_data),
+    force: bool = Query(False, description="Regenerate even if the analyses have not materially changed")
 ):
     background_tasks.add_task(
         offer_service.generate_all_templates,
         pool,
-        auth_data.loyalty_program_id
+        auth_data.loyalty_program_id,
+        force
     )
     return {"message": f"Offer Generation has commenced for loyalty_id = {auth_data.loyalty_program_id}"}
 
@@ -1,17 +1,21 @@
 import asyncpg
+from typing import Optional
 from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException, Query
 
 from app.db.database import get_db_pool
 from app.services import analysis_service
 from app.crud.analysis_crud import analysis_crud
+from app.crud.customer_kpi_crud import customer_kpi_crud
 from app.api.deps import get_current_auth_data
-from app.schemas import AuthData, AnalysisTypeEnum 
+from app.schemas import AuthData, AnalysisTypeEnum, CustomerSegmentEnum
+from app.schemas.core.customer_kpi import CustomerKPIPage
     
 router = APIRouter()
 
 @router.post("/run-all-analyses", status_code=202)
 async def trigger_all_analyses(
     background_tasks: BackgroundTasks,
+    full_rebuild: bool = Query(False, description="Re-ingest the full order history instead of only new orders"),
     pool: asyncpg.Pool = Depends(get_db_pool),
     auth_data: AuthData = Depends(get_current_auth_data)
 ):
@@ -22,7 +26,8 @@ async def trigger_all_analyses(
     background_tasks.add_task(
         analysis_service.trigger_all_analyses,
         pool,
-        auth_data.loyalty_program_id
+        auth_data.loyalty_program_id,
+        full_rebuild
     )
     return {"message": "All analysis pipelines have been queued and are running in the background."}
 
@@ -49,4 +54,35 @@ async def get_latest_analysis(
             detail=f"No '{analysis_type.value}' analysis results found for this program."
         )
         
-    return result
\ No newline at end of file
+    return result
+
+
+@router.get("/customers", response_model=CustomerKPIPage)
+async def list_customers(
+    segment: Optional[CustomerSegmentEnum] = Query(None, description="Customer segment ID"),
+    min_days_since_last_order: Optional[int] = Query(None, ge=0),
+    max_days_since_last_order: Optional[int] = Query(None, ge=0),
+    min_orders: Optional[int] = Query(None, ge=0),
+    cluster: Optional[int] = Query(None, ge=0, description="RFM cluster"),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    pool: asyncpg.Pool = Depends(get_db_pool),
+    auth_data: AuthData = Depends(get_current_auth_data)
+):
+    """
+    Lists the program's customers from the latest customer analysis,
+    highest spenders first, filtered by segment, recency, order count and
+    RFM cluster.
+    """
+    total, items = await customer_kpi_crud.get_customer_kpis(
+        pool=pool,
+        loyalty_program_id=auth_data.loyalty_program_id,
+        segment=segment.value if segment is not None else None,
+        min_days_since_last_order=min_days_since_last_order,
+        max_days_since_last_order=max_days_since_last_order,
+        min_orders=min_orders,
+        cluster=cluster,
+        limit=limit,
+        offset=offset
+    )
+    return CustomerKPIPage(total=total, limit=limit, offset=offset, items=items)
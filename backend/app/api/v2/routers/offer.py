@@ -13,12 +13,14 @@ router = APIRouter()
 async def generate_all_templates(
     background_tasks: BackgroundTasks,
     pool: asyncpg.Pool = Depends(get_db_pool),
-    auth_data: AuthData = Depends(get_current_auth_data)
+    auth_data: AuthData = Depends(get_current_auth_data),
+    force: bool = Query(False, description="Regenerate even if the analyses have not materially changed")
 ):
     background_tasks.add_task(
         offer_service.generate_all_templates,
         pool,
-        auth_data.loyalty_program_id
+        auth_data.loyalty_program_id,
+        force
     )
     return {"message": f"Offer Generation has commenced for loyalty_id = {auth_data.loyalty_program_id}"}
 
@@ -1,7 +1,12 @@
 from dataclasses import dataclass
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
 from pathlib import Path
 
+from app.core.config import settings
+
+# Items that are sold alongside food but say nothing about menu preferences
+DEFAULT_BANNED_ITEM_TERMS: Tuple[str, ...] = ("water", "water bottle", "1 ltr", "cigarette", "cigarettes")
+
 @dataclass
 class AnalysisConfig:
     """Configuration class for KPI analysis parameters"""
@@ -10,6 +15,24 @@ class AnalysisConfig:
     top_n_items: int = 30
     high_value_percentile: float = 0.8
     peak_hours_threshold: float = 0.1
+    banned_item_terms: Tuple[str, ...] = DEFAULT_BANNED_ITEM_TERMS
+    
+    # RFM cluster count selection (sampled silhouette, bounded time)
+    rfm_default_k: int = 3
+    rfm_k_candidates: Tuple[int, ...] = (2, 3, 4, 5, 6, 7, 8)
+    rfm_silhouette_sample_size: int = 5_000
+    rfm_k_selection_budget_seconds: float = 10.0
+    
+    # Item pair counting switches to a bounded heavy-hitters sketch on large menus
+    pair_sketch_min_distinct_items: int = 2_000
+    pair_sketch_capacity: int = 100_000
+    pair_sketch_batch_invoices: int = 20_000
+    
+    # Demand baseline forecasts (product analysis)
+    forecast_horizon_weeks: int = 4
+    forecast_holdout_days: int = 28
+    forecast_smoothing_alpha: float = 0.3
+    forecast_season_weeks: int = 8
     
     # File paths
     base_results_dir: Path = Path("src/results")
@@ -17,6 +40,14 @@ class AnalysisConfig:
     customer_results_dir: Path = Path("src/results/customer_analysis")
     product_results_dir: Path = Path("src/results/product_analysis")
     
+    @classmethod
+    def for_program(cls, loyalty_program_id: int) -> "AnalysisConfig":
+        """Default config with any per-program overrides from settings applied"""
+        banned_item_terms = settings.BANNED_ITEM_TERMS_OVERRIDES.get(loyalty_program_id)
+        if banned_item_terms is None:
+            return cls()
+        return cls(banned_item_terms=tuple(banned_item_terms))
+    
     def to_dict(self) -> Dict[str, Any]:
         """Convert config to dictionary"""
         return {
@@ -24,5 +55,17 @@ class AnalysisConfig:
             "min_item_support": self.min_item_support,
             "top_n_items": self.top_n_items,
             "high_value_percentile": self.high_value_percentile,
-            "peak_hours_threshold": self.peak_hours_threshold
+            "peak_hours_threshold": self.peak_hours_threshold,
+            "banned_item_terms": list(self.banned_item_terms),
+            "rfm_default_k": self.rfm_default_k,
+            "rfm_k_candidates": list(self.rfm_k_candidates),
+            "rfm_silhouette_sample_size": self.rfm_silhouette_sample_size,
+            "rfm_k_selection_budget_seconds": self.rfm_k_selection_budget_seconds,
+            "pair_sketch_min_distinct_items": self.pair_sketch_min_distinct_items,
+            "pair_sketch_capacity": self.pair_sketch_capacity,
+            "pair_sketch_batch_invoices": self.pair_sketch_batch_invoices,
+            "forecast_horizon_weeks": self.forecast_horizon_weeks,
+            "forecast_holdout_days": self.forecast_holdout_days,
+            "forecast_smoothing_alpha": self.forecast_smoothing_alpha,
+            "forecast_season_weeks": self.forecast_season_weeks
         }
\ No newline at end of file
@@ -1,7 +1,7 @@
 import os
 import secrets
 from enum import Enum
-from typing import Any, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 from pydantic import PostgresDsn, EmailStr, field_validator, Field
 from pydantic_core.core_schema import FieldValidationInfo
@@ -69,6 +69,34 @@ class Settings(BaseSettings):
     
     MODEL_TEMPERATURE: float = 0.1
     MODEL_TOP_P: float = 0.95
+    # Estimated input tokens allowed for the analysis summaries sent with each LLM call
+    ANALYSIS_CONTEXT_TOKEN_BUDGET: int = 6000
+    # generate_all_templates reuses the previous offers while the analyses moved less than
+    # this (largest relative KPI change / share of changed top pairs, see analysis_fingerprint)
+    OFFER_REGENERATION_MIN_CHANGE: float = 0.05
+
+    # --- Analysis Pipeline ---
+    # "stream": decode order JSON in Python, batch by batch
+    # "sql": flatten items inside Postgres and COPY the typed rows out
+    ORDER_INGESTION_MODE: Literal["stream", "sql"] = "stream"
+    # Number of orders pulled per round-trip from the server-side cursor
+    ORDER_FETCH_BATCH_SIZE: int = 5000
+    # Where per-program incremental analysis state (watermarks, aggregates) is kept
+    ANALYSIS_STATE_DIR: str = "analysis_state"
+    # Columnar snapshots of preprocessed order frames, evicted LRU past the size limit
+    ORDER_SNAPSHOT_DIR: str = "order_snapshots"
+    ORDER_SNAPSHOT_CACHE_MAX_BYTES: int = 2 * 1024 ** 3
+    # Per-program replacement for the default banned item terms, as JSON: {"12": ["water", "soda"]}
+    BANNED_ITEM_TERMS_OVERRIDES: Dict[int, List[str]] = {}
+    # RFM clustering: "refit" from scratch, "warm_start" from the persisted centroids,
+    # or "predict" with the persisted model (no refit)
+    RFM_CLUSTERING_MODE: Literal["refit", "warm_start", "predict"] = "warm_start"
+    # Customer count from which MiniBatchKMeans replaces KMeans
+    RFM_MINIBATCH_MIN_CUSTOMERS: int = 200_000
+    # Choose the RFM cluster count by sampled silhouette instead of the fixed default
+    RFM_AUTO_CLUSTER_COUNT: bool = False
+    # Largest itemset mined for association rules: 2 (pairs) or 3 (also item triples)
+    ASSOCIATION_RULE_MAX_ITEMSET_SIZE: Literal[2, 3] = 2
 
     # --- Pydantic Settings Config ---
     # It's common to place the .env file in the project root
@@ -1,21 +1,149 @@
 import asyncpg
 import json
-from typing import List, Dict, Any, Optional
+import tempfile
+import pandas as pd
+from typing import List, Dict, Any, Optional, AsyncIterator
 from app.utils.json_encoders import NumpyEncoder
 
+# One row per order item, with the same columns decode_orders_to_dataframe
+# builds. Everything is extracted as text; numeric parsing happens client-side.
+# The CTE is materialized so each blob is parsed to jsonb once, not once per
+# extracted field.
+FLATTENED_ORDER_ITEMS_QUERY = """
+    WITH o AS MATERIALIZED (
+        SELECT pos_raw_data::jsonb AS raw
+        FROM orders
+        WHERE loyalty_program_id = $1
+          AND id > $2 AND id <= $3
+          AND pos_raw_data IS NOT NULL
+    )
+    SELECT
+        o.raw->'Restaurant'->>'res_name'      AS restaurant_name,
+        o.raw->'Order'->>'orderID'            AS invoice_no,
+        o.raw->'Order'->>'created_on'         AS "date",
+        o.raw->'Order'->>'payment_type'       AS payment_type,
+        o.raw->'Order'->>'order_type'         AS order_type,
+        o.raw->'Customer'->>'phone'           AS customer_phone,
+        o.raw->'Customer'->>'name'            AS customer_name,
+        o.raw->'Order'->>'no_of_persons'      AS persons,
+        o.raw->'Order'->>'tax_total'          AS total_tax,
+        o.raw->'Order'->>'discount_total'     AS discount,
+        o.raw->'Order'->>'delivery_charges'   AS delivery_charge,
+        o.raw->'Order'->>'round_off'          AS round_off,
+        o.raw->'Order'->>'total'              AS total,
+        item.name                             AS item_name,
+        item.price                            AS item_price,
+        item.quantity                         AS item_quantity,
+        item.total                            AS item_total,
+        o.raw->'Order'->>'core_total'         AS my_amount
+    FROM o
+    CROSS JOIN LATERAL jsonb_to_recordset(o.raw->'OrderItem')
+        AS item(name text, price text, quantity text, total text)
+    WHERE jsonb_typeof(o.raw->'OrderItem') = 'array'
+"""
+
+# Identifier and label columns must stay strings (phones, order ids)
+FLATTENED_TEXT_COLUMNS = [
+    'restaurant_name', 'invoice_no', 'date', 'payment_type', 'order_type',
+    'customer_phone', 'customer_name', 'item_name'
+]
+FLATTENED_NUMERIC_COLUMNS = [
+    'persons', 'total_tax', 'discount', 'delivery_charge', 'round_off',
+    'total', 'item_price', 'item_quantity', 'item_total', 'my_amount'
+]
+
+# COPY writes SQL NULLs as this marker, so text values such as "NA", "null"
+# or "" survive as strings exactly like on the stream path. Empty numeric
+# fields are missing too, as the decoder coerces them to NaN.
+FLATTENED_NULL_MARKER = r"\N"
+
 class CRUDAnalysis:
-    async def get_all_orders_as_list(self, pool: asyncpg.Pool, loyalty_program_id: int) -> List[Dict[str, Any]]:
-        """Fetches all order JSON blobs for a given program."""
-        query = "SELECT * FROM orders WHERE loyalty_program_id = $1;"
-        
+    async def get_latest_order_id(self, pool: asyncpg.Pool, loyalty_program_id: int) -> Optional[int]:
+        """Returns the highest order id for a program, or None if it has no orders."""
+        query = "SELECT MAX(id) FROM orders WHERE loyalty_program_id = $1;"
         async with pool.acquire() as conn:
+            return await conn.fetchval(query, loyalty_program_id)
+
+    async def stream_order_batches(
+        self,
+        pool: asyncpg.Pool,
+        loyalty_program_id: int,
+        since_order_id: int,
+        upto_order_id: int,
+        batch_size: int = 5000
+    ) -> AsyncIterator[List[str]]:
+        """
+        Streams the raw order JSON text for a program's orders with
+        `since_order_id < id <= upto_order_id`, in batches of at most
+        `batch_size`. Reads through a server-side cursor so only one batch
+        is held in memory at a time. Decoding is left to the caller.
+        """
+        query = """
+            SELECT pos_raw_data
+            FROM orders
+            WHERE loyalty_program_id = $1
+              AND id > $2 AND id <= $3
+              AND pos_raw_data IS NOT NULL;
+        """
+        async with pool.acquire() as conn:
+            # asyncpg cursors only live inside a transaction
+            async with conn.transaction():
+                cursor = await conn.cursor(query, loyalty_program_id, since_order_id, upto_order_id)
+                while True:
+                    records = await cursor.fetch(batch_size)
+                    if not records:
+                        break
+                    yield [r['pos_raw_data'] for r in records]
+
+    async def get_flattened_order_items(
+        self,
+        pool: asyncpg.Pool,
+        loyalty_program_id: int,
+        since_order_id: int,
+        upto_order_id: int,
+        spool_max_bytes: int = 64 * 1024 * 1024
+    ) -> pd.DataFrame:
+        """
+        Flattens the items of a program's orders with
+        `since_order_id < id <= upto_order_id` inside Postgres and returns
+        them as a DataFrame shaped like `decode_orders_to_dataframe`'s output.
+
+        The rows are pulled with COPY into a spooled buffer (spilling to disk
+        past `spool_max_bytes`) and parsed by pandas' C reader, so no JSON
+        text crosses the wire and nothing is decoded row by row in Python.
+        """
+        with tempfile.SpooledTemporaryFile(max_size=spool_max_bytes) as buffer:
+            async with pool.acquire() as conn:
+                await conn.copy_from_query(
+                    FLATTENED_ORDER_ITEMS_QUERY,
+                    loyalty_program_id,
+                    since_order_id,
+                    upto_order_id,
+                    output=buffer,
+                    format='csv',
+                    header=True,
+                    null=FLATTENED_NULL_MARKER
+                )
+            buffer.seek(0)
+            df = pd.read_csv(
+                buffer,
+                dtype={col: str for col in FLATTENED_TEXT_COLUMNS},
+                keep_default_na=False,
+                na_values={
+                    **{col: [FLATTENED_NULL_MARKER] for col in FLATTENED_TEXT_COLUMNS},
+                    **{col: [FLATTENED_NULL_MARKER, ''] for col in FLATTENED_NUMERIC_COLUMNS}
+                }
+            )
 
-            records = await conn.fetch(query, loyalty_program_id)
-            
-        if not records:
-            return []
+        # Unparseable numbers (e.g. "N/A") become NaN, as on the stream path
+        for col in FLATTENED_NUMERIC_COLUMNS:
+            if df[col].dtype == object:
+                df[col] = pd.to_numeric(df[col], errors='coerce')
 
-        return [json.loads(r['pos_raw_data']) for r in records if r['pos_raw_data']]
+        # --- Missing Data (added with default values) ---
+        df.insert(df.columns.get_loc('my_amount'), 'waived_off', 0)
+        df['category_name'] = None
+        return df
 
     async def save_analysis_result(
         self,
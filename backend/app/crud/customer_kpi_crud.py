@@ -0,0 +1,133 @@
+import asyncpg
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Any, Optional, Tuple
+
+# The table is owned by this service, so it is created on startup if missing.
+CUSTOMER_KPIS_DDL = """
+    CREATE TABLE IF NOT EXISTS customer_kpis (
+        loyalty_program_id      INTEGER          NOT NULL,
+        customer_phone          TEXT             NOT NULL,
+        customer_name           TEXT,
+        total_spend             DOUBLE PRECISION,
+        average_spend_per_order DOUBLE PRECISION,
+        total_orders            INTEGER          NOT NULL,
+        average_spend_per_item  DOUBLE PRECISION,
+        total_items             DOUBLE PRECISION,
+        days_since_last_order   INTEGER          NOT NULL,
+        days_since_first_order  INTEGER          NOT NULL,
+        cluster                 SMALLINT,
+        segment                 SMALLINT         NOT NULL,
+        updated_at              TIMESTAMPTZ      NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (loyalty_program_id, customer_phone)
+    );
+    CREATE INDEX IF NOT EXISTS ix_customer_kpis_segment_recency
+        ON customer_kpis (loyalty_program_id, segment, days_since_last_order);
+    CREATE INDEX IF NOT EXISTS ix_customer_kpis_recency
+        ON customer_kpis (loyalty_program_id, days_since_last_order);
+    CREATE INDEX IF NOT EXISTS ix_customer_kpis_cluster
+        ON customer_kpis (loyalty_program_id, cluster);
+    CREATE INDEX IF NOT EXISTS ix_customer_kpis_spend
+        ON customer_kpis (loyalty_program_id, total_spend DESC NULLS LAST, customer_phone);
+"""
+
+# KPI master column -> table column, in COPY order (after loyalty_program_id)
+KPI_COLUMN_MAP = {
+    'customer_phone': 'customer_phone',
+    'customer_name': 'customer_name',
+    'Total_Spend_By_Customer': 'total_spend',
+    'Average_Spend_Per_Order': 'average_spend_per_order',
+    'Total_Orders_Placed': 'total_orders',
+    'Average_Spend_Per_Item': 'average_spend_per_item',
+    'Total_Items_Ordered': 'total_items',
+    'Days_Since_Last_Order': 'days_since_last_order',
+    'Days_Since_First_Order': 'days_since_first_order',
+    'Cluster': 'cluster',
+    'Segment': 'segment'
+}
+
+
+class CRUDCustomerKPI:
+    async def ensure_schema(self, pool: asyncpg.Pool) -> None:
+        """Creates the customer_kpis table and its indexes if they don't exist."""
+        async with pool.acquire() as conn:
+            await conn.execute(CUSTOMER_KPIS_DDL)
+
+    async def replace_customer_kpis(
+        self,
+        pool: asyncpg.Pool,
+        loyalty_program_id: int,
+        kpi_df: pd.DataFrame
+    ) -> int:
+        """
+        Replaces the program's customer rows with the given KPI master, using
+        a single COPY inside one transaction so readers never see a partial
+        table. Returns the number of rows written.
+        """
+        columns = []
+        for kpi_column in KPI_COLUMN_MAP:
+            values = kpi_df[kpi_column]
+            if pd.api.types.is_float_dtype(values):
+                # NaN / inf (e.g. no priced orders) are stored as NULL
+                values = values.where(np.isfinite(values))
+            # tolist() yields native Python scalars, as asyncpg's binary COPY expects
+            columns.append(values.astype(object).where(values.notna(), None).tolist())
+        records = [(loyalty_program_id, *row) for row in zip(*columns)]
+
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM customer_kpis WHERE loyalty_program_id = $1", loyalty_program_id)
+                await conn.copy_records_to_table(
+                    'customer_kpis',
+                    records=records,
+                    columns=['loyalty_program_id', *KPI_COLUMN_MAP.values()]
+                )
+        return len(records)
+
+    async def get_customer_kpis(
+        self,
+        pool: asyncpg.Pool,
+        loyalty_program_id: int,
+        segment: Optional[int] = None,
+        min_days_since_last_order: Optional[int] = None,
+        max_days_since_last_order: Optional[int] = None,
+        min_orders: Optional[int] = None,
+        cluster: Optional[int] = None,
+        limit: int = 50,
+        offset: int = 0
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Fetches one page of a program's customers matching the filters,
+        highest spenders first. Returns (total matching rows, page rows).
+        """
+        conditions = ["loyalty_program_id = $1"]
+        params: List[Any] = [loyalty_program_id]
+        for condition, value in (
+            ("segment = ${}", segment),
+            ("days_since_last_order >= ${}", min_days_since_last_order),
+            ("days_since_last_order <= ${}", max_days_since_last_order),
+            ("total_orders >= ${}", min_orders),
+            ("cluster = ${}", cluster),
+        ):
+            if value is not None:
+                params.append(value)
+                conditions.append(condition.format(len(params)))
+        where_clause = " AND ".join(conditions)
+
+        count_query = f"SELECT COUNT(*) FROM customer_kpis WHERE {where_clause}"
+        page_query = f"""
+            SELECT
+                customer_phone, customer_name, total_spend, average_spend_per_order,
+                total_orders, average_spend_per_item, total_items,
+                days_since_last_order, days_since_first_order, cluster, segment, updated_at
+            FROM customer_kpis
+            WHERE {where_clause}
+            ORDER BY total_spend DESC NULLS LAST, customer_phone
+            LIMIT ${len(params) + 1} OFFSET ${len(params) + 2}
+        """
+        async with pool.acquire() as conn:
+            total = await conn.fetchval(count_query, *params)
+            records = await conn.fetch(page_query, *params, limit, offset)
+        return total, [dict(r) for r in records]
+
+customer_kpi_crud = CRUDCustomerKPI()
@@ -6,6 +6,7 @@ from fastapi.middleware.cors import CORSMiddleware
 import redis.asyncio as redis
 
 from app.db.database import db_manager
+from app.crud.customer_kpi_crud import customer_kpi_crud
 from app.api.v2.api import router
 from app.core.config import settings
 
@@ -18,6 +19,7 @@ logfire.configure(token=settings.LOGFIRE_TOKEN,
 async def lifespan(app: FastAPI):
     try:
         await db_manager.init_pool()
+        await customer_kpi_crud.ensure_schema(db_manager.get_pool())
         app.state.redis = redis.from_url(settings.REDIS_URL, decode_responses=True)
         logfire.info("App started with database and Redis connections.")
     except Exception as e:
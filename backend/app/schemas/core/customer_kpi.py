@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from app.schemas.core.enums import CustomerSegmentEnum
+
+
+class CustomerKPIRecord(BaseModel):
+    """One customer's row of the persisted KPI master."""
+    customer_phone: str
+    customer_name: Optional[str] = None
+    total_spend: Optional[float] = None
+    average_spend_per_order: Optional[float] = None
+    total_orders: int
+    average_spend_per_item: Optional[float] = None
+    total_items: Optional[float] = None
+    days_since_last_order: int
+    days_since_first_order: int
+    cluster: Optional[int] = None
+    segment: CustomerSegmentEnum
+    updated_at: datetime
+
+
+class CustomerKPIPage(BaseModel):
+    """A page of customers matching the filters, with the total match count."""
+    total: int
+    limit: int
+    offset: int
+    items: List[CustomerKPIRecord]
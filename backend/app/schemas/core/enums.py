@@ -75,4 +75,10 @@ class TemplateEnum(IntEnum):
 
 # Lookup dict for quick int -> string conversion
 TEMPLATE_ID_TO_NAME: dict[int, str] = {t.value: t.name for t in TemplateEnum}
-TEMPLATE_NAME_TO_ID: dict[str, int] = {t.name: t.value for t in TemplateEnum}
\ No newline at end of file
+TEMPLATE_NAME_TO_ID: dict[str, int] = {t.name: t.value for t in TemplateEnum}
+
+class CustomerSegmentEnum(IntEnum):
+    """Lifecycle segment of a customer, as used in the customer analysis."""
+    NEW = 1
+    ACTIVE = 2
+    DORMANT = 3
@@ -0,0 +1,61 @@
+from typing import Annotated, List, Optional, Union
+from typing_extensions import TypedDict
+from pydantic import ConfigDict, Field, with_config
+
+# Declared schema of the POS order blobs stored in `orders.pos_raw_data`.
+# TypedDicts (rather than BaseModels) keep pydantic-core decoding into plain
+# dicts, which is markedly cheaper when a batch holds millions of item rows.
+
+# Numbers arrive from the POS both as JSON numbers and as numeric strings.
+# Trying float first lets pydantic-core coerce both while decoding; anything
+# unparseable (e.g. "") is kept as a string and coerced to NaN afterwards.
+PosNumber = Annotated[Union[float, str, None], Field(union_mode="left_to_right")]
+
+# Identifiers are decoded as text (JSON numbers included, via
+# coerce_numbers_to_str), matching what `->>` yields on the SQL ingestion
+# path, so both modes produce the same invoice and customer keys.
+PosIdentifier = Optional[str]
+
+_POS_CONFIG = ConfigDict(coerce_numbers_to_str=True)
+
+
+@with_config(_POS_CONFIG)
+class PosRestaurant(TypedDict, total=False):
+    res_name: Optional[str]
+
+
+@with_config(_POS_CONFIG)
+class PosCustomer(TypedDict, total=False):
+    name: Optional[str]
+    phone: PosIdentifier
+
+
+@with_config(_POS_CONFIG)
+class PosOrderHeader(TypedDict, total=False):
+    orderID: PosIdentifier
+    created_on: Optional[str]
+    payment_type: Optional[str]
+    order_type: Optional[str]
+    no_of_persons: PosNumber
+    tax_total: PosNumber
+    discount_total: PosNumber
+    delivery_charges: PosNumber
+    round_off: PosNumber
+    total: PosNumber
+    core_total: PosNumber
+
+
+@with_config(_POS_CONFIG)
+class PosOrderItem(TypedDict, total=False):
+    name: Optional[str]
+    price: PosNumber
+    quantity: PosNumber
+    total: PosNumber
+
+
+class PosOrder(TypedDict, total=False):
+    """A single order blob as stored in `orders.pos_raw_data`."""
+    Restaurant: Optional[PosRestaurant]
+    Order: Optional[PosOrderHeader]
+    Customer: Optional[PosCustomer]
+    OrderItem: Optional[List[PosOrderItem]]
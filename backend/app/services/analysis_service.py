@@ -1,53 +1,101 @@
 import asyncio
 import asyncpg
+import numpy as np
 import pandas as pd
+from typing import Any, Dict, Optional, Sequence, Tuple
 
 import logfire
 
+from app.core.config import settings
+from app.core.analysis_config import AnalysisConfig
 from app.schemas.core.enums import AnalysisTypeEnum
 
 from app.crud.analysis_crud import analysis_crud
-from app.utils.preprocessing import preprocess_raw_data
-from app.utils.data_transformer import flatten_order_data_to_dataframe
+from app.crud.customer_kpi_crud import customer_kpi_crud
+from app.utils.preprocessing import PreparedOrders, preprocess_raw_data, concat_preprocessed
+from app.utils.data_transformer import decode_orders_to_dataframe
+from app.utils.analysis_state import AnalysisState, analysis_state_store
+from app.utils.order_snapshot_cache import order_snapshot_cache
+from app.utils.analysis_fingerprint import build_fingerprint
 
-from app.analysis.customer_analysis import run_customer_analysis
-from app.analysis.order_analysis import run_order_analysis
-# from app.analysis.product_analysis import run_product_analysis
+from app.analysis.customer_analysis import CustomerAnalyzer, run_customer_analysis
+from app.analysis.order_analysis import OrderAnalyzer, run_order_analysis
+from app.analysis.traffic_cube import TrafficCube, build_traffic_cube
+from app.analysis.product_analysis import ProductAnalyzer, run_product_analysis
 
 from app.summarization.customer_kpi_summarization import run_customer_summarization
 from app.summarization.order_kpi_summarization import run_order_summarization
-# from app.summarization.product_kpi_summarization import run_product_summarization
+from app.summarization.product_kpi_summarization import run_product_summarization
+
+RFM_MODEL_NAME = "rfm_clustering"
+TRAFFIC_CUBE_NAME = "traffic_cube"
+DEMAND_FORECAST_NAME = "demand_forecast"
+
 
 async def _run_one_analysis( 
     pool: asyncpg.Pool, 
-    df: pd.DataFrame, 
+    orders: PreparedOrders, 
     loyalty_program_id: int, 
-    analysis_type: AnalysisTypeEnum
-):
-    """A generic worker that runs one type of analysis."""
+    analysis_type: AnalysisTypeEnum,
+    traffic_cube: Optional[TrafficCube] = None,
+    **analysis_kwargs
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, np.ndarray]]]:
+    """
+    A generic worker that runs one type of analysis.
+
+    Returns the models and arrays to persist by name; the caller stores them
+    with the state once every analysis succeeded.
+    """
     with logfire.span(
         "run_{analysis_type}_analysis",
         analysis_type=analysis_type.name,
         loyalty_program_id=loyalty_program_id,
-        row_count=len(df)
+        row_count=len(orders)
     ):
         analysis_map = {
             AnalysisTypeEnum.CUSTOMER: (run_customer_analysis, run_customer_summarization),
             AnalysisTypeEnum.ORDER: (run_order_analysis, run_order_summarization),
+            AnalysisTypeEnum.PRODUCT: (run_product_analysis, run_product_summarization),
         }
 
         analysis_func, summarization_func = analysis_map[analysis_type]
-        analysis_results = analysis_func(df)
+        analysis_results = analysis_func(orders, **analysis_kwargs)
 
         summary_dict = None
+        models, arrays = {}, {}
         if analysis_type == AnalysisTypeEnum.CUSTOMER:
-            kpi_df = analysis_results
-            summary_dict = summarization_func(kpi_df)
+            kpi_df, rfm_model = analysis_results
+            models[RFM_MODEL_NAME] = rfm_model
+            customer_count = await customer_kpi_crud.replace_customer_kpis(pool, loyalty_program_id, kpi_df)
+            logfire.debug("Customer KPIs stored", loyalty_program_id=loyalty_program_id, customer_count=customer_count)
+            summary_dict = summarization_func(kpi_df, rfm_score_boundaries=rfm_model.score_boundaries.to_dict())
         elif analysis_type == AnalysisTypeEnum.ORDER:
-            invoice_df, cooc_matrix = analysis_results
-            summary_dict = summarization_func(invoice_df=invoice_df, cooc_matrix=cooc_matrix)
+            invoice_df, cooc_matrix, rules_df = analysis_results
+            config = analysis_kwargs['config']
+            summary_dict = summarization_func(
+                invoice_df=invoice_df,
+                cooc_matrix=cooc_matrix,
+                rules_df=rules_df,
+                rule_thresholds={
+                    "min_item_support": config.min_item_support,
+                    "min_pair_support": config.min_pair_support,
+                    # Incremental runs only derive pair rules from the persisted counts
+                    "max_itemset_size": analysis_kwargs['max_itemset_size'] if analysis_kwargs['full_rule_mining'] else 2
+                },
+                pair_count_error_bound=getattr(analysis_kwargs.get('pair_counter'), 'error_bound', None),
+                traffic_cube=traffic_cube
+            )
+        elif analysis_type == AnalysisTypeEnum.PRODUCT:
+            performance, _daily_df, hourly_df, _monthly_df, demand_forecast = analysis_results
+            if demand_forecast is not None:
+                arrays[DEMAND_FORECAST_NAME] = demand_forecast.to_arrays()
+            summary_dict = summarization_func(
+                performance, hourly_df=hourly_df, traffic_cube=traffic_cube, demand_forecast=demand_forecast
+            )
 
         if summary_dict:
+            # Lets consumers (e.g. offer generation) tell whether anything material changed
+            summary_dict["fingerprint"] = build_fingerprint(analysis_type, summary_dict)
             await analysis_crud.save_analysis_result(
                 pool=pool,
                 loyalty_program_id=loyalty_program_id,
@@ -66,38 +114,269 @@ async def _run_one_analysis(
                 loyalty_program_id=loyalty_program_id
             )
 
+        return models, arrays
+
+
+async def _load_orders_streaming(
+    pool: asyncpg.Pool,
+    loyalty_program_id: int,
+    since_order_id: int,
+    upto_order_id: int,
+    banned_item_terms: Sequence[str]
+) -> Optional[pd.DataFrame]:
+    """
+    Streams the raw JSON orders from the database in bounded batches,
+    decoding each batch into flat item rows and preprocessing it before
+    the next one is fetched.
+    """
+    order_count = 0
+    batch_frames = []
+    async for raw_orders in analysis_crud.stream_order_batches(
+        pool,
+        loyalty_program_id,
+        since_order_id=since_order_id,
+        upto_order_id=upto_order_id,
+        batch_size=settings.ORDER_FETCH_BATCH_SIZE
+    ):
+        order_count += len(raw_orders)
+        flat_df = decode_orders_to_dataframe(raw_orders)
+        if not flat_df.empty:
+            batch_frames.append(preprocess_raw_data(flat_df, banned_item_terms=banned_item_terms))
+
+    logfire.debug("Orders fetched", order_count=order_count, batch_count=len(batch_frames))
+
+    if not batch_frames:
+        return None
+    return concat_preprocessed(batch_frames)
+
+
+async def _load_orders_sql(
+    pool: asyncpg.Pool,
+    loyalty_program_id: int,
+    since_order_id: int,
+    upto_order_id: int,
+    banned_item_terms: Sequence[str]
+) -> Optional[pd.DataFrame]:
+    """Lets Postgres flatten the order items, then preprocesses the copied rows."""
+    flat_df = await analysis_crud.get_flattened_order_items(
+        pool, loyalty_program_id, since_order_id=since_order_id, upto_order_id=upto_order_id
+    )
+
+    logfire.debug("Order items fetched", item_row_count=len(flat_df))
+
+    if flat_df.empty:
+        return None
+    return preprocess_raw_data(flat_df, banned_item_terms=banned_item_terms)
+
+
+def _analysis_settings(config: AnalysisConfig) -> Dict[str, Any]:
+    """Everything besides the orders that shapes the results; a change re-runs the analyses."""
+    return {
+        **config.to_dict(),
+        "rfm_clustering_mode": settings.RFM_CLUSTERING_MODE,
+        "rfm_minibatch_min_customers": settings.RFM_MINIBATCH_MIN_CUSTOMERS,
+        "rfm_auto_cluster_count": settings.RFM_AUTO_CLUSTER_COUNT,
+        "association_rule_max_itemset_size": settings.ASSOCIATION_RULE_MAX_ITEMSET_SIZE
+    }
+
+
+def _merge_new_orders(
+    state: Optional[AnalysisState],
+    history_df: Optional[pd.DataFrame],
+    new_df: Optional[pd.DataFrame],
+    upto_order_id: int,
+    config: AnalysisConfig
+) -> Tuple[Optional[AnalysisState], Optional[pd.DataFrame]]:
+    """
+    Folds newly ingested rows into the persisted state and returns it with
+    the full preprocessed frame. Invoice aggregates, pair and item counts,
+    item slots and customer statistics are updated for the touched invoices
+    and customers only; with no previous state everything is built from `new_df`.
+    """
+    analyzer = OrderAnalyzer()
+    customer_analyzer = CustomerAnalyzer()
+    product_analyzer = ProductAnalyzer(config)
+
+    if state is None:
+        if new_df is None:
+            return None, None
+        customer_stats, customer_name_counts = customer_analyzer.compute_customer_stats(
+            customer_analyzer.prepare_customer_data(new_df)
+        )
+        state = AnalysisState(
+            last_order_id=upto_order_id,
+            last_order_date=new_df['date'].max(),
+            invoices=analyzer.compute_invoice_aggregation(new_df),
+            pair_counts=analyzer.build_pair_counts(new_df, config),
+            item_counts=analyzer.count_items(new_df),
+            item_invoice_counts=analyzer.count_item_invoices(new_df),
+            item_slots=product_analyzer.compute_item_slots(new_df),
+            customer_stats=customer_stats,
+            customer_name_counts=customer_name_counts,
+            banned_item_terms=tuple(config.banned_item_terms),
+            analysis_settings=_analysis_settings(config)
+        )
+        return state, new_df
+
+    orders_df = history_df
+    if new_df is not None:
+        state.invoices, state.pair_counts, state.item_counts, state.item_invoice_counts = analyzer.fold_new_orders(
+            history_df=history_df,
+            new_df=new_df,
+            invoice_df=state.invoices,
+            pair_counter=state.pair_counts,
+            item_counter=state.item_counts,
+            item_invoice_counter=state.item_invoice_counts,
+            config=config
+        )
+        state.item_slots = product_analyzer.fold_new_orders(history_df, new_df, state.item_slots)
+        state.customer_stats, state.customer_name_counts = customer_analyzer.fold_new_orders(
+            history_df=history_df,
+            new_df=new_df,
+            customer_stats=state.customer_stats,
+            name_counts=state.customer_name_counts
+        )
+        orders_df = concat_preprocessed([history_df, new_df])
+        state.last_order_date = max(state.last_order_date, new_df['date'].max())
+
+    state.last_order_id = upto_order_id
+    state.analysis_settings = _analysis_settings(config)
+    return state, orders_df
+
 
 @logfire.instrument("trigger_all_analyses for {loyalty_program_id}")
-async def trigger_all_analyses(pool: asyncpg.Pool, loyalty_program_id: int):
+async def trigger_all_analyses(pool: asyncpg.Pool, loyalty_program_id: int, full_rebuild: bool = False):
     """
     Orchestrator that fetches data, transforms it, preprocesses, 
     and then runs all analysis types concurrently.
+
+    Only orders newer than the program's watermark are fetched; they are
+    merged into the persisted state before the analyses run. The state (and
+    so the watermark) is only saved once every analysis succeeded, so a
+    failed run is redone by the next trigger. With no new orders the run is
+    skipped unless the analysis settings changed, in which case the analyses
+    re-run from the cached snapshot. `full_rebuild` discards the state and
+    re-ingests the whole order history, e.g. after historical orders were
+    corrected.
     """
-    # 1. Fetch the raw list of nested JSON orders from the database
-    raw_orders_list = await analysis_crud.get_all_orders_as_list(pool, loyalty_program_id)
-    
-    if not raw_orders_list:
+    config = AnalysisConfig.for_program(loyalty_program_id)
+
+    state, history_df = None, None
+    if full_rebuild:
+        analysis_state_store.clear(loyalty_program_id)
+        order_snapshot_cache.invalidate(loyalty_program_id)
+    else:
+        state = analysis_state_store.load(loyalty_program_id)
+        if state is not None and state.banned_item_terms != config.banned_item_terms:
+            # Rows were filtered with a different banned list; re-ingest everything
+            logfire.info("Banned item terms changed, rebuilding", loyalty_program_id=loyalty_program_id)
+            state = None
+
+    if state is not None:
+        history_df = order_snapshot_cache.load(loyalty_program_id, state.last_order_id)
+        if history_df is None:
+            # The rows behind the aggregates were evicted; start over
+            logfire.info("Order snapshot missing, rebuilding", loyalty_program_id=loyalty_program_id)
+            state = None
+
+    since_order_id = state.last_order_id if state else 0
+    upto_order_id = await analysis_crud.get_latest_order_id(pool, loyalty_program_id)
+
+    if upto_order_id is None:
         logfire.warn("No orders found, aborting analysis", loyalty_program_id=loyalty_program_id)
         return
-    
-    logfire.debug("Orders fetched", order_count=len(raw_orders_list))
-        
-    # 2. Transform the nested JSON into a flat DataFrame
-    flat_df = flatten_order_data_to_dataframe(raw_orders_list)
 
-    # 3. Preprocess
-    preprocessed_df = preprocess_raw_data(flat_df)
+    has_new_orders = upto_order_id > since_order_id
+    if not has_new_orders:
+        if state.analysis_settings == _analysis_settings(config):
+            logfire.info("No new orders since last analysis", loyalty_program_id=loyalty_program_id, last_order_id=since_order_id)
+            return
+        logfire.info("Analysis settings changed, re-running from snapshot", loyalty_program_id=loyalty_program_id)
+        upto_order_id = since_order_id
 
-    # 4. Run all analysis pipelines in parallel
+    # 1-3. Fetch, flatten and preprocess the new orders using the configured ingestion path
+    if not has_new_orders:
+        new_df = None
+    elif settings.ORDER_INGESTION_MODE == "sql":
+        new_df = await _load_orders_sql(
+            pool, loyalty_program_id, since_order_id, upto_order_id, config.banned_item_terms
+        )
+    else:
+        new_df = await _load_orders_streaming(
+            pool, loyalty_program_id, since_order_id, upto_order_id, config.banned_item_terms
+        )
+
+    state, preprocessed_df = _merge_new_orders(
+        state, history_df, new_df, upto_order_id, config
+    )
+
+    if state is None:
+        logfire.warn("No usable orders found, aborting analysis", loyalty_program_id=loyalty_program_id)
+        return
+
+    # 4. Run all analysis pipelines in parallel over one shared, read-only frame
+    orders = PreparedOrders(frame=preprocessed_df, banned_item_terms=config.banned_item_terms)
+
+    # Weekday x hour traffic, built once and sliced by the summaries
+    traffic_cube = build_traffic_cube(
+        state.invoices,
+        state.item_slots,
+        OrderAnalyzer().rank_items(state.item_counts).index[:config.top_n_items]
+    )
     results = await asyncio.gather(
-        _run_one_analysis(pool, preprocessed_df.copy(), loyalty_program_id, AnalysisTypeEnum.CUSTOMER),
-        _run_one_analysis(pool, preprocessed_df.copy(), loyalty_program_id, AnalysisTypeEnum.ORDER),
+        _run_one_analysis(
+            pool, orders, loyalty_program_id, AnalysisTypeEnum.CUSTOMER,
+            customer_stats=state.customer_stats, name_counts=state.customer_name_counts,
+            rfm_model=analysis_state_store.load_model(loyalty_program_id, RFM_MODEL_NAME),
+            rfm_mode=settings.RFM_CLUSTERING_MODE,
+            rfm_minibatch_min_customers=settings.RFM_MINIBATCH_MIN_CUSTOMERS,
+            rfm_auto_k=settings.RFM_AUTO_CLUSTER_COUNT,
+            config=config
+        ),
+        _run_one_analysis(
+            pool, orders, loyalty_program_id, AnalysisTypeEnum.ORDER,
+            traffic_cube=traffic_cube,
+            invoice_df=state.invoices, pair_counter=state.pair_counts, item_counter=state.item_counts,
+            item_invoice_counter=state.item_invoice_counts,
+            config=config, max_itemset_size=settings.ASSOCIATION_RULE_MAX_ITEMSET_SIZE,
+            # Rows are scanned anyway when the state was just built; incremental runs use the counts
+            full_rule_mining=since_order_id == 0
+        ),
+        _run_one_analysis(
+            pool, orders, loyalty_program_id, AnalysisTypeEnum.PRODUCT,
+            traffic_cube=traffic_cube, item_slots=state.item_slots, config=config
+        ),
         return_exceptions=True
     )
     
     # Log any failures
-    for analysis_type, result in zip([AnalysisTypeEnum.CUSTOMER, AnalysisTypeEnum.ORDER], results):
+    failed = False
+    for analysis_type, result in zip([AnalysisTypeEnum.CUSTOMER, AnalysisTypeEnum.ORDER, AnalysisTypeEnum.PRODUCT], results):
         if isinstance(result, Exception):
+            failed = True
             logfire.error("Analysis failed", analysis_type=analysis_type.name, exc_info=result)
+
+    if failed:
+        # Keep the previous watermark so the next trigger redoes these orders
+        logfire.warn("Analysis state not advanced", loyalty_program_id=loyalty_program_id, last_order_id=since_order_id)
+        return
+
+    # Snapshot and artifacts first: a state file never points at a watermark without them
+    if has_new_orders:
+        order_snapshot_cache.store(loyalty_program_id, state.last_order_id, preprocessed_df)
+    arrays = {TRAFFIC_CUBE_NAME: traffic_cube.to_arrays()}
+    for result_models, result_arrays in results:
+        for name, model in result_models.items():
+            analysis_state_store.save_model(loyalty_program_id, name, model)
+        arrays.update(result_arrays)
+    for name, named_arrays in arrays.items():
+        analysis_state_store.save_arrays(loyalty_program_id, name, named_arrays)
+    analysis_state_store.save(loyalty_program_id, state)
+    logfire.debug(
+        "Analysis state updated",
+        incremental=since_order_id > 0,
+        new_item_rows=0 if new_df is None else len(new_df),
+        last_order_id=state.last_order_id
+    )
     
     logfire.info("All analyses complete", loyalty_program_id=loyalty_program_id)
\ No newline at end of file
@@ -7,8 +7,9 @@ from app.agents.registry import get_agent
 from app.utils.message_parser import parser
 from app.crud.chat_crud import chat_crud
 from app.crud.analysis_crud import analysis_crud
+from app.utils.analysis_context import build_analysis_context
 from app.schemas import AnalysisTypeEnum, AgentTypeEnum, AgentCategoryEnum, MessageTypeEnum
-from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart
+from pydantic_ai.messages import ModelMessage
 
 async def chat(pool: asyncpg.Pool, content: str, agent_type: AgentTypeEnum, agent_category: AgentCategoryEnum, loyalty_program_id: int) -> ChatMessageResponse:
     
@@ -23,13 +24,11 @@ async def chat(pool: asyncpg.Pool, content: str, agent_type: AgentTypeEnum, agen
 
     customer_analysis_result, order_analysis_result = await asyncio.gather(*tasks)
     # customer_analysis_result, order_analysis_result, product_analysis_result = await asyncio.gather(*tasks)
-    customer_analysis = customer_analysis_result["analysis_json"] if customer_analysis_result else None
-    order_analysis = order_analysis_result["analysis_json"] if order_analysis_result else None
-    # product_analysis = product_analysis_result["analysis_json"] if product_analysis_result else None
-
-    message_history.append(ModelResponse(parts=[TextPart(content=customer_analysis)]))
-    message_history.append(ModelResponse(parts=[TextPart(content=order_analysis)]))
-    # message_history.append(ModelResponse(parts=[TextPart(content=product_analysis)]))
+    message_history += build_analysis_context({
+        AnalysisTypeEnum.CUSTOMER: customer_analysis_result,
+        AnalysisTypeEnum.ORDER: order_analysis_result,
+        # AnalysisTypeEnum.PRODUCT: product_analysis_result
+    })
 
     agent = get_agent(agent_type.name, agent_category.name)
 
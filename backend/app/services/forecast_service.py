@@ -8,6 +8,7 @@ from app.crud.analysis_crud import analysis_crud
 from app.crud.offer_crud import offer_crud
 from app.schemas.core.enums import AnalysisTypeEnum
 from app.agents.registry import get_agent
+from app.utils.analysis_context import build_analysis_context
 
 
 @logfire.instrument("generate_forecast for template {template_id}")
@@ -20,14 +21,14 @@ async def generate_forecast(
     Generate forecast for a specific template's offers.
     
     Flow:
-    1. Fetch customer analysis, order analysis, and latest offer data
+    1. Fetch customer, order and product analysis (with its demand baselines), and latest offer data
     2. Build message history from these contexts
     3. Run forecast agent to predict offer performance
     4. Update the offer records with forecast data
     """
     print(f"Starting forecast generation for template {template_id}, loyalty program {loyalty_program_id}")
     
-    customer_analysis_result, order_analysis_result, offer_result = await asyncio.gather(
+    customer_analysis_result, order_analysis_result, product_analysis_result, offer_result = await asyncio.gather(
         analysis_crud.get_latest_analysis_result(
             pool=pool, 
             loyalty_program_id=loyalty_program_id, 
@@ -38,6 +39,11 @@ async def generate_forecast(
             loyalty_program_id=loyalty_program_id, 
             analysis_type=AnalysisTypeEnum.ORDER.value
         ),
+        analysis_crud.get_latest_analysis_result(
+            pool=pool, 
+            loyalty_program_id=loyalty_program_id, 
+            analysis_type=AnalysisTypeEnum.PRODUCT.value
+        ),
         offer_crud.get_latest_offer(
             pool=pool, 
             loyalty_program_id=loyalty_program_id, 
@@ -49,20 +55,16 @@ async def generate_forecast(
         "Context fetched",
         has_customer_analysis=customer_analysis_result is not None,
         has_order_analysis=order_analysis_result is not None,
+        has_product_analysis=product_analysis_result is not None,
         has_offer=offer_result is not None
     )
     
-    message_history: list[ModelMessage] = []
-    
-    if customer_analysis_result:
-        message_history.append(
-            ModelResponse(parts=[TextPart(content=customer_analysis_result["analysis_json"])])
-        )
-    
-    if order_analysis_result:
-        message_history.append(
-            ModelResponse(parts=[TextPart(content=order_analysis_result["analysis_json"])])
-        )
+    # The product analysis carries the per-item and program demand baselines for the next weeks
+    message_history: list[ModelMessage] = build_analysis_context({
+        AnalysisTypeEnum.CUSTOMER: customer_analysis_result,
+        AnalysisTypeEnum.ORDER: order_analysis_result,
+        AnalysisTypeEnum.PRODUCT: product_analysis_result
+    })
     
     if offer_result:
         message_history.append(
@@ -72,7 +74,7 @@ async def generate_forecast(
         logfire.error("No offer found", template_id=template_id, loyalty_program_id=loyalty_program_id)
         raise ValueError(f"No offer found for template {template_id}. Generate offers first.")
     
-    user_prompt = "Analyze the potential impact and forecast outcomes for these offers based on the customer and order analysis data."
+    user_prompt = "Analyze the potential impact and forecast outcomes for these offers based on the customer, order and product analysis data, using the demand baselines as the no-offer reference."
     
     agent = get_agent(agent_type="forecast", agent_category="forecast")
     result = await agent.run(user_prompt=user_prompt, message_history=message_history)
@@ -1,9 +1,10 @@
 import asyncpg
 import asyncio
 import uuid
+from typing import Any, Dict, Optional
 
 import logfire
-from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart
+from pydantic_ai.messages import ModelMessage
 
 from app.schemas.templates.registry import TEMPLATE_REGISTRY, get_template_config
 from app.schemas.templates.models import TemplateConfig
@@ -12,17 +13,48 @@ from app.agents.registry import get_agent
 from app.crud.analysis_crud import analysis_crud
 from app.crud.offer_crud import offer_crud
 from app.utils.offer_forecast_splitter import separate_forecast_from_offers
+from app.utils.analysis_context import build_analysis_context
+from app.utils.analysis_fingerprint import material_change, stored_fingerprint
+from app.utils.analysis_state import analysis_state_store
+from app.core.config import settings
 
 
 @logfire.instrument("generate_all_templates for {loyalty_program_id}")
 async def generate_all_templates(
     pool: asyncpg.Pool,
-    loyalty_program_id: int
+    loyalty_program_id: int,
+    force: bool = False
 ):
     """
     Public API: Generate ALL registered templates in parallel.
+
+    When the customer and order analyses changed less than
+    OFFER_REGENERATION_MIN_CHANGE since the last complete generation, the
+    previous offers are kept and nothing is generated, unless `force` is set.
     """
-    message_history = await _fetch_analysis_context(pool, loyalty_program_id)
+    analysis_results = await _fetch_analysis_results(pool, loyalty_program_id)
+    fingerprints = {
+        analysis_type.name: stored_fingerprint(analysis_type, result)
+        for analysis_type, result in analysis_results.items() if result
+    }
+
+    # Without any analysis there is nothing to compare, so offers are always generated
+    if not force and fingerprints:
+        basis = analysis_state_store.load_offer_basis(loyalty_program_id)
+        if basis is not None:
+            change = max(
+                (material_change(basis.get(name), fingerprint) for name, fingerprint in fingerprints.items()),
+                default=1.0
+            ) if fingerprints.keys() == basis.keys() else 1.0
+            if change < settings.OFFER_REGENERATION_MIN_CHANGE:
+                logfire.info(
+                    "Analysis not materially changed, keeping previous offers",
+                    loyalty_program_id=loyalty_program_id,
+                    material_change=change
+                )
+                return []
+
+    message_history = build_analysis_context(analysis_results)
     
     user_prompt = (
         f"Generate offers for loyalty program {loyalty_program_id} based on the analysis data. "
@@ -51,6 +83,10 @@ async def generate_all_templates(
         success=success_count,
         failed=len(results) - success_count
     )
+
+    # Only a complete generation can be reused; after any failure the next call regenerates
+    if success_count == len(results) and fingerprints:
+        analysis_state_store.save_offer_basis(loyalty_program_id, fingerprints)
     
     return results
 
@@ -60,7 +96,15 @@ async def _fetch_analysis_context(
     pool: asyncpg.Pool,
     loyalty_program_id: int
 ) -> list[ModelMessage]:
-    """Fetch customer and order analysis to build message history."""
+    """Fetch customer and order analysis to build a compact, token-budgeted message history."""
+    return build_analysis_context(await _fetch_analysis_results(pool, loyalty_program_id))
+
+
+async def _fetch_analysis_results(
+    pool: asyncpg.Pool,
+    loyalty_program_id: int
+) -> Dict[AnalysisTypeEnum, Optional[Dict[str, Any]]]:
+    """Latest customer and order analysis results (None where missing)."""
     customer_analysis_result, order_analysis_result = await asyncio.gather(
         analysis_crud.get_latest_analysis_result(
             pool=pool, 
@@ -74,17 +118,10 @@ async def _fetch_analysis_context(
         ),
     )
     
-    message_history: list[ModelMessage] = []
-    if customer_analysis_result:
-        message_history.append(
-            ModelResponse(parts=[TextPart(content=customer_analysis_result["analysis_json"])])
-        )
-    if order_analysis_result:
-        message_history.append(
-            ModelResponse(parts=[TextPart(content=order_analysis_result["analysis_json"])])
-        )
-    
-    return message_history
+    return {
+        AnalysisTypeEnum.CUSTOMER: customer_analysis_result,
+        AnalysisTypeEnum.ORDER: order_analysis_result
+    }
 
 
 async def _run_one_template_generation(
@@ -1,8 +1,15 @@
 import pandas as pd
 import numpy as np
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from dataclasses import dataclass
 
+from app.analysis.customer_analysis import label_segments
+from app.schemas.core.enums import CustomerSegmentEnum
+
+NEW = CustomerSegmentEnum.NEW.value
+ACTIVE = CustomerSegmentEnum.ACTIVE.value
+DORMANT = CustomerSegmentEnum.DORMANT.value
+
 @dataclass
 class CustomerSegments:
     total_customers: int
@@ -10,75 +17,119 @@ class CustomerSegments:
     active_customers: Dict[str, Any]
     dormant_customers: Dict[str, Any]
 
+@dataclass
+class CustomerProfile:
+    """
+    Everything the summary sections need, from one labelling pass and one
+    grouped aggregation over the segment column. `segment_stats` has one
+    row per CustomerSegmentEnum value, empty segments included.
+    """
+    total_customers: int
+    segment_stats: pd.DataFrame
+    segments: np.ndarray         # CustomerSegmentEnum value per customer
+    orders: np.ndarray           # Total_Orders_Placed
+    spend: np.ndarray            # Total_Spend_By_Customer
+    days_since_last_order: pd.Series
+
 class CustomerKPIAnalyzer:
-    
-    def _safe_mean(self, series: pd.Series, default: float = 0.0) -> float:
-        """Calculate mean, returning default if result is NaN."""
-        result = series.mean()
-        return float(round(result, 2)) if pd.notna(result) else default
-    
+
+    def _safe_mean(self, mean: float, default: float = 0.0) -> float:
+        """Round a mean, returning default if it is NaN."""
+        return float(round(mean, 2)) if pd.notna(mean) else default
+
     def _safe_value(self, value: float, default: float = 0.0) -> float:
         """Return value if valid, else default."""
         return float(round(value, 2)) if pd.notna(value) and not np.isinf(value) else default
 
-    def segment_customers(self, df: pd.DataFrame) -> CustomerSegments:
-        total_customers = len(df)
+    def profile_customers(self, df: pd.DataFrame) -> CustomerProfile:
+        """
+        Labels every customer once (reusing the KPI master's Segment column
+        when present) and aggregates the per-segment figures in one groupby.
+        """
+        if 'Segment' in df.columns:
+            segments = df['Segment'].to_numpy()
+        else:
+            segments = label_segments(df['Days_Since_First_Order'], df['Days_Since_Last_Order'])
+        orders = df['Total_Orders_Placed'].to_numpy()
+
+        keyed = pd.DataFrame({
+            'segment': pd.Categorical(segments, categories=[segment.value for segment in CustomerSegmentEnum]),
+            'spend': df['Total_Spend_By_Customer'].to_numpy(),
+            'spend_per_order': df['Average_Spend_Per_Order'].to_numpy(),
+            'orders': orders,
+            'repeat': orders > 1
+        }, copy=False)
+        segment_stats = keyed.groupby('segment', observed=False).agg(
+            count=('orders', 'size'),
+            spend_sum=('spend', 'sum'),
+            spend_count=('spend', 'count'),
+            avg_spend=('spend', 'mean'),
+            avg_spend_per_order=('spend_per_order', 'mean'),
+            orders_sum=('orders', 'sum'),
+            avg_orders=('orders', 'mean'),
+            repeat_customers=('repeat', 'sum')
+        )
+
+        return CustomerProfile(
+            total_customers=len(df),
+            segment_stats=segment_stats,
+            segments=segments,
+            orders=orders,
+            spend=keyed['spend'].to_numpy(),
+            days_since_last_order=df['Days_Since_Last_Order']
+        )
 
-        new_customers_df = df[df['Days_Since_First_Order'] <= 30]
-        dormant_customers_df = df[
-            (df['Days_Since_Last_Order'] > 60) &
-            (df['Days_Since_First_Order'] > 30)
-        ]
-        active_mask = ~df.index.isin(new_customers_df.index) & ~df.index.isin(dormant_customers_df.index)
-        active_customers_df = df[active_mask]
+    def _percentage(self, count: int, total: int) -> float:
+        return round(count / total * 100, 2) if total else 0
+
+    def segment_customers(self, profile: CustomerProfile) -> CustomerSegments:
+        total_customers = profile.total_customers
+        new, active, dormant = (profile.segment_stats.loc[segment] for segment in (NEW, ACTIVE, DORMANT))
 
         return CustomerSegments(
             total_customers=total_customers,
             new_customers={
-                "count": len(new_customers_df),
-                "percentage": round(len(new_customers_df) / total_customers * 100, 2) if total_customers else 0,
-                "avg_first_order_value": self._safe_mean(new_customers_df['Average_Spend_Per_Order']) if len(new_customers_df) > 0 else 0
+                "count": int(new['count']),
+                "percentage": self._percentage(new['count'], total_customers),
+                "avg_first_order_value": self._safe_mean(new['avg_spend_per_order']) if new['count'] > 0 else 0
             },
             active_customers={
-                "count": len(active_customers_df),
-                "percentage": round(len(active_customers_df) / total_customers * 100, 2) if total_customers else 0,
-                "avg_clv": self._safe_mean(active_customers_df['Total_Spend_By_Customer']) if len(active_customers_df) > 0 else 0,
-                "avg_orders": self._safe_mean(active_customers_df['Total_Orders_Placed']) if len(active_customers_df) > 0 else 0
+                "count": int(active['count']),
+                "percentage": self._percentage(active['count'], total_customers),
+                "avg_clv": self._safe_mean(active['avg_spend']) if active['count'] > 0 else 0,
+                "avg_orders": self._safe_mean(active['avg_orders']) if active['count'] > 0 else 0
             },
             dormant_customers={
-                "count": len(dormant_customers_df),
-                "percentage": round(len(dormant_customers_df) / total_customers * 100, 2) if total_customers else 0,
-                "avg_clv_before_dormancy": self._safe_mean(dormant_customers_df['Total_Spend_By_Customer']) if len(dormant_customers_df) > 0 else 0
+                "count": int(dormant['count']),
+                "percentage": self._percentage(dormant['count'], total_customers),
+                "avg_clv_before_dormancy": self._safe_mean(dormant['avg_spend']) if dormant['count'] > 0 else 0
             }
         )
 
-    def analyze_financials(self, df: pd.DataFrame) -> Dict[str, Any]:
-        total_revenue = self._safe_value(df['Total_Spend_By_Customer'].sum())
-        total_orders = df['Total_Orders_Placed'].sum()
-        
+    def analyze_financials(self, profile: CustomerProfile) -> Dict[str, Any]:
+        stats = profile.segment_stats
+        total_revenue = self._safe_value(stats['spend_sum'].sum())
+        total_orders = stats['orders_sum'].sum()
+        spend_count = stats['spend_count'].sum()
+
         return {
             "total_revenue": total_revenue,
             "estimated_total_profit": round(total_revenue * 0.25, 2),
             "overall_aov": self._safe_value(total_revenue / total_orders) if total_orders > 0 else 0,
-            "overall_avg_clv": self._safe_mean(df['Total_Spend_By_Customer'])
+            "overall_avg_clv": self._safe_mean(stats['spend_sum'].sum() / spend_count) if spend_count else 0.0
         }
 
-    def coupon_insights(self, segments: CustomerSegments, df: pd.DataFrame) -> Dict[str, Any]:
-        active_multi_order = df[
-            (df['Total_Orders_Placed'] > 1) &
-            ~df.index.isin(df[df['Days_Since_First_Order'] <= 30].index) &
-            ~df.index.isin(df[(df['Days_Since_Last_Order'] > 60) & (df['Days_Since_First_Order'] > 30)].index)
-        ]
-        dormant_df = df[(df['Days_Since_Last_Order'] > 60) & (df['Days_Since_First_Order'] > 30)]
-        new_df = df[df['Days_Since_First_Order'] <= 30]
+    def coupon_insights(self, segments: CustomerSegments, profile: CustomerProfile) -> Dict[str, Any]:
+        stats = profile.segment_stats
 
         # Stamp card suggestion
-        if len(active_multi_order) > 0:
-            stats = active_multi_order['Total_Orders_Placed'].describe()
+        if stats.loc[ACTIVE, 'repeat_customers'] > 0:
+            stamp_card_orders = profile.orders[(profile.segments == ACTIVE) & (profile.orders > 1)]
+            order_stats = pd.Series(stamp_card_orders).describe()
             stamp_card = {
-                "target_customer_count": len(active_multi_order),
-                "order_frequency_distribution": {k: self._safe_value(v) for k, v in stats.items()},
-                "suggestion": f"Most active customers place between {int(stats['25%'])} and {int(stats['75%'])} orders. Recommend 5 or 7 stamp card."
+                "target_customer_count": len(stamp_card_orders),
+                "order_frequency_distribution": {k: self._safe_value(v) for k, v in order_stats.items()},
+                "suggestion": f"Most active customers place between {int(order_stats['25%'])} and {int(order_stats['75%'])} orders. Recommend 5 or 7 stamp card."
             }
         else:
             stamp_card = {
@@ -88,11 +139,12 @@ class CustomerKPIAnalyzer:
             }
 
         # Miss you
-        if len(dormant_df) > 0:
-            recency_stats = df['Days_Since_Last_Order'].describe()
+        dormant_count = segments.dormant_customers["count"]
+        if dormant_count > 0:
+            recency_stats = profile.days_since_last_order.describe()
             miss_you = {
-                "target_customer_count": len(dormant_df),
-                "avg_spend_of_dormant_customers": self._safe_mean(dormant_df['Average_Spend_Per_Order']),
+                "target_customer_count": dormant_count,
+                "avg_spend_of_dormant_customers": self._safe_mean(stats.loc[DORMANT, 'avg_spend_per_order']),
                 "last_order_recency_distribution": {k: self._safe_value(v) for k, v in recency_stats.items()},
                 "suggestion": "A win-back offer should be compelling relative to these averages."
             }
@@ -105,10 +157,11 @@ class CustomerKPIAnalyzer:
             }
 
         # Joining bonus
-        if len(new_df) > 0:
+        new_count = segments.new_customers["count"]
+        if new_count > 0:
             joining = {
-                "target_customer_count": len(new_df),
-                "avg_first_order_value": self._safe_mean(new_df['Average_Spend_Per_Order']),
+                "target_customer_count": new_count,
+                "avg_first_order_value": self._safe_mean(stats.loc[NEW, 'avg_spend_per_order']),
                 "suggestion": "Offer joining bonuses cautiously to protect margins."
             }
         else:
@@ -124,30 +177,32 @@ class CustomerKPIAnalyzer:
             "joining_bonus": joining
         }
 
-    def additional_insights(self, df: pd.DataFrame) -> Dict[str, Any]:
-        top20_threshold = df['Total_Spend_By_Customer'].quantile(0.8)
-        high_value_df = df[df['Total_Spend_By_Customer'] > top20_threshold]
-        
+    def additional_insights(self, profile: CustomerProfile) -> Dict[str, Any]:
+        spend, orders = profile.spend, profile.orders
+        top20_threshold = np.nanquantile(spend, 0.8) if len(spend) else np.nan
+        high_value = spend > top20_threshold
+
         return {
             "high_value_customers": {
-                "count": len(high_value_df),
+                "count": int(np.count_nonzero(high_value)),
                 "threshold": self._safe_value(top20_threshold),
-                "avg_clv": self._safe_mean(high_value_df['Total_Spend_By_Customer'])
+                "avg_clv": self._safe_mean(spend[high_value].mean()) if high_value.any() else 0.0
             },
             "order_frequency_insights": {
-                "single_order_customers": len(df[df['Total_Orders_Placed'] == 1]),
-                "repeat_customers": len(df[df['Total_Orders_Placed'] > 1]),
-                "high_frequency_customers": len(df[df['Total_Orders_Placed'] >= 5])
+                "single_order_customers": int(np.count_nonzero(orders == 1)),
+                "repeat_customers": int(profile.segment_stats['repeat_customers'].sum()),
+                "high_frequency_customers": int(np.count_nonzero(orders >= 5))
             }
         }
 
-def run_customer_summarization(customer_df: pd.DataFrame):
+def run_customer_summarization(customer_df: pd.DataFrame, rfm_score_boundaries: Optional[Dict[str, List[float]]] = None):
     analyzer = CustomerKPIAnalyzer()
 
-    segments = analyzer.segment_customers(customer_df)
-    financials = analyzer.analyze_financials(customer_df)
-    coupons = analyzer.coupon_insights(segments, customer_df)
-    additional = analyzer.additional_insights(customer_df)
+    profile = analyzer.profile_customers(customer_df)
+    segments = analyzer.segment_customers(profile)
+    financials = analyzer.analyze_financials(profile)
+    coupons = analyzer.coupon_insights(segments, profile)
+    additional = analyzer.additional_insights(profile)
 
     summary = {
         "analysis_timestamp": pd.Timestamp.now().isoformat(),
@@ -156,5 +211,8 @@ def run_customer_summarization(customer_df: pd.DataFrame):
         "coupon_strategy_insights": coupons,
         "additional_insights": additional
     }
+    if rfm_score_boundaries is not None:
+        # Quintile edges behind the 1-5 RFM scores, for scoring customers between runs
+        summary["rfm_score_boundaries"] = rfm_score_boundaries
 
     return summary
@@ -1,9 +1,13 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
+import numpy as np
 import pandas as pd
 
+from app.analysis.traffic_cube import TrafficCube, HOURS
+from app.utils.preprocessing import WEEKDAY_NAMES
+
 class OrderAnalysisSummarizer:
 
-    def analyze_order_patterns(self, invoice_df: pd.DataFrame) -> Dict[str, Any]:
+    def analyze_order_patterns(self, invoice_df: pd.DataFrame, traffic_cube: Optional[TrafficCube] = None) -> Dict[str, Any]:
         """Analyze order patterns and generate KPIs"""
         # --- SENSIBLE DEFAULT: Using the 80th percentile for high-value orders ---
         high_value_percentile = 0.8
@@ -21,7 +25,10 @@ class OrderAnalysisSummarizer:
         basket_stats = invoice_df['basket_size'].describe()
        
         # Temporal patterns
-        temporal_patterns = self._analyze_temporal_patterns(invoice_df)
+        if traffic_cube is not None:
+            temporal_patterns = self._analyze_cube_temporal_patterns(traffic_cube)
+        else:
+            temporal_patterns = self._analyze_temporal_patterns(invoice_df)
        
         return {
             "total_orders": total_invoices,
@@ -52,9 +59,9 @@ class OrderAnalysisSummarizer:
             "temporal_patterns": temporal_patterns
         }
    
-    def analyze_cooccurrence_patterns(self, cooc_matrix: pd.DataFrame) -> Dict[str, Any]:
+    def analyze_cooccurrence_patterns(self, cooc_matrix: pd.DataFrame, top_pairs: int = 15) -> Dict[str, Any]:
         """Analyze co-occurrence patterns"""
-        strongest_pairs = self._extract_strongest_pairs(cooc_matrix)
+        strongest_pairs = self._extract_strongest_pairs(cooc_matrix, top_k=top_pairs)
        
         # --- MORE ROBUST: Get the scope directly from the input matrix ---
         items_in_scope = len(cooc_matrix.index)
@@ -69,6 +76,21 @@ class OrderAnalysisSummarizer:
             }
         }
    
+    def analyze_association_rules(self, rules_df: pd.DataFrame, max_rules: int = 15) -> List[Dict[str, Any]]:
+        """Strongest item affinities (lift above 1), as plain dicts"""
+        positive_rules = rules_df[rules_df['lift'] > 1].head(max_rules)
+        return [
+            {
+                "if_ordered": list(rule.antecedent),
+                "also_orders": rule.consequent,
+                "orders_together": int(rule.count),
+                "support": round(float(rule.support), 4),
+                "confidence": round(float(rule.confidence), 3),
+                "lift": round(float(rule.lift), 2)
+            }
+            for rule in positive_rules.itertuples(index=False)
+        ]
+
     def _analyze_temporal_patterns(self, invoice_df: pd.DataFrame) -> Dict[str, Any]:
         """Analyze temporal patterns in orders"""
         # --- SENSIBLE DEFAULT: An hour is a "peak" hour if it has >7.5% of total orders ---
@@ -100,46 +122,87 @@ class OrderAnalysisSummarizer:
         
         return patterns
    
-    def _extract_strongest_pairs(self, matrix: pd.DataFrame) -> List[Dict[str, Any]]:
-        """Extract strongest co-occurrence pairs from matrix"""
-        pairs = []
-        
-        # Get the actual item names from the matrix index and columns
-        item_names = list(matrix.index)
-        
-        # Iterate through the matrix using actual item names
-        for i in range(len(item_names)):
-            for j in range(i + 1, len(item_names)):  # Start from i+1 to avoid duplicates
-                item1 = item_names[i]
-                item2 = item_names[j]
-                
-                # Get the co-occurrence count from the matrix
-                # Handle both symmetric and asymmetric matrices
-                try:
-                    count = matrix.loc[item1, item2]
-                    if pd.isna(count):
-                        count = 0
-                except (KeyError, IndexError):
-                    try:
-                        count = matrix.loc[item2, item1]
-                        if pd.isna(count):
-                            count = 0
-                    except (KeyError, IndexError):
-                        count = 0
-                
-                # Only add pairs with meaningful co-occurrence
-                if count > 0:
-                    pairs.append({
-                        "item_1": item1,
-                        "item_2": item2,
-                        "count": int(count)
-                    })
-       
-        # Sort by count and return top 15
-        return sorted(pairs, key=lambda x: x['count'], reverse=True)[:15]
+    def _analyze_cube_temporal_patterns(self, traffic_cube: TrafficCube, max_slots: int = 5) -> Dict[str, Any]:
+        """Same patterns as _analyze_temporal_patterns, sliced from the traffic cube, plus busiest/quietest slots"""
+        peak_hours_threshold = 0.075
+
+        invoices = traffic_cube.metric('invoices')
+        day_counts = invoices.sum(axis=1)
+        hour_counts = invoices.sum(axis=0)
+        total_orders = invoices.sum()
+
+        days_by_count = [d for d in np.argsort(-day_counts, kind='stable') if day_counts[d] > 0]
+        open_hours = np.flatnonzero(hour_counts > 0)
+
+        # Slots with at least one order, busiest first
+        open_slots = np.flatnonzero(invoices.ravel() > 0)
+        open_slots = open_slots[np.argsort(-invoices.ravel()[open_slots], kind='stable')]
+
+        return {
+            "day_of_week_distribution": {WEEKDAY_NAMES[d]: int(day_counts[d]) for d in days_by_count},
+            "peak_days": [WEEKDAY_NAMES[d] for d in days_by_count[:3]],
+            "hour_analysis": {
+                "peak_hours": [int(h) for h in open_hours if hour_counts[h] >= total_orders * peak_hours_threshold],
+                "hourly_distribution": {int(h): int(hour_counts[h]) for h in open_hours}
+            },
+            "slot_analysis": {
+                "busiest_slots": self._slot_details(traffic_cube, open_slots[:max_slots]),
+                "quietest_slots": self._slot_details(traffic_cube, open_slots[::-1][:max_slots])
+            }
+        }
+
+    def _slot_details(self, traffic_cube: TrafficCube, slots: np.ndarray) -> List[Dict[str, Any]]:
+        """Orders and revenue of flat (weekday * 24 + hour) slots"""
+        invoices = traffic_cube.metric('invoices').ravel()
+        revenue = traffic_cube.metric('revenue').ravel()
+        return [
+            {
+                "day": WEEKDAY_NAMES[slot // HOURS],
+                "hour": int(slot % HOURS),
+                "orders": int(invoices[slot]),
+                "revenue": round(float(revenue[slot]), 2)
+            }
+            for slot in slots
+        ]
+
+    def _extract_strongest_pairs(self, matrix: pd.DataFrame, top_k: int = 15) -> List[Dict[str, Any]]:
+        """
+        Extract the top_k strongest co-occurrence pairs from the upper triangle
+        of the matrix, strongest first; equal counts keep row-major order.
+        """
+        item_names = matrix.index.to_numpy(dtype=object)
+        values = matrix.reindex(columns=matrix.index).to_numpy(dtype=np.float64)
+
+        # A pair missing from the columns is read from its mirrored cell instead
+        in_columns = matrix.index.isin(matrix.columns)
+        rows, cols = np.triu_indices(len(item_names), k=1)
+        counts = np.where(
+            in_columns[cols],
+            values[rows, cols],
+            np.where(in_columns[rows], values[cols, rows], 0)
+        )
+        counts = np.nan_to_num(counts, nan=0.0)
+
+        # Only pairs with meaningful co-occurrence
+        candidates = np.flatnonzero(counts > 0)
+        if len(candidates) > top_k > 0:
+            # Keep everything tied with the k-th largest count, then order stably
+            kth_count = -np.partition(-counts[candidates], top_k - 1)[top_k - 1]
+            candidates = candidates[counts[candidates] >= kth_count]
+        strongest = candidates[np.argsort(-counts[candidates], kind='stable')][:top_k]
+
+        return [
+            {
+                "item_1": item_names[rows[p]],
+                "item_2": item_names[cols[p]],
+                "count": int(counts[p])
+            }
+            for p in strongest
+        ]
     
     def generate_business_insights(self, cooc_pairs: List[Dict[str, Any]], 
-                                 invoice_analysis: Dict[str, Any]) -> Dict[str, Any]:
+                                 invoice_analysis: Dict[str, Any],
+                                 association_rules: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """Generate business insights from co-occurrence patterns and order data"""
         insights = {
             "bundle_opportunities": [],
@@ -147,23 +210,49 @@ class OrderAnalysisSummarizer:
             "inventory_insights": []
         }
         
-        # Generate bundle opportunities from top co-occurrence pairs
-        for pair in cooc_pairs[:5]:  # Top 5 pairs
-            insights["bundle_opportunities"].append({
-                "bundle_items": [pair['item_1'], pair['item_2']],
-                "statistical_strength": f"Co-occurrence: {pair['count']} times",
-                "frequency": f"Appears together in {pair['count']} orders",
-                "recommendation": "Strong candidate for bundle pricing or combo offers"
-            })
-        
-        # Cross-sell recommendations
-        for pair in cooc_pairs[:8]:  # Top 8 for cross-sell
-            insights["cross_sell_recommendations"].append({
-                "trigger_item": pair['item_1'],
-                "suggest_item": pair['item_2'],
-                "frequency": f"Bought together {pair['count']} times",
-                "strategy": "Suggest as add-on during ordering"
-            })
+        if association_rules:
+            # Rules rank by real affinity (lift), not just by how popular both items are
+            # A pair yields a rule in each direction; bundle each itemset once
+            bundles, seen_itemsets = [], set()
+            for rule in association_rules:
+                itemset = frozenset(rule['if_ordered'] + [rule['also_orders']])
+                if itemset not in seen_itemsets:
+                    seen_itemsets.add(itemset)
+                    bundles.append(rule)
+
+            for rule in bundles[:5]:  # Top 5 itemsets
+                insights["bundle_opportunities"].append({
+                    "bundle_items": rule['if_ordered'] + [rule['also_orders']],
+                    "statistical_strength": f"Lift: {rule['lift']}, confidence: {rule['confidence']:.0%}",
+                    "frequency": f"Appears together in {rule['orders_together']} orders",
+                    "recommendation": "Strong candidate for bundle pricing or combo offers"
+                })
+
+            for rule in association_rules[:8]:  # Top 8 for cross-sell
+                insights["cross_sell_recommendations"].append({
+                    "trigger_item": " + ".join(rule['if_ordered']),
+                    "suggest_item": rule['also_orders'],
+                    "frequency": f"{rule['confidence']:.0%} of these orders also include it",
+                    "strategy": "Suggest as add-on during ordering"
+                })
+        else:
+            # Generate bundle opportunities from top co-occurrence pairs
+            for pair in cooc_pairs[:5]:  # Top 5 pairs
+                insights["bundle_opportunities"].append({
+                    "bundle_items": [pair['item_1'], pair['item_2']],
+                    "statistical_strength": f"Co-occurrence: {pair['count']} times",
+                    "frequency": f"Appears together in {pair['count']} orders",
+                    "recommendation": "Strong candidate for bundle pricing or combo offers"
+                })
+            
+            # Cross-sell recommendations
+            for pair in cooc_pairs[:8]:  # Top 8 for cross-sell
+                insights["cross_sell_recommendations"].append({
+                    "trigger_item": pair['item_1'],
+                    "suggest_item": pair['item_2'],
+                    "frequency": f"Bought together {pair['count']} times",
+                    "strategy": "Suggest as add-on during ordering"
+                })
         
         # Inventory insights based on order patterns
         avg_order_value = invoice_analysis.get('average_order_value', 0)
@@ -193,17 +282,31 @@ class OrderAnalysisSummarizer:
         
         return insights
     
-def run_order_summarization(invoice_df: pd.DataFrame, cooc_matrix: pd.DataFrame):
+def run_order_summarization(
+    invoice_df: pd.DataFrame,
+    cooc_matrix: pd.DataFrame,
+    rules_df: Optional[pd.DataFrame] = None,
+    rule_thresholds: Optional[Dict[str, Any]] = None,
+    pair_count_error_bound: Optional[int] = None,
+    traffic_cube: Optional[TrafficCube] = None
+):
 
     summarizer = OrderAnalysisSummarizer()
 
     # Analyze patterns
-    invoice_df_summary = summarizer.analyze_order_patterns(invoice_df=invoice_df)
+    invoice_df_summary = summarizer.analyze_order_patterns(invoice_df=invoice_df, traffic_cube=traffic_cube)
     cooc_matrix_summary = summarizer.analyze_cooccurrence_patterns(cooc_matrix=cooc_matrix)
+    if pair_count_error_bound is not None:
+        # Pair counts came from the bounded sketch and may be undercounted
+        cooc_matrix_summary["count_accuracy"] = {
+            "mode": "approximate",
+            "max_undercount": int(pair_count_error_bound)
+        }
+    association_rules = summarizer.analyze_association_rules(rules_df) if rules_df is not None else None
     
     # Generate business insights
     cooc_pairs = cooc_matrix_summary.get('strongest_cooccurrences', [])
-    business_insights = summarizer.generate_business_insights(cooc_pairs, invoice_df_summary)
+    business_insights = summarizer.generate_business_insights(cooc_pairs, invoice_df_summary, association_rules)
 
     summary = {
         "analysis_timestamp": pd.Timestamp.now().isoformat(),
@@ -215,5 +318,10 @@ def run_order_summarization(invoice_df: pd.DataFrame, cooc_matrix: pd.DataFrame)
         "cooccurrence_analysis": cooc_matrix_summary,
         "business_insights": business_insights
     }
+    if association_rules is not None:
+        summary["association_rules"] = {
+            "thresholds": rule_thresholds or {},
+            "rules": association_rules
+        }
 
     return summary
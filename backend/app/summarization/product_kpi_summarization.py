@@ -1,2 +1,78 @@
-def run_summarization():
-    pass
\ No newline at end of file
+from typing import Dict, List, Any, Optional
+import numpy as np
+import pandas as pd
+
+from app.analysis.demand_forecast import DemandForecast, FORECAST_METHODS, PROGRAM_TOTAL
+from app.analysis.traffic_cube import TrafficCube, HOURS
+from app.utils.preprocessing import WEEKDAY_NAMES
+
+
+class ProductAnalysisSummarizer:
+
+    def analyze_hourly_patterns(self, hourly_df: pd.DataFrame, items: List[str]) -> Dict[str, Any]:
+        """Peak hour of each of the given items, by units sold"""
+        selected = hourly_df[hourly_df['item_name'].isin(items)]
+        peak_rows = selected.sort_values(['quantity', 'Hour'], ascending=[False, True], kind='stable').drop_duplicates('item_name')
+        return {
+            item: {"peak_hour": int(hour), "units_sold_in_peak_hour": int(quantity)}
+            for item, hour, quantity in zip(peak_rows['item_name'], peak_rows['Hour'], peak_rows['quantity'])
+        }
+
+    def analyze_slot_patterns(self, traffic_cube: TrafficCube, items: List[str]) -> Dict[str, Any]:
+        """Busiest weekday/hour slot of each item in the traffic cube's per-item breakdown"""
+        slots = {}
+        for item in items:
+            quantity = traffic_cube.metric('quantity', item).ravel()
+            if not quantity.any():
+                continue
+            slot = int(np.argmax(quantity))
+            slots[item] = {
+                "day": WEEKDAY_NAMES[slot // HOURS],
+                "hour": slot % HOURS,
+                "units_sold": int(quantity[slot])
+            }
+        return slots
+
+    def analyze_demand_forecast(self, demand_forecast: DemandForecast, items: List[str]) -> Dict[str, Any]:
+        """Weekly unit baselines of the program and of the given items"""
+        weekly = demand_forecast.weekly()
+        position = {name: i for i, name in enumerate(demand_forecast.series)}
+
+        def describe(i: int) -> Dict[str, Any]:
+            mae = demand_forecast.holdout_mae[i, demand_forecast.method[i]]
+            return {
+                "method": FORECAST_METHODS[demand_forecast.method[i]],
+                "weekly_units": [round(float(units), 1) for units in weekly[i]],
+                "holdout_daily_mae": round(float(mae), 2) if np.isfinite(mae) else None
+            }
+
+        return {
+            "forecast_start": demand_forecast.start_date.strftime('%Y-%m-%d'),
+            "horizon_weeks": weekly.shape[1],
+            "program": describe(position[PROGRAM_TOTAL]),
+            "items": {item: describe(position[item]) for item in items if item in position}
+        }
+
+
+def run_product_summarization(
+    performance: Dict[str, Any],
+    hourly_df: pd.DataFrame,
+    traffic_cube: Optional[TrafficCube] = None,
+    demand_forecast: Optional[DemandForecast] = None
+):
+    summarizer = ProductAnalysisSummarizer()
+
+    top_items = [item["item_name"] for item in performance.get("top_selling_items", [])]
+    time_patterns = {"peak_hour_by_item": summarizer.analyze_hourly_patterns(hourly_df, top_items)}
+    if traffic_cube is not None:
+        time_patterns["peak_slot_by_item"] = summarizer.analyze_slot_patterns(traffic_cube, top_items)
+
+    summary = {
+        "analysis_timestamp": pd.Timestamp.now().isoformat(),
+        **performance,
+        "time_patterns": time_patterns
+    }
+    if demand_forecast is not None:
+        summary["demand_forecast"] = summarizer.analyze_demand_forecast(demand_forecast, top_items)
+
+    return summary
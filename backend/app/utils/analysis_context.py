@@ -0,0 +1,138 @@
+import json
+import math
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import logfire
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart
+
+from app.core.config import settings
+from app.schemas.core.enums import AnalysisTypeEnum
+
+# Keys that carry no information for the model: run timestamps, change
+# fingerprints and the canned advice strings the summarizers attach to every section
+DROPPED_KEYS = {"analysis_timestamp", "fingerprint", "material_change", "suggestion"}
+
+# Mappings with more entries than this are data (e.g. item -> value) and may
+# be truncated like lists; smaller ones are treated as fixed structure
+MAX_STRUCTURAL_KEYS = 12
+
+_TOKEN_PIECES = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+@dataclass(frozen=True)
+class CompactContext:
+    text: str
+    tokens_before: int
+    tokens_after: int
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Deterministic BPE-style token estimate: every punctuation mark is one
+    token, letter and digit runs cost one token per 4 characters.
+    """
+    return sum(math.ceil(len(piece) / 4) for piece in _TOKEN_PIECES.findall(text))
+
+
+def compact_analysis(summary: Any) -> Any:
+    """
+    Drops boilerplate keys, rounds floats to 2 decimals (2 significant
+    digits below 1, so small rates survive) and turns whole floats into
+    ints, recursively. Key order is left to the serializer.
+    """
+    if isinstance(summary, dict):
+        return {key: compact_analysis(value) for key, value in summary.items() if key not in DROPPED_KEYS}
+    if isinstance(summary, list):
+        return [compact_analysis(value) for value in summary]
+    if isinstance(summary, float):
+        if not math.isfinite(summary):
+            return None
+        rounded = round(summary, 2) if abs(summary) >= 1 else float(f"{summary:.2g}")
+        return int(rounded) if rounded.is_integer() else rounded
+    return summary
+
+
+def _dumps(summary: Any) -> str:
+    return json.dumps(summary, separators=(",", ":"), sort_keys=True, ensure_ascii=False)
+
+
+def _longest_collection(summary: Any) -> Optional[Any]:
+    """The longest truncatable list or data mapping in the tree (first found on ties)."""
+    best, best_len = None, 1
+    queue = deque([summary])
+    while queue:
+        node = queue.popleft()
+        if isinstance(node, dict):
+            if len(node) > max(best_len, MAX_STRUCTURAL_KEYS):
+                best, best_len = node, len(node)
+            queue.extend(node[key] for key in sorted(node))
+        elif isinstance(node, list):
+            if len(node) > best_len:
+                best, best_len = node, len(node)
+            queue.extend(node)
+    return best
+
+
+def fit_to_budget(summary: Any, token_budget: int) -> str:
+    """
+    Serializes the summary compactly, halving its longest list or data
+    mapping (keeping the leading, highest ranked entries) until the text
+    fits in `token_budget` estimated tokens or nothing is left to trim.
+    """
+    text = _dumps(summary)
+    while estimate_tokens(text) > token_budget:
+        collection = _longest_collection(summary)
+        if collection is None:
+            break
+        keep = len(collection) // 2
+        if isinstance(collection, list):
+            del collection[keep:]
+        else:
+            for key in list(collection)[keep:]:
+                del collection[key]
+        text = _dumps(summary)
+    return text
+
+
+def compact_analysis_json(analysis_json: str, label: str, token_budget: int) -> CompactContext:
+    """Compact, deterministic form of one stored analysis summary, wrapped as {label: summary}."""
+    summary = {label: compact_analysis(json.loads(analysis_json))}
+    text = fit_to_budget(summary, token_budget)
+    return CompactContext(
+        text=text,
+        tokens_before=estimate_tokens(analysis_json),
+        tokens_after=estimate_tokens(text)
+    )
+
+
+def build_analysis_context(
+    analysis_results: Dict[AnalysisTypeEnum, Optional[Dict[str, Any]]],
+    token_budget: Optional[int] = None
+) -> List[ModelMessage]:
+    """
+    One ModelResponse per stored analysis result (rows from
+    analysis_crud.get_latest_analysis_result; missing ones are skipped),
+    compacted to share `token_budget` estimated tokens evenly.
+    """
+    token_budget = token_budget or settings.ANALYSIS_CONTEXT_TOKEN_BUDGET
+    available = {analysis_type: result for analysis_type, result in analysis_results.items() if result}
+    if not available:
+        return []
+
+    per_result_budget = token_budget // len(available)
+    message_history: List[ModelMessage] = []
+    for analysis_type, result in available.items():
+        context = compact_analysis_json(
+            result["analysis_json"], f"{analysis_type.name.lower()}_analysis", per_result_budget
+        )
+        logfire.debug(
+            "Analysis context compacted",
+            analysis_type=analysis_type.name,
+            tokens_before=context.tokens_before,
+            tokens_after=context.tokens_after
+        )
+        message_history.append(ModelResponse(parts=[TextPart(content=context.text)]))
+    return message_history
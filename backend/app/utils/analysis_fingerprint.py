@@ -0,0 +1,106 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from app.schemas.core.enums import AnalysisTypeEnum
+from app.utils.json_encoders import NumpyEncoder
+
+# Keys that vary between runs without the analysis itself changing
+# (material_change is only found on results stored by older runs)
+VOLATILE_KEYS = {"analysis_timestamp", "fingerprint", "material_change"}
+
+# Number of ranked entries (pairs, items) compared between runs
+TOP_ENTRIES = 10
+
+
+def _path(summary: Dict[str, Any], *keys: str) -> Any:
+    for key in keys:
+        if not isinstance(summary, dict):
+            return None
+        summary = summary.get(key)
+    return summary
+
+
+def _key_metrics(analysis_type: AnalysisTypeEnum, summary: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    if analysis_type == AnalysisTypeEnum.CUSTOMER:
+        metrics = {
+            "total_customers": _path(summary, "customer_segments", "total_customers"),
+            "new_customers": _path(summary, "customer_segments", "new_customers", "count"),
+            "active_customers": _path(summary, "customer_segments", "active_customers", "count"),
+            "dormant_customers": _path(summary, "customer_segments", "dormant_customers", "count"),
+            "total_revenue": _path(summary, "financial_summary", "total_revenue"),
+            "overall_aov": _path(summary, "financial_summary", "overall_aov"),
+            "overall_avg_clv": _path(summary, "financial_summary", "overall_avg_clv")
+        }
+    elif analysis_type == AnalysisTypeEnum.ORDER:
+        metrics = {
+            "total_orders": _path(summary, "invoice_analysis", "total_orders"),
+            "total_revenue": _path(summary, "invoice_analysis", "total_revenue"),
+            "average_order_value": _path(summary, "invoice_analysis", "average_order_value"),
+            "average_items_per_order": _path(summary, "invoice_analysis", "average_items_per_order")
+        }
+    elif analysis_type == AnalysisTypeEnum.PRODUCT:
+        metrics = {
+            "forecast_weekly_units": sum(_path(summary, "demand_forecast", "program", "weekly_units") or [0])
+        }
+    else:
+        metrics = {}
+    return {name: float(value) if isinstance(value, (int, float)) else None for name, value in metrics.items()}
+
+
+def _top_entries(analysis_type: AnalysisTypeEnum, summary: Dict[str, Any]) -> List[str]:
+    if analysis_type == AnalysisTypeEnum.ORDER:
+        pairs = _path(summary, "cooccurrence_analysis", "strongest_cooccurrences") or []
+        return [f"{pair['item_1']} + {pair['item_2']}" for pair in pairs[:TOP_ENTRIES]]
+    if analysis_type == AnalysisTypeEnum.PRODUCT:
+        items = _path(summary, "top_selling_items") or []
+        return [item["item_name"] for item in items[:TOP_ENTRIES]]
+    return []
+
+
+def build_fingerprint(analysis_type: AnalysisTypeEnum, summary: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Content hash of a summary (ignoring timestamps and fingerprint fields)
+    plus the key KPIs and top ranked entries material_change compares.
+    """
+    content = {key: value for key, value in summary.items() if key not in VOLATILE_KEYS}
+    # Round-trip first so numpy scalars and int keys hash like the stored JSON
+    content = json.loads(json.dumps(content, cls=NumpyEncoder))
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return {
+        "content_hash": hashlib.sha256(canonical.encode()).hexdigest(),
+        "key_metrics": _key_metrics(analysis_type, summary),
+        "top_entries": _top_entries(analysis_type, summary)
+    }
+
+
+def material_change(previous: Optional[Dict[str, Any]], current: Dict[str, Any]) -> float:
+    """
+    How much an analysis moved between two fingerprints, in [0, 1]: the
+    largest relative change of any key KPI, or the share of top entries
+    (pairs, items) that are not in both runs, whichever is larger.
+    """
+    if previous is None:
+        return 1.0
+    if previous["content_hash"] == current["content_hash"]:
+        return 0.0
+
+    changes = [0.0]
+    previous_metrics = previous["key_metrics"]
+    for name, value in current["key_metrics"].items():
+        before = previous_metrics.get(name)
+        if value is None or before is None:
+            changes.append(0.0 if value == before else 1.0)
+        elif before != value:
+            changes.append(min(abs(value - before) / max(abs(before), 1e-9), 1.0))
+
+    previous_entries, current_entries = set(previous["top_entries"]), set(current["top_entries"])
+    if previous_entries or current_entries:
+        changes.append(1 - len(previous_entries & current_entries) / len(previous_entries | current_entries))
+    return max(changes)
+
+
+def stored_fingerprint(analysis_type: AnalysisTypeEnum, analysis_result: Dict[str, Any]) -> Dict[str, Any]:
+    """Fingerprint of a row from analysis_crud, computed on the fly for results saved without one."""
+    summary = json.loads(analysis_result["analysis_json"])
+    return summary.get("fingerprint") or build_fingerprint(analysis_type, summary)
@@ -0,0 +1,150 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from app.analysis.heavy_hitters import PairHeavyHitters
+from app.core.config import settings
+
+# Bump whenever the shape of AnalysisState changes; older files are then
+# ignored and the next run rebuilds the state from scratch.
+STATE_VERSION = 8
+
+
+@dataclass
+class AnalysisState:
+    """
+    Intermediate analysis state for one loyalty program, valid up to (and
+    including) the order with id `last_order_id`. The preprocessed item rows
+    themselves live in the order snapshot cache under the same watermark.
+    """
+    last_order_id: int
+    last_order_date: Optional[pd.Timestamp]
+    invoices: pd.DataFrame        # OrderAnalyzer.compute_invoice_aggregation output
+    pair_counts: Union[Counter, PairHeavyHitters]  # (item_1, item_2) -> invoices containing both
+    item_counts: Counter          # item_name -> item rows
+    item_invoice_counts: Counter  # item_name -> invoices containing the item
+    item_slots: pd.DataFrame      # ProductAnalyzer.compute_item_slots, item x day x hour
+    customer_stats: pd.DataFrame  # CustomerAnalyzer.compute_customer_stats, per customer_phone
+    customer_name_counts: pd.Series  # (customer_phone, customer_name) -> occurrences
+    banned_item_terms: Tuple[str, ...]  # preprocessing filter the rows were built with
+    analysis_settings: Dict[str, Any]   # config the last successful run used
+    version: int = STATE_VERSION
+
+
+class AnalysisStateStore:
+    """
+    On-disk store of per-program AnalysisState.
+
+    Each program's state lives in a single pickle that is replaced atomically,
+    so the watermark can never disagree with the aggregates saved alongside it.
+    A missing or outdated file simply means the next run is a full rebuild.
+    """
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+
+    def _state_path(self, loyalty_program_id: int) -> Path:
+        return self.base_dir / f"program_{loyalty_program_id}" / "state.pkl"
+
+    def _model_path(self, loyalty_program_id: int, name: str) -> Path:
+        return self.base_dir / f"program_{loyalty_program_id}" / f"{name}.model.pkl"
+
+    def _arrays_path(self, loyalty_program_id: int, name: str) -> Path:
+        return self.base_dir / f"program_{loyalty_program_id}" / f"{name}.npz"
+
+    def _offer_basis_path(self, loyalty_program_id: int) -> Path:
+        return self.base_dir / f"program_{loyalty_program_id}" / "offer_basis.json"
+
+    def _replace_atomic(self, path: Path, write: Callable[[IO], None], mode: str = "wb") -> None:
+        """
+        Writes through a uniquely named temp file next to `path` and swaps it
+        into place, so overlapping runs never write into the same temp file.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    def _write_atomic(self, path: Path, obj: Any) -> None:
+        self._replace_atomic(path, lambda f: pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def load(self, loyalty_program_id: int) -> Optional[AnalysisState]:
+        """Returns the persisted state, or None if there is no usable state."""
+        path = self._state_path(loyalty_program_id)
+        if not path.exists():
+            return None
+
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+
+        if getattr(state, "version", None) != STATE_VERSION:
+            return None
+        return state
+
+    def save(self, loyalty_program_id: int, state: AnalysisState) -> None:
+        """Writes the state to a temp file and swaps it into place."""
+        self._write_atomic(self._state_path(loyalty_program_id), state)
+
+    def load_model(self, loyalty_program_id: int, name: str) -> Optional[Any]:
+        """
+        Returns a fitted model persisted under `name`, or None. Models are kept
+        apart from the watermark state: they survive incremental runs and only
+        go away with clear().
+        """
+        path = self._model_path(loyalty_program_id, name)
+        if not path.exists():
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save_model(self, loyalty_program_id: int, name: str, model: Any) -> None:
+        """Persists a fitted model, replacing the previous one atomically."""
+        self._write_atomic(self._model_path(loyalty_program_id, name), model)
+
+    def load_arrays(self, loyalty_program_id: int, name: str) -> Optional[Dict[str, np.ndarray]]:
+        """Returns the arrays persisted under `name`, or None. Like models, they survive incremental runs."""
+        path = self._arrays_path(loyalty_program_id, name)
+        if not path.exists():
+            return None
+        with np.load(path) as arrays:
+            return {key: arrays[key] for key in arrays.files}
+
+    def save_arrays(self, loyalty_program_id: int, name: str, arrays: Dict[str, np.ndarray]) -> None:
+        """Persists named numpy arrays as one .npz, replacing the previous file atomically."""
+        self._replace_atomic(self._arrays_path(loyalty_program_id, name), lambda f: np.savez(f, **arrays))
+
+    def load_offer_basis(self, loyalty_program_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Returns the analysis fingerprints (analysis type name -> fingerprint)
+        the last complete offer generation was built from, or None.
+        """
+        path = self._offer_basis_path(loyalty_program_id)
+        if not path.exists():
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def save_offer_basis(self, loyalty_program_id: int, fingerprints: Dict[str, Any]) -> None:
+        """Records the fingerprints behind a complete offer generation, replacing the previous ones atomically."""
+        self._replace_atomic(self._offer_basis_path(loyalty_program_id), lambda f: json.dump(fingerprints, f), mode="w")
+
+    def clear(self, loyalty_program_id: int) -> None:
+        """Drops all persisted state and models for a program (used for full rebuilds)."""
+        shutil.rmtree(self._state_path(loyalty_program_id).parent, ignore_errors=True)
+
+
+analysis_state_store = AnalysisStateStore(Path(settings.ANALYSIS_STATE_DIR))
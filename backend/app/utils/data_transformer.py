@@ -1,44 +1,122 @@
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Any
+from typing import List, Iterable, Union
+import logfire
+from pydantic import TypeAdapter, ValidationError
 
-def flatten_order_data_to_dataframe(raw_orders: List[Dict[str, Any]]) -> pd.DataFrame:
+from app.schemas.core.pos_order import PosOrder
+
+_POS_ORDERS_ADAPTER = TypeAdapter(List[PosOrder])
+_POS_ORDER_ADAPTER = TypeAdapter(PosOrder)
+
+# Order-level fields copied onto every item row: output column -> (section, field)
+_ORDER_LEVEL_COLUMNS = {
+    'restaurant_name': ('Restaurant', 'res_name'),
+    'invoice_no': ('Order', 'orderID'),
+    'date': ('Order', 'created_on'),
+    'payment_type': ('Order', 'payment_type'),
+    'order_type': ('Order', 'order_type'),
+    'customer_phone': ('Customer', 'phone'),
+    'customer_name': ('Customer', 'name'),
+    'persons': ('Order', 'no_of_persons'),
+    'total_tax': ('Order', 'tax_total'),
+    'discount': ('Order', 'discount_total'),
+    'delivery_charge': ('Order', 'delivery_charges'),
+    'round_off': ('Order', 'round_off'),
+    'total': ('Order', 'total'),
+    'my_amount': ('Order', 'core_total'),
+}
+
+_ITEM_LEVEL_COLUMNS = {
+    'item_name': 'name',
+    'item_price': 'price',
+    'item_quantity': 'quantity',
+    'item_total': 'total',
+}
+
+_NUMERIC_COLUMNS = {
+    'persons', 'total_tax', 'discount', 'delivery_charge', 'round_off',
+    'total', 'my_amount', 'item_price', 'item_quantity', 'item_total'
+}
+
+# Column order of the flat item-level DataFrame (also the SQL ingestion path's columns)
+_COLUMN_ORDER = [
+    'restaurant_name', 'invoice_no', 'date', 'payment_type', 'order_type',
+    'customer_phone', 'customer_name', 'persons', 'total_tax', 'discount',
+    'delivery_charge', 'round_off', 'total', 'item_name', 'item_price',
+    'item_quantity', 'item_total', 'waived_off', 'my_amount', 'category_name'
+]
+
+
+def _to_numeric_array(values: list) -> np.ndarray:
+    """Most values are already floats after decoding; only stray strings need coercion."""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _validate_orders(raw_orders: List[bytes]) -> List[PosOrder]:
     """
-    Transforms a list of nested order JSON objects into a flat DataFrame
-    where each row represents a single item.
+    Validates the whole batch in one call; if any order does not match the
+    schema, the batch is validated again order by order and the invalid
+    ones are logged and skipped, so one bad blob cannot fail the run.
     """
-    flattened_data = []
-    
-    for order in raw_orders:
-        # Loop through each item in the OrderItem list
-        for item in order.get("OrderItem", []):
-            flat_row = {
-                # --- Mapped Data ---
-                'restaurant_name': order.get("Restaurant", {}).get("res_name"),
-                'invoice_no': order.get("Order", {}).get("orderID"),
-                'date': order.get("Order", {}).get("created_on"),
-                'payment_type': order.get("Order", {}).get("payment_type"),
-                'order_type': order.get("Order", {}).get("order_type"),
-                'customer_phone': order.get("Customer", {}).get("phone"),
-                'customer_name': order.get("Customer", {}).get("name"),
-                'persons': order.get("Order", {}).get("no_of_persons"),
-                'total_tax': order.get("Order", {}).get("tax_total"),
-                'discount': order.get("Order", {}).get("discount_total"),
-                'delivery_charge': order.get("Order", {}).get("delivery_charges"),
-                'round_off': order.get("Order", {}).get("round_off"),
-                'total': order.get("Order", {}).get("total"),
-                
-                # --- Item-Specific Data ---
-                'item_name': item.get("name"),
-                'item_price': item.get("price"),
-                'item_quantity': item.get("quantity"),
-                'item_total': item.get("total"),
-                
-                # --- Missing Data (added with default values) ---
-                'waived_off': 0,
-                'my_amount': order.get("Order", {}).get("core_total"),
-                'category_name': None,
-                # ... add any other missing columns your analysis needs
-            }
-            flattened_data.append(flat_row)
-            
-    return pd.DataFrame(flattened_data)
\ No newline at end of file
+    try:
+        return _POS_ORDERS_ADAPTER.validate_json(b"[" + b",".join(raw_orders) + b"]")
+    except ValidationError:
+        pass
+
+    orders = []
+    for raw in raw_orders:
+        try:
+            orders.append(_POS_ORDER_ADAPTER.validate_json(raw))
+        except ValidationError as e:
+            logfire.warn(
+                "Skipping order that does not match the POS schema",
+                error_count=e.error_count(),
+                errors=e.errors(include_url=False, include_input=False)[:3]
+            )
+    return orders
+
+
+def decode_orders_to_dataframe(raw_orders: Iterable[Union[str, bytes]]) -> pd.DataFrame:
+    """
+    Decodes raw order JSON text straight into a flat item-level DataFrame,
+    one row per order item with the order-level fields repeated on each.
+
+    The whole batch is parsed against the declared POS schema in a single
+    pydantic-core call (numeric strings become floats while decoding; orders
+    that do not match the schema are skipped), then
+    written into per-column arrays: order-level values once per order and
+    repeated by item count, item-level values once per item.
+    """
+    raw_orders = [r.encode() if isinstance(r, str) else r for r in raw_orders]
+    orders = [o for o in _validate_orders(raw_orders) if o.get("OrderItem")]
+
+    if not orders:
+        return pd.DataFrame(columns=_COLUMN_ORDER)
+
+    # Each section is resolved once per order instead of once per item
+    sections = {
+        section: [o.get(section) or {} for o in orders]
+        for section in ("Restaurant", "Order", "Customer")
+    }
+    item_counts = np.fromiter((len(o["OrderItem"]) for o in orders), dtype=np.int64, count=len(orders))
+    items = [item for o in orders for item in o["OrderItem"]]
+
+    columns = {}
+    for column, (section, field) in _ORDER_LEVEL_COLUMNS.items():
+        values = [part.get(field) for part in sections[section]]
+        per_order = _to_numeric_array(values) if column in _NUMERIC_COLUMNS else np.array(values, dtype=object)
+        columns[column] = np.repeat(per_order, item_counts)
+
+    for column, field in _ITEM_LEVEL_COLUMNS.items():
+        values = [item.get(field) for item in items]
+        columns[column] = _to_numeric_array(values) if column in _NUMERIC_COLUMNS else np.array(values, dtype=object)
+
+    # --- Missing Data (added with default values) ---
+    columns['waived_off'] = np.zeros(len(items), dtype=np.int64)
+    columns['category_name'] = np.full(len(items), None, dtype=object)
+
+    return pd.DataFrame({column: columns[column] for column in _COLUMN_ORDER})
@@ -0,0 +1,178 @@
+import json
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+
+MANIFEST_NAME = "manifest.json"
+
+# Snapshots are written into a uniquely named hidden directory and renamed into place
+TMP_PREFIX = ".tmp_upto_"
+
+# Temp directories older than this are left over from crashed writers
+STALE_TMP_SECONDS = 3600
+
+_SNAPSHOT_DIR_NAME = re.compile(r"upto_(\d+)")
+
+
+class OrderSnapshotCache:
+    """
+    Local columnar cache of preprocessed order frames, keyed by loyalty
+    program and data watermark (the last ingested order id).
+
+    Every column is written as its own .npy file and loaded with mmap, so
+    numeric and datetime columns come back without copying or decoding.
+    Object columns are stored as integer codes plus their distinct values.
+    Storing a program's snapshot invalidates its older watermarks, and the
+    least recently used snapshots are evicted once the cache exceeds
+    `max_bytes`.
+
+    Writers never touch a directory another run may be writing or reading:
+    each snapshot is built in its own temp directory and renamed into place,
+    and only completed snapshots with an older watermark are removed.
+    """
+
+    def __init__(self, base_dir: Path, max_bytes: int):
+        self.base_dir = base_dir
+        self.max_bytes = max_bytes
+
+    def _program_dir(self, loyalty_program_id: int) -> Path:
+        return self.base_dir / f"program_{loyalty_program_id}"
+
+    def _snapshot_dir(self, loyalty_program_id: int, watermark: int) -> Path:
+        return self._program_dir(loyalty_program_id) / f"upto_{watermark}"
+
+    def load(self, loyalty_program_id: int, watermark: int) -> Optional[pd.DataFrame]:
+        """Returns the snapshot for exactly this watermark, or None on a miss."""
+        snapshot_dir = self._snapshot_dir(loyalty_program_id, watermark)
+        manifest_path = snapshot_dir / MANIFEST_NAME
+        if not manifest_path.exists():
+            return None
+
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        columns = {}
+        for i, spec in enumerate(manifest["columns"]):
+            columns[spec["name"]] = self._read_column(snapshot_dir, i, spec)
+
+        # Mark as recently used for eviction
+        os.utime(manifest_path)
+        return pd.DataFrame(columns, copy=False)
+
+    def store(self, loyalty_program_id: int, watermark: int, df: pd.DataFrame) -> None:
+        """Writes the snapshot, drops older ones for the program and enforces the size limit."""
+        program_dir = self._program_dir(loyalty_program_id)
+        program_dir.mkdir(parents=True, exist_ok=True)
+        snapshot_dir = self._snapshot_dir(loyalty_program_id, watermark)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f"{TMP_PREFIX}{watermark}_", dir=program_dir))
+
+        try:
+            specs = [self._write_column(tmp_dir, i, name, df[name]) for i, name in enumerate(df.columns)]
+            with open(tmp_dir / MANIFEST_NAME, "w") as f:
+                json.dump({"watermark": watermark, "row_count": len(df), "columns": specs}, f)
+            os.rename(tmp_dir, snapshot_dir)
+        except OSError:
+            if not (snapshot_dir / MANIFEST_NAME).exists():
+                raise
+            # Another run already stored this watermark; its rows are the same
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self._remove_stale(program_dir, watermark)
+        self._evict(keep=snapshot_dir)
+
+    def invalidate(self, loyalty_program_id: int) -> None:
+        """Drops every snapshot of a program."""
+        shutil.rmtree(self._program_dir(loyalty_program_id), ignore_errors=True)
+
+    def _write_column(self, directory: Path, i: int, name: str, series: pd.Series) -> dict:
+        dtype = series.dtype
+
+        if isinstance(dtype, pd.PeriodDtype):
+            np.save(directory / f"{i}.npy", series.array.asi8)
+            return {"name": name, "kind": "period", "dtype": str(dtype)}
+
+        if isinstance(dtype, pd.CategoricalDtype):
+            np.save(directory / f"{i}.npy", series.cat.codes.to_numpy())
+            with open(directory / f"{i}.values.pkl", "wb") as f:
+                pickle.dump(series.cat.categories, f, protocol=pickle.HIGHEST_PROTOCOL)
+            return {"name": name, "kind": "category", "ordered": bool(dtype.ordered)}
+
+        if dtype == object:
+            codes, uniques = pd.factorize(series, use_na_sentinel=True)
+            np.save(directory / f"{i}.npy", codes.astype(np.int32))
+            with open(directory / f"{i}.values.pkl", "wb") as f:
+                pickle.dump(np.asarray(uniques, dtype=object), f, protocol=pickle.HIGHEST_PROTOCOL)
+            return {"name": name, "kind": "object"}
+
+        np.save(directory / f"{i}.npy", series.to_numpy())
+        return {"name": name, "kind": "array"}
+
+    def _read_column(self, directory: Path, i: int, spec: dict):
+        data = np.load(directory / f"{i}.npy", mmap_mode="r")
+        kind = spec["kind"]
+
+        if kind == "array":
+            return data
+
+        if kind == "period":
+            return pd.arrays.PeriodArray(np.asarray(data), dtype=pd.api.types.pandas_dtype(spec["dtype"]))
+
+        with open(directory / f"{i}.values.pkl", "rb") as f:
+            values = pickle.load(f)
+
+        if kind == "category":
+            return pd.Categorical.from_codes(data, categories=values, ordered=spec["ordered"])
+
+        # Object columns: -1 marks missing values
+        column = values.take(data, mode="clip") if len(values) else np.full(len(data), None, dtype=object)
+        column[np.asarray(data) == -1] = None
+        return column
+
+    def _remove_stale(self, program_dir: Path, watermark: int) -> None:
+        """Drops completed snapshots older than `watermark` and temp directories of crashed writers."""
+        now = time.time()
+        for path in program_dir.iterdir():
+            match = _SNAPSHOT_DIR_NAME.fullmatch(path.name)
+            if match:
+                stale = int(match.group(1)) < watermark
+            else:
+                try:
+                    stale = path.name.startswith(TMP_PREFIX) and now - path.stat().st_mtime > STALE_TMP_SECONDS
+                except FileNotFoundError:
+                    continue
+            if stale:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _evict(self, keep: Path) -> None:
+        """Removes least recently used snapshots until the cache fits in max_bytes."""
+        snapshots = []
+        for manifest_path in self.base_dir.glob(f"program_*/upto_*/{MANIFEST_NAME}"):
+            snapshot_dir = manifest_path.parent
+            size = sum(p.stat().st_size for p in snapshot_dir.iterdir())
+            snapshots.append((manifest_path.stat().st_mtime, size, snapshot_dir))
+
+        total = sum(size for _, size, _ in snapshots)
+        for _, size, snapshot_dir in sorted(snapshots, key=lambda s: s[0]):
+            if total <= self.max_bytes:
+                break
+            if snapshot_dir == keep:
+                continue
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            total -= size
+
+
+order_snapshot_cache = OrderSnapshotCache(
+    Path(settings.ORDER_SNAPSHOT_DIR),
+    max_bytes=settings.ORDER_SNAPSHOT_CACHE_MAX_BYTES
+)
@@ -1,17 +1,101 @@
+import re
+import numpy as np
 import pandas as pd
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+from pandas.api.types import union_categoricals, is_datetime64_any_dtype
+
+from app.core.analysis_config import DEFAULT_BANNED_ITEM_TERMS
+
+DATE_FORMAT = '%Y-%m-%d %H: %M: %S'
+
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Compact dtypes for the preprocessed item-level frame.
+# Low-cardinality labels become categoricals; amounts that are summed into
+# reported revenue stay float64 so totals don't drift, the rest is float32.
+CATEGORICAL_COLUMNS = ['item_name', 'order_type', 'payment_type', 'customer_name', 'restaurant_name']
+FLOAT32_COLUMNS = [
+    'persons', 'my_amount', 'total_tax', 'delivery_charge', 'container_charge',
+    'service_charge', 'additional_charge', 'waived_off', 'round_off',
+    'item_price'
+]
+FLOAT64_COLUMNS = ['total', 'item_total', 'item_quantity', 'discount', 'net_sales']
+
+
+def apply_compact_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Casts a preprocessed frame to its compact dtypes (in place) and returns it."""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(np.float32)
+    for col in FLOAT64_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(np.float64)
+    return df
+
+
+def concat_preprocessed(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenates preprocessed frames, keeping categorical columns categorical.
+    Plain pd.concat falls back to object when the category sets differ.
+    """
+    if len(frames) == 1:
+        return frames[0]
+
+    df = pd.concat(frames, ignore_index=True)
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = union_categoricals([frame[col] for frame in frames], sort_categories=True)
+    return df
+
+
+def build_banned_items_pattern(terms: Sequence[str]) -> str:
+    """Case-insensitive whole-word regex matching any of the banned item terms."""
+    # Non-capturing group (?:...) avoids pandas' match-groups UserWarning
+    return r"(?i)\b(?:" + "|".join(re.escape(term) for term in terms) + r")\b"
+
+
+def map_distinct(series: pd.Series, func: Callable[[pd.Index], Any], fill_value: Any) -> np.ndarray:
+    """
+    Evaluates `func` once over the distinct values of `series` and maps the
+    results back onto every row through the factorized codes. Missing values
+    get `fill_value`.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    results = np.asarray(func(pd.Index(uniques)))
+    # Code -1 (missing) indexes the trailing fill value
+    lookup = np.concatenate([results, np.array([fill_value], dtype=results.dtype)])
+    return lookup[codes]
+
+
+def preprocess_raw_data(df: pd.DataFrame, banned_item_terms: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Clean and preprocess raw order data.
+    The input frame is left untouched; rows are copied once when the filters
+    are applied and once more if incomplete rows have to be dropped.
+    """
+    keep = np.ones(len(df), dtype=bool)
 
-def preprocess_raw_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Clean and preprocess raw order data"""
-    df = df.copy()
-    
     # Filter unwanted order types
     if 'order_type' in df.columns:
-        df = df[df['order_type'] != "Delivery(Parcel)"]
+        keep &= (df['order_type'] != "Delivery(Parcel)").to_numpy()
+
+    # Banned items: the regex runs once per distinct item name, not once per row
+    if banned_item_terms is None:
+        banned_item_terms = DEFAULT_BANNED_ITEM_TERMS
+    if 'item_name' in df.columns and banned_item_terms:
+        banned_patterns = build_banned_items_pattern(banned_item_terms)
+        keep &= ~map_distinct(
+            df['item_name'],
+            lambda names: names.astype(str).str.contains(banned_patterns, regex=True),
+            fill_value=False
+        )
 
-    # FIX 1: Use a non-capturing group (?:...) to silence the UserWarning.
-    banned_patterns = r"(?i)\b(?:water|water bottle|1 ltr|cigarette|cigarettes)\b"
-    if 'item_name' in df.columns:
-        df = df[~df['item_name'].str.contains(banned_patterns, na=False, regex=True)]
+    # take() returns an independent frame, so the column writes below never reach the input
+    df = df.take(np.flatnonzero(keep))
         
     # Define numeric columns
     numeric_cols = [
@@ -30,9 +114,25 @@ def preprocess_raw_data(df: pd.DataFrame) -> pd.DataFrame:
     if all(col in df.columns for col in ['discount', 'waived_off']):
         df[['discount', 'waived_off']] = df[['discount', 'waived_off']].fillna(0)
     
-    # Drop incomplete rows
+    # Parse dates before dropping, so incomplete and undated rows go in one pass
+    if 'date' in df.columns:
+        # FIX 2: Provide the exact format to handle the unusual spacing.
+        # This resolves the DateParseError.
+        # Orders share timestamps across their items, so each distinct string is parsed once.
+        if not is_datetime64_any_dtype(df['date']):
+            df['date'] = map_distinct(
+                df['date'],
+                lambda values: pd.to_datetime(values, format=DATE_FORMAT, errors='coerce').to_numpy(dtype='datetime64[ns]'),
+                fill_value=np.datetime64('NaT', 'ns')
+            )
+
+    # Drop incomplete rows, and rows where date could not be parsed
     required_cols = ['invoice_no', 'item_name', 'item_quantity', 'item_total']
-    df.dropna(subset=required_cols, inplace=True)
+    if 'date' in df.columns:
+        required_cols.append('date')
+    complete = df[required_cols].notna().all(axis=1).to_numpy()
+    if not complete.all():
+        df = df.take(np.flatnonzero(complete))
     
     # Compute net sales
     if all(col in df.columns for col in ['item_total', 'discount', 'waived_off']):
@@ -40,16 +140,40 @@ def preprocess_raw_data(df: pd.DataFrame) -> pd.DataFrame:
     
     # Add time features
     if 'date' in df.columns:
-        # FIX 2: Provide the exact format to handle the unusual spacing.
-        # This resolves the DateParseError.
-        df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d %H: %M: %S', errors='coerce')
-        
-        # Drop rows where date could not be parsed
-        df.dropna(subset=['date'], inplace=True)
-        
-        df['YearMonth'] = df['date'].dt.to_period('M')
-        df['DateOnly'] = df['date'].dt.date
-        df['Weekday'] = df['date'].dt.day_name()
-        df['Hour'] = df['date'].dt.hour
+        # Day/month keys stay datetime64 (midnight / first of month)
+        df['YearMonth'] = df['date'].values.astype('datetime64[M]').astype('datetime64[ns]')
+        df['DateOnly'] = df['date'].dt.normalize()
+        df['Weekday'] = pd.Categorical.from_codes(
+            df['date'].dt.dayofweek.to_numpy(np.int8), categories=WEEKDAY_NAMES, ordered=True
+        )
+        df['Hour'] = df['date'].dt.hour.astype(np.int8)
     
-    return df
\ No newline at end of file
+    return apply_compact_schema(df)
+
+
+@dataclass(frozen=True)
+class PreparedOrders:
+    """
+    Item rows that have been through preprocess_raw_data exactly once.
+
+    The frame is shared read-only by every analyzer in a run. Analyzers take
+    the columns they need via `select` and build their working columns on
+    that selection, never on `frame` itself.
+    """
+    frame: pd.DataFrame
+    banned_item_terms: Tuple[str, ...]
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def select(self, columns: Sequence[str], rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Returns a frame with only `columns`, optionally restricted to the rows
+        where the boolean mask `rows` is set. Without a mask the columns are
+        views into the shared frame: add new columns freely, but do not write
+        into the selected ones.
+        """
+        selected = pd.DataFrame({name: self.frame[name] for name in columns}, copy=False)
+        if rows is None:
+            return selected
+        return selected.take(np.flatnonzero(rows))
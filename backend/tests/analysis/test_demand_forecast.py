@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.analysis.demand_forecast import (
+    FORECAST_METHODS, PROGRAM_TOTAL, exponential_smoothing, forecast_demand, seasonal_naive, weekly_seasonal
+)
+from app.core.analysis_config import AnalysisConfig
+
+WEEK_PATTERN = np.array([10.0, 20.0, 30.0, 40.0, 50.0, 60.0, 70.0])
+
+
+def daily_frame(series: dict, first_day: str = '2024-01-01') -> pd.DataFrame:
+    """Item x day performance rows from {item: daily units}"""
+    frames = [
+        pd.DataFrame({
+            'item_name': item,
+            'DateOnly': pd.date_range(first_day, periods=len(units), freq='D'),
+            'quantity': units
+        })
+        for item, units in series.items()
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+
+@pytest.fixture
+def weekly_series() -> np.ndarray:
+    return np.tile(WEEK_PATTERN, 12)
+
+
+def test_seasonal_naive_repeats_last_week(weekly_series):
+    forecast = seasonal_naive(weekly_series[None, :], horizon=14)
+    np.testing.assert_allclose(forecast[0], np.tile(WEEK_PATTERN, 2))
+
+
+def test_exponential_smoothing_keeps_a_constant_level():
+    forecast = exponential_smoothing(np.full((1, 30), 5.0), horizon=7, alpha=0.3)
+    np.testing.assert_allclose(forecast[0], np.full(7, 5.0))
+
+
+def test_weekly_seasonal_recovers_the_weekday_pattern(weekly_series):
+    forecast = weekly_seasonal(weekly_series[None, :], horizon=14, alpha=0.3, season_weeks=8)
+    np.testing.assert_allclose(forecast[0], np.tile(WEEK_PATTERN, 2))
+
+
+def test_forecast_picks_a_seasonal_method_for_weekly_demand(weekly_series):
+    config = AnalysisConfig()
+    forecast = forecast_demand(daily_frame({'Pizza': weekly_series, 'Fries': np.full(len(weekly_series), 5.0)}), config)
+
+    assert list(forecast.series) == ['Fries', 'Pizza', PROGRAM_TOTAL]
+    assert forecast.start_date == pd.Timestamp('2024-01-01') + pd.Timedelta(days=len(weekly_series))
+    assert forecast.daily.shape == (3, config.forecast_horizon_weeks * 7)
+
+    pizza = list(forecast.series).index('Pizza')
+    assert FORECAST_METHODS[forecast.method[pizza]] != 'exponential_smoothing'
+    assert forecast.holdout_mae[pizza, FORECAST_METHODS.index('seasonal_naive')] == 0
+    assert forecast.holdout_mae[pizza, FORECAST_METHODS.index('exponential_smoothing')] > 0
+    np.testing.assert_allclose(forecast.daily[pizza], np.tile(WEEK_PATTERN, config.forecast_horizon_weeks))
+
+    np.testing.assert_allclose(forecast.daily[-1], forecast.daily[:-1].sum(axis=0))
+    np.testing.assert_allclose(forecast.weekly()[:, 0], [35.0, WEEK_PATTERN.sum(), WEEK_PATTERN.sum() + 35.0])
+
+
+def test_short_history_falls_back_to_smoothing():
+    forecast = forecast_demand(daily_frame({'Pizza': np.full(10, 4.0)}), AnalysisConfig())
+
+    assert (forecast.method == FORECAST_METHODS.index('exponential_smoothing')).all()
+    assert np.isnan(forecast.holdout_mae).all()
+    np.testing.assert_allclose(forecast.daily, 4.0)
@@ -0,0 +1,62 @@
+from collections import Counter
+
+import numpy as np
+
+from app.analysis.heavy_hitters import PairHeavyHitters
+
+
+def zipf_batches(n_pairs: int, n_batches: int, batch_size: int, seed: int = 0):
+    """Exact pair counts of consecutive batches drawn from a skewed distribution."""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, n_pairs + 1)
+    for _ in range(n_batches):
+        draws = rng.choice(n_pairs, size=batch_size, p=weights / weights.sum())
+        yield Counter((f"item_{i}", f"item_{i + 1}") for i in draws.tolist())
+
+
+def test_exact_below_capacity():
+    sketch = PairHeavyHitters(capacity=10)
+    sketch.update({("a", "b"): 3, ("a", "c"): 1})
+    sketch.update({("a", "b"): 2})
+
+    assert dict(sketch.items()) == {("a", "b"): 5, ("a", "c"): 1}
+    assert sketch.error_bound == 0
+    assert sketch.total == 6
+
+
+def test_error_bounds_on_skewed_stream():
+    capacity = 20
+    sketch = PairHeavyHitters(capacity)
+    true_counts = Counter()
+    for batch in zipf_batches(n_pairs=300, n_batches=40, batch_size=500):
+        sketch.update(batch)
+        true_counts.update(batch)
+
+    assert len(sketch) <= capacity
+    assert sketch.total == sum(true_counts.values())
+    assert 0 < sketch.error_bound <= sketch.total / (capacity + 1)
+    for pair, count in true_counts.items():
+        # Never overcounts, undercounts by at most error_bound
+        assert sketch[pair] <= count <= sketch[pair] + sketch.error_bound
+        if count > sketch.error_bound:
+            assert sketch.get(pair, None) is not None
+
+
+def test_heaviest_pairs_rank_first():
+    sketch = PairHeavyHitters(capacity=20)
+    true_counts = Counter()
+    for batch in zipf_batches(n_pairs=300, n_batches=40, batch_size=500, seed=1):
+        sketch.update(batch)
+        true_counts.update(batch)
+
+    top_pairs = [pair for pair, _ in sketch.most_common(3)]
+    assert top_pairs == [pair for pair, _ in true_counts.most_common(3)]
+
+
+def test_negative_counts_retract_tracked_pairs():
+    sketch = PairHeavyHitters(capacity=10)
+    sketch.update({("a", "b"): 4, ("a", "c"): 1})
+    sketch.update({("a", "b"): -1, ("a", "c"): -1, ("x", "y"): -2})
+
+    assert dict(sketch.items()) == {("a", "b"): 3}
+    assert sketch.total == 1
@@ -0,0 +1,81 @@
+import copy
+from collections import Counter
+
+import pandas as pd
+import pytest
+
+from app.analysis.customer_analysis import CustomerAnalyzer
+from app.analysis.heavy_hitters import PairHeavyHitters
+from app.analysis.order_analysis import OrderAnalyzer
+from app.analysis.product_analysis import PRODUCT_COLUMNS, ProductAnalyzer
+from app.core.analysis_config import AnalysisConfig
+from app.utils.preprocessing import concat_preprocessed
+
+
+@pytest.fixture
+def batches(raw_orders, prepare):
+    """
+    Earlier and newly ingested rows; the new batch re-sends two earlier
+    invoices with other items, as the POS does when an order is edited.
+    """
+    resent = []
+    for order in (raw_orders[10], raw_orders[500]):
+        order = copy.deepcopy(order)
+        order['OrderItem'] = [{"name": "Fries", "price": 50.0, "quantity": 2, "total": 100.0}]
+        resent.append(order)
+    history_df = prepare(raw_orders[:900])
+    new_df = prepare(raw_orders[900:] + resent)
+    return history_df, new_df, concat_preprocessed([history_df, new_df])
+
+
+def sort_invoices(invoice_df: pd.DataFrame) -> pd.DataFrame:
+    return invoice_df.sort_values('invoice_no', kind='stable').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('use_sketch', [False, True])
+def test_order_fold_matches_full_rebuild(batches, use_sketch):
+    history_df, new_df, full_df = batches
+    analyzer = OrderAnalyzer()
+    # A sketch with room for every pair is exact, so both kinds must match the rebuild
+    config = AnalysisConfig(pair_sketch_min_distinct_items=0 if use_sketch else 2_000, pair_sketch_capacity=10_000)
+
+    invoice_df, pair_counts, item_counts, item_invoice_counts = analyzer.fold_new_orders(
+        history_df=history_df,
+        new_df=new_df,
+        invoice_df=analyzer.compute_invoice_aggregation(history_df),
+        pair_counter=analyzer.build_pair_counts(history_df, config),
+        item_counter=analyzer.count_items(history_df),
+        item_invoice_counter=analyzer.count_item_invoices(history_df),
+        config=config
+    )
+
+    pd.testing.assert_frame_equal(sort_invoices(invoice_df), sort_invoices(analyzer.compute_invoice_aggregation(full_df)))
+    assert isinstance(pair_counts, PairHeavyHitters) == use_sketch
+    assert Counter(dict(pair_counts.items())) == analyzer.count_item_pairs(full_df)
+    assert item_counts == analyzer.count_items(full_df)
+    assert item_invoice_counts == analyzer.count_item_invoices(full_df)
+
+
+def test_item_slot_fold_matches_full_rebuild(batches):
+    history_df, new_df, full_df = batches
+    analyzer = ProductAnalyzer(AnalysisConfig())
+
+    item_slots = analyzer.fold_new_orders(
+        history_df[PRODUCT_COLUMNS], new_df[PRODUCT_COLUMNS], analyzer.compute_item_slots(history_df[PRODUCT_COLUMNS])
+    )
+
+    pd.testing.assert_frame_equal(item_slots, analyzer.compute_item_slots(full_df[PRODUCT_COLUMNS]))
+
+
+def test_customer_fold_matches_full_rebuild(batches):
+    history_df, new_df, full_df = batches
+    analyzer = CustomerAnalyzer()
+    customer_stats, name_counts = analyzer.compute_customer_stats(analyzer.prepare_customer_data(history_df))
+
+    customer_stats, name_counts = analyzer.fold_new_orders(
+        history_df=history_df, new_df=new_df, customer_stats=customer_stats, name_counts=name_counts
+    )
+
+    full_stats, full_name_counts = analyzer.compute_customer_stats(analyzer.prepare_customer_data(full_df))
+    pd.testing.assert_frame_equal(customer_stats, full_stats)
+    pd.testing.assert_series_equal(name_counts.sort_index(), full_name_counts.sort_index())
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.analysis.order_analysis import OrderAnalyzer
+from app.analysis.product_analysis import PRODUCT_COLUMNS, ProductAnalyzer
+from app.analysis.traffic_cube import HOURS, TrafficCube, build_traffic_cube
+from app.core.analysis_config import AnalysisConfig
+from app.utils.preprocessing import WEEKDAY_NAMES
+
+
+def grid(values: pd.Series) -> np.ndarray:
+    """(weekday, hour) array from a Series indexed by (weekday, hour)"""
+    cells = pd.MultiIndex.from_product([range(len(WEEKDAY_NAMES)), range(HOURS)])
+    return values.reindex(cells, fill_value=0).to_numpy(np.float64).reshape(len(WEEKDAY_NAMES), HOURS)
+
+
+@pytest.fixture
+def cube_inputs(orders_df):
+    analyzer = OrderAnalyzer()
+    invoice_df = analyzer.compute_invoice_aggregation(orders_df)
+    item_slots = ProductAnalyzer(AnalysisConfig()).compute_item_slots(orders_df[PRODUCT_COLUMNS])
+    items = analyzer.rank_items(analyzer.count_items(orders_df)).index[:3]
+    return invoice_df, item_slots, items
+
+
+def test_totals_match_invoice_groupby(cube_inputs):
+    invoice_df, item_slots, items = cube_inputs
+    cube = build_traffic_cube(invoice_df, item_slots, items)
+
+    by_slot = invoice_df.groupby([invoice_df['order_date'].dt.dayofweek, invoice_df['order_date'].dt.hour])
+    np.testing.assert_allclose(cube.metric('invoices'), grid(by_slot.size()))
+    np.testing.assert_allclose(cube.metric('revenue'), grid(by_slot['net_invoice_value'].sum()))
+    np.testing.assert_allclose(cube.metric('quantity'), grid(by_slot['total_quantity'].sum()))
+
+    weekdays = invoice_df['order_date'].dt.dayofweek
+    np.testing.assert_allclose(cube.by_weekday(), weekdays.value_counts().reindex(range(7), fill_value=0))
+    hourly_revenue = invoice_df.groupby(invoice_df['order_date'].dt.hour)['net_invoice_value'].sum()
+    np.testing.assert_allclose(cube.by_hour('revenue'), hourly_revenue.reindex(range(HOURS), fill_value=0))
+
+
+def test_item_slices_match_row_groupby(orders_df, cube_inputs):
+    invoice_df, item_slots, items = cube_inputs
+    cube = build_traffic_cube(invoice_df, item_slots, items)
+
+    for item in items:
+        rows = orders_df[orders_df['item_name'] == item]
+        by_slot = rows.groupby([rows['date'].dt.dayofweek, rows['date'].dt.hour])
+        np.testing.assert_allclose(cube.metric('invoices', item), grid(by_slot['invoice_no'].nunique()))
+        np.testing.assert_allclose(cube.metric('quantity', item), grid(by_slot['item_quantity'].sum()))
+
+    assert not cube.metric('quantity', 'Not On The Menu').any()
+
+
+def test_array_round_trip(cube_inputs):
+    cube = build_traffic_cube(*cube_inputs)
+    restored = TrafficCube.from_arrays(cube.to_arrays())
+
+    np.testing.assert_array_equal(restored.totals, cube.totals)
+    np.testing.assert_array_equal(restored.by_item, cube.by_item)
+    assert list(restored.items) == list(cube.items)
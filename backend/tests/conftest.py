@@ -0,0 +1,69 @@
+import json
+import os
+import random
+from typing import Any, Callable, Dict, List
+
+import pandas as pd
+import pytest
+
+# app.core.config validates these at import time; the analysis code under test never uses them
+for _name in (
+    "DATABASE_USER", "DATABASE_PASSWORD", "DATABASE_HOST", "DATABASE_NAME", "REDIS_URL",
+    "AWS_ACCESS_KEY", "AWS_SECRET_ACCESS_KEY", "AWS_REGION",
+    "OPENAI_API_KEY", "PERPLEXITY_API_KEY", "GOOGLE_API_KEY", "LOGFIRE_TOKEN", "LOGFIRE_ENVIRONMENT"
+):
+    os.environ.setdefault(_name, "test")
+os.environ.setdefault("DATABASE_PORT", "5432")
+
+from app.utils.data_transformer import decode_orders_to_dataframe  # noqa: E402
+from app.utils.preprocessing import preprocess_raw_data  # noqa: E402
+
+MENU = ["Cold Coffee", "Veg Burger", "Fries", "Paneer Wrap", "Masala Chai", "Brownie", "Pasta", "Pizza"]
+
+
+def make_order(order_id: int, rng: random.Random) -> Dict[str, Any]:
+    """One POS order blob with 1-4 items, spread over a year, days and hours."""
+    month, day, hour = rng.randint(1, 12), rng.randint(1, 28), rng.randint(8, 23)
+    items = []
+    for name in rng.sample(MENU, rng.randint(1, 4)):
+        price, quantity = rng.choice([50.0, 99.0, 120.5]), rng.randint(1, 3)
+        items.append({"name": name, "price": price, "quantity": quantity, "total": price * quantity})
+    return {
+        "Restaurant": {"res_name": "Cafe"},
+        "Customer": {"name": rng.choice(["Asha", "Ravi"]), "phone": str(9000000000 + rng.randint(0, 60))},
+        "Order": {
+            "orderID": order_id,
+            "created_on": f"2024-{month:02d}-{day:02d} {hour:02d}: {rng.randint(0, 59):02d}: 00",
+            "payment_type": rng.choice(["Cash", "Card"]),
+            "order_type": rng.choice(["Dine In", "Pick Up"]),
+            "no_of_persons": 2,
+            "tax_total": 5.5,
+            "discount_total": rng.choice([0, 10]),
+            "delivery_charges": 0,
+            "round_off": 0.2,
+            "total": sum(item["total"] for item in items),
+            "core_total": 90
+        },
+        "OrderItem": items
+    }
+
+
+def prepare_orders(orders: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Runs order blobs through the same decode and preprocess steps as the pipeline."""
+    return preprocess_raw_data(decode_orders_to_dataframe([json.dumps(order) for order in orders]))
+
+
+@pytest.fixture
+def raw_orders() -> List[Dict[str, Any]]:
+    rng = random.Random(0)
+    return [make_order(order_id, rng) for order_id in range(1, 1201)]
+
+
+@pytest.fixture
+def prepare() -> Callable[[List[Dict[str, Any]]], pd.DataFrame]:
+    return prepare_orders
+
+
+@pytest.fixture
+def orders_df(raw_orders, prepare) -> pd.DataFrame:
+    return prepare(raw_orders)
@@ -0,0 +1,72 @@
+import os
+
+import pandas as pd
+import pytest
+
+from app.utils.order_snapshot_cache import MANIFEST_NAME, OrderSnapshotCache
+
+
+def snapshot_bytes(cache: OrderSnapshotCache, loyalty_program_id: int, watermark: int) -> int:
+    return sum(p.stat().st_size for p in cache._snapshot_dir(loyalty_program_id, watermark).iterdir())
+
+
+@pytest.fixture
+def cache(tmp_path) -> OrderSnapshotCache:
+    return OrderSnapshotCache(tmp_path, max_bytes=1024 ** 3)
+
+
+def test_round_trip(cache, orders_df):
+    cache.store(1, 1200, orders_df)
+    # Columns come back memory-mapped; a deep copy compares them as plain arrays
+    loaded = cache.load(1, 1200).copy(deep=True)
+
+    pd.testing.assert_frame_equal(loaded, orders_df.reset_index(drop=True))
+    assert cache.load(1, 1199) is None
+    assert cache.load(2, 1200) is None
+
+
+def test_round_trip_keeps_missing_object_values(cache):
+    df = pd.DataFrame({'invoice_no': ['1', None, '2', '1'], 'amount': [1.0, 2.0, float('nan'), 4.0]})
+    cache.store(1, 4, df)
+
+    pd.testing.assert_frame_equal(cache.load(1, 4), df)
+
+
+def test_newer_watermark_replaces_older(cache, orders_df):
+    cache.store(1, 600, orders_df.iloc[:600])
+    cache.store(1, 1200, orders_df)
+
+    assert cache.load(1, 600) is None
+    assert cache.load(1, 1200) is not None
+    assert [path.name for path in cache._program_dir(1).iterdir()] == ['upto_1200']
+
+
+def test_evicts_least_recently_used(tmp_path, orders_df):
+    cache = OrderSnapshotCache(tmp_path, max_bytes=1024 ** 3)
+    cache.store(1, 1200, orders_df)
+    cache.store(2, 1200, orders_df)
+    # Room for two snapshots: storing a third evicts the one read least recently
+    cache.max_bytes = 2 * snapshot_bytes(cache, 1, 1200) + 1
+    os.utime(cache._snapshot_dir(1, 1200) / MANIFEST_NAME, (0, 0))
+    os.utime(cache._snapshot_dir(2, 1200) / MANIFEST_NAME, (1, 1))
+    assert cache.load(1, 1200) is not None
+
+    cache.store(3, 1200, orders_df)
+
+    assert cache.load(2, 1200) is None
+    assert cache.load(1, 1200) is not None
+    assert cache.load(3, 1200) is not None
+
+
+def test_keeps_the_snapshot_just_stored(tmp_path, orders_df):
+    cache = OrderSnapshotCache(tmp_path, max_bytes=1)
+    cache.store(1, 1200, orders_df)
+
+    assert cache.load(1, 1200) is not None
+
+
+def test_invalidate(cache, orders_df):
+    cache.store(1, 1200, orders_df)
+    cache.invalidate(1)
+
+    assert cache.load(1, 1200) is None